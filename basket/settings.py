@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+from datetime import timedelta
 import os
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -31,6 +32,8 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    # Antes que staticfiles: su runserver sirve también los websockets (ASGI)
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -46,6 +49,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primero, para que el total incluya al resto de middlewares
+    'basketconecta.instrumentacion.MedicionMiddleware',
+    'basketconecta.metricas.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -110,6 +116,93 @@ DJOSER = {
         'user': ['rest_framework.permissions.AllowAny'],  # ← esta es la clave correcta
     }
 }
+# Geocodificación de direcciones (ver basketconecta/geocoding.py)
+GEOCODIFICACION_TTL = timedelta(days=30)
+GEOCODIFICACION_TTL_NEGATIVO = timedelta(days=1)
+GEOCODIFICACION_TAMANO_LRU = 2048
+# 'sincrono', 'hilos' o 'cola' (ver basketconecta/cola_geocodificacion.py)
+GEOCODIFICACION_MODO = 'sincrono'
+GEOCODIFICACION_HILOS = 1
+# En modo 'sincrono', reintentos de las filas que quedaron pendientes porque el
+# geocodificador falló (el primero pasado GEOCODIFICACION_ENFRIAMIENTO, luego el doble
+# cada vez). Como respaldo, programar `manage.py geocodificar_pendientes` en un cron.
+GEOCODIFICACION_REINTENTOS = 5
+# Segundos mínimos entre peticiones al geocodificador (Nominatim pide 1/s)
+GEOCODIFICACION_INTERVALO_MINIMO = 1.0
+# Segundos máximos por petición y circuit breaker de los backends remotos
+GEOCODIFICACION_TIMEOUT = 3
+GEOCODIFICACION_UMBRAL_FALLOS = 5
+GEOCODIFICACION_ENFRIAMIENTO = 30
+# Backends en orden de consulta. Para trabajar sin red, añadir
+# 'basketconecta.geocoding.GeocodificadorLocal' y apuntar GEOCODIFICACION_GAZETTEER
+# a un TSV con columnas nombre, latitud, longitud.
+GEOCODIFICACION_BACKENDS = [
+    'basketconecta.geocoding.GeocodificadorNominatim',
+]
+GEOCODIFICACION_GAZETTEER = None
+
+# Emparejamiento jugador-equipo (ver basketconecta/emparejamiento.py)
+EMPAREJAMIENTO_PESOS = {'disponibilidad': 0.45, 'nivel': 0.2, 'distancia': 0.35}
+EMPAREJAMIENTO_ESCALA_KM = 10
+# Radio (km) de las parejas que se guardan en la tabla Emparejamiento
+EMPAREJAMIENTO_RADIO_KM = 30
+
+# Caché de Django. La rejilla del mapa (ver basketconecta/mapa.py) se invalida
+# subiendo una clave de versión en esta caché; la de memoria es propia de cada
+# proceso, así que con varios workers cada uno puede servir su rejilla antigua
+# hasta MAPA_CACHE_TIMEOUT segundos. En producción con varios procesos hay que
+# usar una compartida, p. ej. 'django.core.cache.backends.redis.RedisCache'.
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+# Mapa de anuncios (ver basketconecta/mapa.py)
+MAPA_ZOOM_PUNTOS = 14
+MAPA_MAX_PUNTOS = 500
+MAPA_CACHE_TIMEOUT = 600
+
+ASGI_APPLICATION = 'basket.asgi.application'
+
+# Capa de canales de los websockets de chat (ver basketconecta/tiempo_real.py).
+# La de memoria solo reparte dentro de un proceso; con varios procesos hace
+# falta una compartida, p. ej. 'channels_redis.core.RedisChannelLayer'.
+CHANNEL_LAYERS = {
+    'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+}
+
+# Flujo SSE de notificaciones (ver basketconecta/flujo_notificaciones.py):
+# eventos en cola por conexión antes de expulsarla y segundos entre latidos
+NOTIFICACIONES_FLUJO_COLA = 100
+NOTIFICACIONES_FLUJO_LATIDO = 15
+
+# Paginación por cursor de mensajes y notificaciones (ver basketconecta/pagination.py)
+PAGINACION_CURSOR_LIMITE = 50
+PAGINACION_CURSOR_LIMITE_MAXIMO = 200
+
+# Instrumentación por petición: cabecera Server-Timing y log estructurado
+# (ver basketconecta/instrumentacion.py)
+INSTRUMENTACION_ACTIVA = False
+# Peticiones lentas: umbral, fracción que se registra y consultas que se listan
+INSTRUMENTACION_UMBRAL_LENTO_MS = 500
+INSTRUMENTACION_MUESTREO_LENTAS = 1.0
+INSTRUMENTACION_CONSULTAS_LENTAS = 5
+
+# Métricas Prometheus en /metrics (ver basketconecta/metricas.py). /metrics pide
+# 'Authorization: Bearer <METRICAS_TOKEN>'; sin token solo responde con DEBUG
+METRICAS_ACTIVAS = True
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'consola': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'basketconecta.instrumentacion': {'handlers': ['consola'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -19,12 +19,15 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from basketconecta.metricas import vista_metricas
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/auth/', include('djoser.urls')),
     path('api/auth/', include('djoser.urls.authtoken')),
     path('api/auth/', include('djoser.urls.jwt')),
     path('api/', include('basketconecta.urls')),
+    path('metrics', vista_metricas, name='metricas'),
 ]
 
 if settings.DEBUG:
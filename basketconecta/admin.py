@@ -1,7 +1,9 @@
 from django.contrib import admin
 
 from django.contrib import admin
-from .models import Jugador
+from .models import Jugador, GeocodificacionCache, Emparejamiento
 
 admin.site.register(Jugador)
+admin.site.register(GeocodificacionCache)
+admin.site.register(Emparejamiento)
 # Register your models here.
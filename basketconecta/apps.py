@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class BasketconectaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'basketconecta'
+
+    def ready(self):
+        # Registra las señales que mantienen datos derivados (tabla de
+        # emparejamientos, rejilla del mapa y último mensaje de cada chat),
+        # las que alimentan las métricas y las que difunden los mensajes y
+        # notificaciones nuevos
+        from . import chats, emparejamiento, flujo_notificaciones, mapa, metricas, tiempo_real  # noqa: F401
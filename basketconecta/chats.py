@@ -0,0 +1,181 @@
+from django.db.models import CharField, Count, F, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+
+def chats_de(usuario):
+    """Chats privados en los que participa el usuario, como jugador o como creador del equipo."""
+    from .models import Chat
+
+    return Chat.objects.filter(Q(jugador__user=usuario) | Q(equipo__creador=usuario))
+
+
+def chats_equipo_de(usuario):
+    """Chats grupales de los equipos que el usuario ha creado o en los que juega."""
+    from .models import ChatEquipo, Equipo
+
+    equipos = Equipo.objects.filter(Q(creador=usuario) | Q(jugadores__user=usuario)).values('id')
+    return ChatEquipo.objects.filter(equipo__in=equipos)
+
+
+def ultimos_ids():
+    """Ids más altos de Mensaje y MensajeChatEquipo: desde dónde empezar a sondear."""
+    from .models import Mensaje, MensajeChatEquipo
+
+    return (
+        Mensaje.objects.order_by('-id').values_list('id', flat=True).first() or 0,
+        MensajeChatEquipo.objects.order_by('-id').values_list('id', flat=True).first() or 0,
+    )
+
+
+def novedades(usuario, despues_de, despues_de_equipo):
+    """
+    Chats del usuario con mensajes posteriores a los ids dados, con cuántos
+    hay y el último: `{'chats': [...], 'chats_equipo': [...]}`. Una sola
+    consulta (UNION de dos GROUP BY) que recorre el índice de la clave
+    primaria desde los ids, así que cuesta según el tráfico nuevo y no según
+    el tamaño del historial.
+    """
+    from .models import Mensaje, MensajeChatEquipo
+
+    def nuevos(mensajes, desde, chats, tipo):
+        return (
+            mensajes.objects
+            .filter(id__gt=desde, chat__in=chats.values('id'))
+            .order_by()
+            .values('chat')
+            .annotate(tipo=Value(tipo, output_field=CharField()), nuevos=Count('id'), ultimo=Max('id'))
+        )
+
+    filas = nuevos(Mensaje, despues_de, chats_de(usuario), 'chats').union(
+        nuevos(MensajeChatEquipo, despues_de_equipo, chats_equipo_de(usuario), 'chats_equipo'),
+        all=True,
+    )
+    resultado = {'chats': [], 'chats_equipo': []}
+    for fila in filas:
+        resultado[fila['tipo']].append({'chat': fila['chat'], 'nuevos': fila['nuevos'], 'ultimo': fila['ultimo']})
+    return resultado
+
+
+def bandeja(chats, usuario):
+    """
+    Chats ordenados por última actividad, con `no_leidos`: mensajes de los
+    demás posteriores al cursor de lectura del usuario. Cada recuento es una
+    subconsulta sobre el índice (chat, id) de Mensaje.
+    """
+    from .models import LecturaChat, Mensaje
+
+    cursor = LecturaChat.objects.filter(chat=OuterRef('pk'), usuario=usuario).values('ultimo_leido')[:1]
+    no_leidos = (
+        Mensaje.objects
+        .filter(chat=OuterRef('pk'), id__gt=OuterRef('leido_hasta'))
+        .exclude(emisor=usuario)
+        .order_by()
+        .values('chat')
+        .annotate(n=Count('id'))
+        .values('n')
+    )
+    return (
+        chats
+        .annotate(leido_hasta=Coalesce(Subquery(cursor), 0))
+        .annotate(no_leidos=Coalesce(Subquery(no_leidos), 0))
+        .order_by(F('ultima_actividad').desc(nulls_last=True), '-id')
+    )
+
+
+def marcar_leido(chat, usuario, mensaje_id=None):
+    """
+    Avanza el cursor de lectura del usuario hasta `mensaje_id` (por defecto,
+    el último mensaje del chat). Un solo UPDATE; el cursor nunca retrocede.
+    """
+    from .models import LecturaChat
+
+    ultimo = chat.ultimo_mensaje_id or 0
+    # Nunca más allá del último mensaje: el cursor no retrocede y dejaría sin contar los siguientes
+    hasta = ultimo if mensaje_id is None else max(0, min(mensaje_id, ultimo))
+    actualizadas = LecturaChat.objects.filter(chat=chat, usuario=usuario).update(
+        ultimo_leido=Greatest(F('ultimo_leido'), hasta)
+    )
+    if not actualizadas:
+        LecturaChat.objects.get_or_create(chat=chat, usuario=usuario, defaults={'ultimo_leido': hasta})
+    return hasta
+
+
+def actualizar_ultimo_mensaje(chat_id):
+    """Recalcula el último mensaje y la última actividad de un chat."""
+    from .models import Chat, Mensaje
+
+    ultimo = Mensaje.objects.filter(chat_id=chat_id).order_by('-timestamp', '-id').first()
+    chat = Chat.objects.filter(pk=chat_id)
+    if ultimo is None:
+        chat.update(ultimo_mensaje=None, ultima_actividad=None)
+    else:
+        chat.update(ultimo_mensaje=ultimo, ultima_actividad=ultimo.timestamp)
+
+
+@receiver(post_save, sender='basketconecta.Mensaje')
+def _mensaje_guardado(sender, instance, created, **kwargs):
+    if not created:
+        return
+    from .models import Chat
+
+    # Un solo UPDATE; la condición evita que un mensaje anterior que llega tarde pise al último
+    Chat.objects.filter(pk=instance.chat_id).filter(
+        Q(ultima_actividad__isnull=True) | Q(ultima_actividad__lte=instance.timestamp)
+    ).update(ultimo_mensaje=instance, ultima_actividad=instance.timestamp)
+
+
+def _borrado(origin):
+    """
+    Estado que comparten las señales de un mismo delete(), guardado en su
+    `origin` (la instancia o el queryset que se borra): chats cuyo último
+    mensaje hay que revisar y chats que se borran en la misma operación.
+    """
+    estado = getattr(origin, '_borrado_chats', None)
+    if estado is None:
+        estado = {'por_revisar': set(), 'borrandose': set()}
+        if origin is not None:
+            origin._borrado_chats = estado
+    return estado
+
+
+@receiver(pre_delete, sender='basketconecta.Chat')
+def _chat_borrandose(sender, instance, origin=None, **kwargs):
+    _borrado(origin)['borrandose'].add(instance.pk)
+
+
+@receiver(pre_delete, sender='basketconecta.Mensaje')
+def _mensaje_borrandose(sender, instance, origin=None, **kwargs):
+    _borrado(origin)['por_revisar'].add(instance.chat_id)
+
+
+@receiver(post_delete, sender='basketconecta.Mensaje')
+def _mensaje_borrado(sender, instance, origin=None, **kwargs):
+    # Cuando llega la primera señal ya están borrados todos los mensajes del
+    # delete(): cada chat se revisa una vez y los que se borran con ellos
+    # (al borrar el chat, su jugador, su equipo o un usuario) ni eso
+    from .models import Chat
+
+    estado = _borrado(origin)
+    if origin is not None and instance.chat_id not in estado['por_revisar']:
+        return
+    estado['por_revisar'].discard(instance.chat_id)
+    if instance.chat_id in estado['borrandose']:
+        return
+    if Chat.objects.filter(pk=instance.chat_id, ultimo_mensaje__isnull=True).exists():
+        actualizar_ultimo_mensaje(instance.chat_id)
+
+
+@receiver(post_save, sender='basketconecta.Chat')
+def _chat_creado(sender, instance, created, **kwargs):
+    # Un cursor por participante desde el principio: marcar como leído es siempre un UPDATE
+    if not created:
+        return
+    from .models import LecturaChat
+
+    participantes = {instance.jugador.user_id, instance.equipo.creador_id}
+    LecturaChat.objects.bulk_create(
+        [LecturaChat(chat=instance, usuario_id=usuario_id) for usuario_id in participantes],
+        ignore_conflicts=True,
+    )
@@ -0,0 +1,189 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, transaction
+from django.dispatch import Signal
+
+from . import geocoding
+
+
+logger = logging.getLogger(__name__)
+
+PENDIENTE = 'pendiente'
+RESUELTA = 'resuelta'
+FALLIDA = 'fallida'
+
+ESTADOS = [
+    (RESUELTA, 'Resuelta'),
+    (PENDIENTE, 'Pendiente'),
+    (FALLIDA, 'Fallida'),
+]
+
+# Modos de GEOCODIFICACION_MODO:
+#   'sincrono': se geocodifica dentro de save(), como siempre; si el geocodificador
+#               falla la fila queda pendiente y se reintenta en un hilo más tarde
+#   'hilos':    save() deja la fila pendiente y un hilo de este proceso la resuelve
+#   'cola':     save() deja la fila pendiente y la resuelve `manage.py geocodificar_pendientes`
+SINCRONO = 'sincrono'
+HILOS = 'hilos'
+COLA = 'cola'
+
+MODELOS = ['basketconecta.Jugador', 'basketconecta.AnuncioEquipo']
+
+# Se envía (sender=modelo, pk=...) cuando una fila pendiente recibe sus coordenadas.
+# procesar_fila() usa update(), así que no hay post_save.
+fila_geocodificada = Signal()
+
+
+def modo():
+    return getattr(settings, 'GEOCODIFICACION_MODO', SINCRONO)
+
+
+def es_diferida():
+    return modo() != SINCRONO
+
+
+class EstadoGeocodificacionMixin:
+    """
+    Lleva `estado_geocodificacion` al guardar un modelo con direcciones y
+    encola las filas que quedan pendientes. El modelo define
+    `CAMPOS_GEOCODIFICACION`, `geocodificar()`, `direcciones()` y los ganchos
+    `_faltan_coordenadas()` y `_tiene_coordenadas()`.
+    """
+
+    def save(self, *args, **kwargs):
+        self._preparar_geocodificacion()
+        super().save(*args, **kwargs)
+        if self.estado_geocodificacion == PENDIENTE:
+            encolar(self)
+
+    def _preparar_geocodificacion(self):
+        if self._faltan_coordenadas():
+            if es_diferida() or self.estado_geocodificacion == PENDIENTE:
+                # Se guarda ya y las coordenadas llegan en segundo plano. Si ya
+                # estaba pendiente (p. ej. el serializador no pudo validarla
+                # con el geocodificador caído) no se reintenta aquí
+                self.estado_geocodificacion = PENDIENTE
+            else:
+                self.geocodificar()
+        elif self._tiene_coordenadas():
+            # Coordenadas nuevas (validadas en el serializador) resuelven una fila pendiente
+            self.estado_geocodificacion = RESUELTA
+
+
+class LimitadorFrecuencia:
+    """Deja pasar como mucho una llamada cada `intervalo` segundos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._siguiente = 0.0
+
+    def esperar(self):
+        intervalo = getattr(settings, 'GEOCODIFICACION_INTERVALO_MINIMO', 1.0)
+        with self._lock:
+            ahora = time.monotonic()
+            espera = self._siguiente - ahora
+            self._siguiente = max(ahora, self._siguiente) + intervalo
+        if espera > 0:
+            time.sleep(espera)
+
+
+_limitador = LimitadorFrecuencia()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'GEOCODIFICACION_HILOS', 1),
+                thread_name_prefix='geocodificacion',
+            )
+        return _executor
+
+
+def encolar(instancia):
+    """
+    Programa la geocodificación de una fila pendiente. En modo 'hilos' se
+    lanza al confirmar la transacción; en modo 'sincrono' la fila solo queda
+    pendiente si el geocodificador falló, así que se reintenta pasado el
+    enfriamiento del circuito; en modo 'cola' la fila espera a que se
+    ejecute el comando.
+    """
+    etiqueta = instancia._meta.label
+    pk = instancia.pk
+    if modo() == HILOS:
+        transaction.on_commit(lambda: _get_executor().submit(_procesar_en_hilo, etiqueta, pk))
+    elif modo() == SINCRONO:
+        transaction.on_commit(lambda: _programar_reintento(etiqueta, pk, 0))
+
+
+def _programar_reintento(etiqueta, pk, intento):
+    # Los temporizadores viven en memoria: si el proceso se reinicia, las filas
+    # que queden pendientes las recoge `manage.py geocodificar_pendientes`
+    if intento >= getattr(settings, 'GEOCODIFICACION_REINTENTOS', 5):
+        logger.warning("%s %s sigue pendiente tras %s reintentos", etiqueta, pk, intento)
+        return
+    espera = getattr(settings, 'GEOCODIFICACION_ENFRIAMIENTO', 30) * 2 ** intento
+    temporizador = threading.Timer(espera, _lanzar_reintento, (etiqueta, pk, intento))
+    temporizador.daemon = True
+    temporizador.start()
+
+
+def _lanzar_reintento(etiqueta, pk, intento):
+    _get_executor().submit(_reintentar, etiqueta, pk, intento)
+
+
+def _reintentar(etiqueta, pk, intento):
+    if _procesar_en_hilo(etiqueta, pk) == PENDIENTE:
+        _programar_reintento(etiqueta, pk, intento + 1)
+
+
+def _procesar_en_hilo(etiqueta, pk):
+    try:
+        return procesar_fila(apps.get_model(etiqueta), pk)
+    except Exception:
+        logger.exception("Error geocodificando %s %s", etiqueta, pk)
+    finally:
+        connections.close_all()
+
+
+def procesar_fila(modelo, pk):
+    """
+    Resuelve las direcciones de una fila pendiente. Devuelve el estado final
+    o None si la fila ya no estaba pendiente.
+    """
+    instancia = modelo.objects.filter(pk=pk, estado_geocodificacion=PENDIENTE).first()
+    if instancia is None:
+        return None
+    # Solo se espera antes de las llamadas que salen al geocodificador remoto
+    with geocoding.antes_de_consultar(_limitador.esperar):
+        instancia.geocodificar()
+    campos = {campo: getattr(instancia, campo) for campo in modelo.CAMPOS_GEOCODIFICACION}
+    # update() en vez de save(): no vuelve a pasar por la lógica de geocodificación,
+    # y si la dirección cambió mientras tanto la fila sigue pendiente
+    actualizadas = modelo.objects.filter(pk=pk, estado_geocodificacion=PENDIENTE, **instancia.direcciones()).update(**campos)
+    # Con el geocodificador caído la fila sigue pendiente: no hay coordenadas nuevas que avisar
+    if actualizadas and instancia.estado_geocodificacion != PENDIENTE:
+        fila_geocodificada.send(sender=modelo, pk=pk)
+    return instancia.estado_geocodificacion
+
+
+def procesar_pendientes(limite=None):
+    """Drena la cola de filas pendientes. Devuelve cuántas se han procesado."""
+    procesadas = 0
+    for etiqueta in MODELOS:
+        modelo = apps.get_model(etiqueta)
+        pendientes = modelo.objects.filter(estado_geocodificacion=PENDIENTE).order_by('pk').values_list('pk', flat=True)
+        for pk in list(pendientes):
+            if limite is not None and procesadas >= limite:
+                return procesadas
+            if procesar_fila(modelo, pk) is not None:
+                procesadas += 1
+    return procesadas
@@ -0,0 +1,63 @@
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from . import chats, tiempo_real
+
+
+# Códigos de cierre propios (4000-4999): sin token válido y sin acceso a la sala
+NO_AUTENTICADO = 4401
+SIN_PERMISO = 4403
+
+
+class SalaConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Conexión a una sala de chat. Solo recibe: cada mensaje nuevo de la sala
+    llega como `{"tipo": "mensaje", "mensaje": {...}}` con el mismo formato
+    que la API REST, por donde se siguen enviando los mensajes.
+    """
+
+    def chats_del_usuario(self, usuario):
+        raise NotImplementedError
+
+    def grupo(self, chat_id):
+        raise NotImplementedError
+
+    @database_sync_to_async
+    def puede_entrar(self, usuario, chat_id):
+        return self.chats_del_usuario(usuario).filter(id=chat_id).exists()
+
+    async def connect(self):
+        usuario = self.scope['user']
+        if not usuario.is_authenticated:
+            await self.close(code=NO_AUTENTICADO)
+            return
+        chat_id = self.scope['url_route']['kwargs']['chat_id']
+        if not await self.puede_entrar(usuario, chat_id):
+            await self.close(code=SIN_PERMISO)
+            return
+        self.sala = self.grupo(chat_id)
+        await self.channel_layer.group_add(self.sala, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, 'sala'):
+            await self.channel_layer.group_discard(self.sala, self.channel_name)
+
+    async def mensaje_nuevo(self, evento):
+        await self.send_json({'tipo': 'mensaje', 'mensaje': evento['mensaje']})
+
+
+class ChatConsumer(SalaConsumer):
+    def chats_del_usuario(self, usuario):
+        return chats.chats_de(usuario)
+
+    def grupo(self, chat_id):
+        return tiempo_real.grupo_chat(chat_id)
+
+
+class ChatEquipoConsumer(SalaConsumer):
+    def chats_del_usuario(self, usuario):
+        return chats.chats_equipo_de(usuario)
+
+    def grupo(self, chat_id):
+        return tiempo_real.grupo_chat_equipo(chat_id)
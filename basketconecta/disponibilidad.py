@@ -0,0 +1,98 @@
+from django.db import models
+from django.db.models import Lookup
+
+
+# Disponibilidad semanal como máscara de 14 bits: para cada día, un bit de
+# mañana y otro de tarde (bit 2*día y 2*día + 1). Dos disponibilidades son
+# compatibles si comparten algún bit: un solo AND.
+DIAS = ['lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo']
+FRANJAS = ['manana', 'tarde']
+
+TODA_LA_SEMANA = (1 << (len(DIAS) * len(FRANJAS))) - 1
+MANANAS = sum(1 << (2 * i) for i in range(len(DIAS)))
+TARDES = MANANAS << 1
+
+
+def bit(dia, franja):
+    return 1 << (2 * DIAS.index(dia) + FRANJAS.index(franja))
+
+
+def desde_opciones(dia, horario):
+    """
+    Máscara equivalente a los antiguos campos de día y horario, donde
+    'indiferente' (y 'todo_dia' en el horario) valen por todos.
+    """
+    if not dia or not horario:
+        return 0
+    dias = DIAS if dia == 'indiferente' else [dia]
+    franjas = FRANJAS if horario in ('todo_dia', 'indiferente') else [horario]
+    return sum(bit(d, f) for d in dias for f in franjas)
+
+
+def a_opciones(mascara):
+    """
+    Resumen de una máscara en los antiguos campos `(dia, horario)`: el día si
+    solo hay uno, si no 'indiferente'; y la franja si solo hay una.
+    """
+    if not mascara:
+        return None, None
+    dias = [d for i, d in enumerate(DIAS) if mascara & (3 << (2 * i))]
+    dia = dias[0] if len(dias) == 1 else 'indiferente'
+    if mascara == TODA_LA_SEMANA:
+        horario = 'indiferente'
+    elif not mascara & TARDES:
+        horario = 'manana'
+    elif not mascara & MANANAS:
+        horario = 'tarde'
+    else:
+        horario = 'todo_dia'
+    return dia, horario
+
+
+def a_lista(mascara):
+    """Franjas de la máscara como `['sabado_manana', ...]`."""
+    return [f'{d}_{f}' for d in DIAS for f in FRANJAS if mascara & bit(d, f)]
+
+
+def desde_lista(franjas):
+    """Inversa de a_lista. Lanza ValueError con franjas desconocidas."""
+    mascara = 0
+    for franja in franjas:
+        dia, _, momento = franja.rpartition('_')
+        if dia not in DIAS or momento not in FRANJAS:
+            raise ValueError(franja)
+        mascara |= bit(dia, momento)
+    return mascara
+
+
+def sincronizar(instancia):
+    """
+    Mantiene de acuerdo cada máscara de `instancia.CAMPOS_DISPONIBILIDAD` con
+    sus campos antiguos de día y horario. La máscara manda; si está vacía se
+    deduce de los campos antiguos.
+    """
+    for campo, (campo_dia, campo_horario) in instancia.CAMPOS_DISPONIBILIDAD.items():
+        mascara = getattr(instancia, campo)
+        anterior = desde_opciones(getattr(instancia, campo_dia), getattr(instancia, campo_horario))
+        if not mascara:
+            setattr(instancia, campo, anterior)
+        elif mascara != anterior:
+            dia, horario = a_opciones(mascara)
+            setattr(instancia, campo_dia, dia)
+            setattr(instancia, campo_horario, horario)
+
+
+class DisponibilidadField(models.PositiveSmallIntegerField):
+    """Máscara de disponibilidad semanal. Admite el lookup `__solapa`."""
+
+
+@DisponibilidadField.register_lookup
+class Solapa(Lookup):
+    # campo__solapa=<máscara>: comparten alguna franja. Se resuelve en SQL con un AND de bits
+    lookup_name = 'solapa'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'({lhs} & {rhs}) <> 0', (*lhs_params, *rhs_params)
+
@@ -0,0 +1,381 @@
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Case, FloatField, When
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import cola_geocodificacion
+from .geo import distancias_km, filtro_caja
+
+
+# Sexo del equipo, equipos que admiten a cada jugador y preferencia del anuncio
+MASCARA_SEXO_EQUIPO = {'masculino': 1, 'femenino': 2, 'mixto': 4}
+MASCARA_SEXO_JUGADOR = {'masculino': 1 | 4, 'femenino': 2 | 4}
+MASCARA_SEXO_PREFERENCIA = {'masculino': 1, 'femenino': 2, 'mixto': 4, 'indiferente': 7}
+
+NIVELES = {'relajado': 0, 'intermedio': 1, 'alto': 2}
+
+PESOS = {'disponibilidad': 0.45, 'nivel': 0.2, 'distancia': 0.35}
+# Distancia (km) a la que la puntuación de distancia cae a 1/e
+ESCALA_KM = 10
+# Solo se materializan en la tabla Emparejamiento las parejas a menos de este radio (km)
+RADIO_KM = 30
+
+
+class Caracteristicas:
+    """
+    Vectores de características de un lado del emparejamiento (anuncios de
+    jugador o de equipo), un array de NumPy por atributo y ordenados por id.
+    """
+
+    def __init__(self, filas):
+        filas = list(filas)
+        self.ids = np.array([f[0] for f in filas], dtype=np.int64)
+        # Máscara de franjas de la semana (ver disponibilidad.py)
+        self.disponibilidades = np.array([f[1] for f in filas], dtype=np.int64)
+        self.sexos = np.array([f[2] for f in filas], dtype=np.int64)
+        self.niveles = np.array([f[3] for f in filas], dtype=np.float64)
+        self.latitudes = np.array([f[4] for f in filas], dtype=np.float64)
+        self.longitudes = np.array([f[5] for f in filas], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _o_nan(valor):
+    # Los valores que faltan se guardan como NaN en los arrays
+    return np.nan if valor is None else valor
+
+
+def _filas_jugadores(anuncios=None):
+    from .models import AnuncioJugador
+
+    anuncios = AnuncioJugador.objects.all() if anuncios is None else anuncios
+    anuncios = (
+        anuncios
+        .exclude(jugador__estado_geocodificacion=cola_geocodificacion.PENDIENTE)
+        .order_by('pk')
+        .values_list(
+            'id', 'disponibilidad', 'sexo',
+            'jugador__sexo', 'jugador__nivel', 'jugador__latitud', 'jugador__longitud',
+        )
+    )
+    for id, franjas, preferencia, sexo, nivel, lat, lon in anuncios.iterator(chunk_size=5000):
+        admitidos = MASCARA_SEXO_JUGADOR.get(sexo, 7)
+        # Si la preferencia no es compatible con su sexo, cuenta solo el sexo
+        sexos = (admitidos & MASCARA_SEXO_PREFERENCIA.get(preferencia, 7)) or admitidos
+        yield (
+            id, franjas, sexos,
+            _o_nan(NIVELES.get(nivel)), _o_nan(lat), _o_nan(lon),
+        )
+
+
+def _filas_equipos(anuncios=None):
+    from .models import AnuncioEquipo
+
+    # Nivel del equipo: media del nivel de su plantilla (NULL si no tiene jugadores)
+    nivel_medio = Avg(Case(
+        *[When(equipo__jugadores__nivel=nivel, then=valor) for nivel, valor in NIVELES.items()],
+        output_field=FloatField(),
+    ))
+    anuncios = AnuncioEquipo.objects.all() if anuncios is None else anuncios
+    anuncios = (
+        anuncios
+        .exclude(estado_geocodificacion=cola_geocodificacion.PENDIENTE)
+        .annotate(nivel_medio=nivel_medio)
+        .order_by('pk')
+        .values_list(
+            'id', 'disponibilidad_partido', 'equipo__sexo',
+            'nivel_medio', 'latitud_partido', 'longitud_partido',
+        )
+    )
+    for id, franjas, sexo, nivel, lat, lon in anuncios.iterator(chunk_size=5000):
+        yield (
+            id, franjas, MASCARA_SEXO_EQUIPO.get(sexo, 0),
+            _o_nan(nivel), _o_nan(lat), _o_nan(lon),
+        )
+
+
+def puntuar(origen, i, destino, distancia_max=None):
+    """
+    Puntuación en [0, 1] de la fila `i` de `origen` contra todas las filas de
+    `destino`, en una sola pasada vectorizada. Devuelve `(puntuaciones,
+    distancias)`; los incompatibles por sexo, o más lejos que `distancia_max`,
+    quedan a -inf.
+    """
+    pesos = getattr(settings, 'EMPAREJAMIENTO_PESOS', PESOS)
+    escala = getattr(settings, 'EMPAREJAMIENTO_ESCALA_KM', ESCALA_KM)
+
+    # Comparten alguna franja de día y hora: un solo AND
+    disponible = (destino.disponibilidades & origen.disponibilidades[i]) != 0
+    # Sin nivel conocido (equipo sin jugadores) se da una puntuación neutra
+    nivel = np.nan_to_num(1 - np.abs(destino.niveles - origen.niveles[i]) / 2, nan=0.5)
+    distancias = distancias_km(origen.latitudes[i], origen.longitudes[i], destino.latitudes, destino.longitudes)
+    cercania = np.nan_to_num(np.exp(-distancias / escala), nan=0.0)
+
+    puntuaciones = (
+        pesos['disponibilidad'] * disponible
+        + pesos['nivel'] * nivel
+        + pesos['distancia'] * cercania
+    ) / sum(pesos.values())
+
+    descartados = (destino.sexos & origen.sexos[i]) == 0
+    if distancia_max is not None:
+        descartados |= ~(distancias <= distancia_max)
+    puntuaciones[descartados] = -np.inf
+    return puntuaciones, distancias
+
+
+def radio_km():
+    return getattr(settings, 'EMPAREJAMIENTO_RADIO_KM', RADIO_KM)
+
+
+def _parejas(origen, i, destino, radio):
+    """Parejas `(id destino, puntuación, distancia)` de la fila `i` de `origen` dentro del radio."""
+    puntuaciones, distancias = puntuar(origen, i, destino, radio)
+    return [
+        (int(destino.ids[j]), float(puntuaciones[j]), float(distancias[j]))
+        for j in np.flatnonzero(np.isfinite(puntuaciones))
+    ]
+
+
+def _sin_ubicacion(vectores):
+    return not len(vectores) or np.isnan(vectores.latitudes[0]) or np.isnan(vectores.longitudes[0])
+
+
+def parejas_jugador(anuncio_jugador_id):
+    """Parejas de un anuncio de jugador, puntuando solo los equipos de las celdas de su radio."""
+    from .models import AnuncioEquipo, AnuncioJugador
+
+    origen = Caracteristicas(_filas_jugadores(AnuncioJugador.objects.filter(pk=anuncio_jugador_id)))
+    if _sin_ubicacion(origen):
+        return []
+    radio = radio_km()
+    candidatos = AnuncioEquipo.objects.candidatos_partido(origen.latitudes[0], origen.longitudes[0], radio)
+    return _parejas(origen, 0, Caracteristicas(_filas_equipos(candidatos)), radio)
+
+
+def parejas_equipo(anuncio_equipo_id):
+    """Parejas de un anuncio de equipo, puntuando solo los jugadores de la caja de su radio."""
+    from .models import AnuncioEquipo, AnuncioJugador
+
+    origen = Caracteristicas(_filas_equipos(AnuncioEquipo.objects.filter(pk=anuncio_equipo_id)))
+    if _sin_ubicacion(origen):
+        return []
+    radio = radio_km()
+    candidatos = AnuncioJugador.objects.filter(
+        filtro_caja('jugador__latitud', 'jugador__longitud', origen.latitudes[0], origen.longitudes[0], radio)
+    )
+    return _parejas(origen, 0, Caracteristicas(_filas_jugadores(candidatos)), radio)
+
+
+def emparejar_jugador(anuncio_jugador_id):
+    """Sustituye las filas de Emparejamiento de un anuncio de jugador. Devuelve cuántas quedan."""
+    from .models import Emparejamiento
+
+    filas = [
+        Emparejamiento(anuncio_jugador_id=anuncio_jugador_id, anuncio_equipo_id=equipo_id, puntuacion=puntuacion, distancia=distancia)
+        for equipo_id, puntuacion, distancia in parejas_jugador(anuncio_jugador_id)
+    ]
+    with transaction.atomic():
+        Emparejamiento.objects.filter(anuncio_jugador_id=anuncio_jugador_id).delete()
+        Emparejamiento.objects.bulk_create(filas)
+    return len(filas)
+
+
+def emparejar_equipo(anuncio_equipo_id):
+    """Sustituye las filas de Emparejamiento de un anuncio de equipo. Devuelve cuántas quedan."""
+    from .models import Emparejamiento
+
+    filas = [
+        Emparejamiento(anuncio_jugador_id=jugador_id, anuncio_equipo_id=anuncio_equipo_id, puntuacion=puntuacion, distancia=distancia)
+        for jugador_id, puntuacion, distancia in parejas_equipo(anuncio_equipo_id)
+    ]
+    with transaction.atomic():
+        Emparejamiento.objects.filter(anuncio_equipo_id=anuncio_equipo_id).delete()
+        Emparejamiento.objects.bulk_create(filas)
+    return len(filas)
+
+
+def _parejas_esperadas():
+    """
+    Parejas de cada anuncio de jugador puntuado contra todos los equipos, sin
+    pasar por el índice espacial: `(anuncio_jugador_id, [(equipo_id, puntuación, distancia)])`.
+    """
+    jugadores = Caracteristicas(_filas_jugadores())
+    equipos = Caracteristicas(_filas_equipos())
+    radio = radio_km()
+    for i in range(len(jugadores)):
+        if np.isnan(jugadores.latitudes[i]) or np.isnan(jugadores.longitudes[i]):
+            yield int(jugadores.ids[i]), []
+        else:
+            yield int(jugadores.ids[i]), _parejas(jugadores, i, equipos, radio)
+
+
+def reconstruir(lote=5000):
+    """Vacía y recalcula toda la tabla de emparejamientos. Devuelve cuántas filas crea."""
+    from .models import Emparejamiento
+
+    total = 0
+    filas = []
+    with transaction.atomic():
+        Emparejamiento.objects.all().delete()
+        for anuncio_jugador_id, parejas in _parejas_esperadas():
+            filas.extend(
+                Emparejamiento(anuncio_jugador_id=anuncio_jugador_id, anuncio_equipo_id=equipo_id, puntuacion=puntuacion, distancia=distancia)
+                for equipo_id, puntuacion, distancia in parejas
+            )
+            if len(filas) >= lote:
+                Emparejamiento.objects.bulk_create(filas)
+                total += len(filas)
+                filas = []
+        Emparejamiento.objects.bulk_create(filas)
+    return total + len(filas)
+
+
+def comprobar(lote=1000, tolerancia=1e-6):
+    """
+    Compara la tabla con las parejas recalculadas desde cero. Devuelve un dict
+    con las parejas que faltan, sobran o tienen otra puntuación, y los
+    anuncios de jugador afectados.
+    """
+    from .models import Emparejamiento
+
+    resultado = {'faltan': 0, 'sobran': 0, 'distintas': 0, 'anuncios_jugador': []}
+
+    def comparar(esperadas):
+        guardadas = defaultdict(dict)
+        filas = Emparejamiento.objects.filter(anuncio_jugador_id__in=esperadas).values_list(
+            'anuncio_jugador_id', 'anuncio_equipo_id', 'puntuacion'
+        )
+        for anuncio_jugador_id, equipo_id, puntuacion in filas:
+            guardadas[anuncio_jugador_id][equipo_id] = puntuacion
+        for anuncio_jugador_id, parejas in esperadas.items():
+            calculadas = {equipo_id: puntuacion for equipo_id, puntuacion, _ in parejas}
+            propias = guardadas[anuncio_jugador_id]
+            faltan = calculadas.keys() - propias.keys()
+            sobran = propias.keys() - calculadas.keys()
+            distintas = [e for e in calculadas.keys() & propias.keys() if abs(calculadas[e] - propias[e]) > tolerancia]
+            if faltan or sobran or distintas:
+                resultado['faltan'] += len(faltan)
+                resultado['sobran'] += len(sobran)
+                resultado['distintas'] += len(distintas)
+                resultado['anuncios_jugador'].append(anuncio_jugador_id)
+
+    esperadas = {}
+    for anuncio_jugador_id, parejas in _parejas_esperadas():
+        esperadas[anuncio_jugador_id] = parejas
+        if len(esperadas) >= lote:
+            comparar(esperadas)
+            esperadas = {}
+    if esperadas:
+        comparar(esperadas)
+
+    # Filas de anuncios que ya no cuentan (p. ej. pendientes de geocodificar)
+    huerfanas = Emparejamiento.objects.filter(
+        anuncio_jugador__jugador__estado_geocodificacion=cola_geocodificacion.PENDIENTE
+    )
+    resultado['sobran'] += huerfanas.count()
+    for anuncio_jugador_id in huerfanas.values_list('anuncio_jugador_id', flat=True).distinct():
+        if anuncio_jugador_id not in resultado['anuncios_jugador']:
+            resultado['anuncios_jugador'].append(anuncio_jugador_id)
+    return resultado
+
+
+def _reemparejar_jugador(jugador_id):
+    # Su ubicación, sexo y nivel entran en su anuncio, y su nivel en la media de sus equipos
+    from .models import AnuncioEquipo, AnuncioJugador
+
+    for anuncio_id in AnuncioJugador.objects.filter(jugador_id=jugador_id).values_list('pk', flat=True):
+        emparejar_jugador(anuncio_id)
+    for anuncio_id in AnuncioEquipo.objects.filter(equipo__jugadores=jugador_id).values_list('pk', flat=True):
+        emparejar_equipo(anuncio_id)
+
+
+def _reemparejar_equipos(equipo_ids):
+    from .models import AnuncioEquipo
+
+    for anuncio_id in AnuncioEquipo.objects.filter(equipo__in=equipo_ids).values_list('pk', flat=True):
+        emparejar_equipo(anuncio_id)
+
+
+# Cada cambio vuelve a puntuar solo las parejas del anuncio afectado. Al
+# borrar un anuncio sus filas se van en cascada.
+@receiver(post_save, sender='basketconecta.AnuncioJugador')
+def _anuncio_jugador_guardado(sender, instance, **kwargs):
+    emparejar_jugador(instance.pk)
+
+
+@receiver(post_save, sender='basketconecta.AnuncioEquipo')
+def _anuncio_equipo_guardado(sender, instance, **kwargs):
+    emparejar_equipo(instance.pk)
+
+
+# Campos del jugador y del equipo que entran en la puntuación. Los demás
+# cambios (nombre, descripción, camisetas...) no tocan la tabla.
+CAMPOS_PUNTUACION = {
+    'basketconecta.Jugador': ('latitud', 'longitud', 'nivel', 'sexo', 'estado_geocodificacion'),
+    'basketconecta.Equipo': ('sexo',),
+}
+
+
+@receiver(pre_save, sender='basketconecta.Jugador')
+@receiver(pre_save, sender='basketconecta.Equipo')
+def _guardandose(sender, instance, **kwargs):
+    campos = CAMPOS_PUNTUACION[sender._meta.label]
+    if instance._state.adding:
+        # Aún no tiene anuncios ni plantilla que puntuar
+        instance._cambia_puntuacion = False
+    else:
+        anteriores = sender._base_manager.filter(pk=instance.pk).values_list(*campos).first()
+        instance._cambia_puntuacion = anteriores != tuple(getattr(instance, c) for c in campos)
+
+
+@receiver(post_save, sender='basketconecta.Jugador')
+def _jugador_guardado(sender, instance, **kwargs):
+    if getattr(instance, '_cambia_puntuacion', True):
+        _reemparejar_jugador(instance.pk)
+
+
+@receiver(post_save, sender='basketconecta.Equipo')
+def _equipo_guardado(sender, instance, **kwargs):
+    if getattr(instance, '_cambia_puntuacion', True):
+        _reemparejar_equipos([instance.pk])
+
+
+@receiver(pre_delete, sender='basketconecta.Jugador')
+def _jugador_borrandose(sender, instance, **kwargs):
+    # Después del borrado ya no se sabe en qué equipos estaba
+    instance._equipos_emparejamiento = list(instance.equipos.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender='basketconecta.Jugador')
+def _jugador_borrado(sender, instance, **kwargs):
+    _reemparejar_equipos(getattr(instance, '_equipos_emparejamiento', []))
+
+
+@receiver(m2m_changed, sender='basketconecta.Equipo_jugadores')
+def _plantilla_cambiada(sender, instance, action, reverse, pk_set, **kwargs):
+    # El nivel del equipo sale de su plantilla
+    if reverse and action == 'pre_clear':
+        instance._equipos_emparejamiento = list(instance.equipos.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        equipo_ids = [instance.pk]
+    elif pk_set is not None:
+        equipo_ids = list(pk_set)
+    else:
+        equipo_ids = getattr(instance, '_equipos_emparejamiento', [])
+    _reemparejar_equipos(equipo_ids)
+
+
+@receiver(cola_geocodificacion.fila_geocodificada)
+def _fila_geocodificada(sender, pk, **kwargs):
+    if sender._meta.model_name == 'jugador':
+        _reemparejar_jugador(pk)
+    else:
+        emparejar_equipo(pk)
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.http import JsonResponse, StreamingHttpResponse
+
+from .tiempo_real import usuario_del_token
+
+
+# Notificaciones en tiempo real por Server-Sent Events. Cada conexión tiene
+# una cola acotada en el hub del proceso; al crearse una notificación se copia
+# a las colas de su usuario. Una conexión que no vacía su cola a tiempo se
+# expulsa en vez de acumular memoria o frenar a las demás: el cliente se
+# reconecta con Last-Event-ID y recupera lo perdido de la base de datos.
+
+TAMANO_COLA = 100
+# Segundos entre comentarios de latido, para que proxies y clientes no cierren la conexión
+LATIDO = 15
+# Notificaciones que se recuperan como máximo al reconectar con Last-Event-ID
+MAX_RECUPERADAS = 100
+
+# Marca que se deja en la cola de una conexión expulsada
+_EXPULSADA = object()
+
+
+class Suscripcion:
+    def __init__(self, hub, usuario_id, tamano):
+        self.hub = hub
+        self.usuario_id = usuario_id
+        self.cola = asyncio.Queue(maxsize=tamano)
+        self.loop = asyncio.get_running_loop()
+        self.expulsada = False
+
+    def _entregar(self, evento):
+        # Siempre en el hilo del bucle de la conexión
+        if self.expulsada:
+            return
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            self.expulsada = True
+            while not self.cola.empty():
+                self.cola.get_nowait()
+            self.cola.put_nowait(_EXPULSADA)
+            # También si la respuesta nunca llegó a consumirse
+            self.hub.cancelar(self)
+
+    def close(self):
+        # Django llama a close() al terminar la respuesta, también si el cliente se desconecta
+        self.hub.cancelar(self)
+
+
+class Hub:
+    """
+    Reparto en memoria de eventos por usuario. `publicar` se puede llamar
+    desde cualquier hilo: solo toma el lock para copiar las suscripciones del
+    usuario y deja cada evento en el bucle de su conexión sin esperar.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._suscripciones = {}
+
+    def suscribir(self, usuario_id, tamano=None):
+        suscripcion = Suscripcion(self, usuario_id, tamano or getattr(settings, 'NOTIFICACIONES_FLUJO_COLA', TAMANO_COLA))
+        with self._lock:
+            self._suscripciones.setdefault(usuario_id, set()).add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion):
+        with self._lock:
+            suscripciones = self._suscripciones.get(suscripcion.usuario_id, set())
+            suscripciones.discard(suscripcion)
+            if not suscripciones:
+                self._suscripciones.pop(suscripcion.usuario_id, None)
+
+    def conexiones(self, usuario_id=None):
+        with self._lock:
+            if usuario_id is not None:
+                return len(self._suscripciones.get(usuario_id, ()))
+            return sum(len(s) for s in self._suscripciones.values())
+
+    def publicar(self, usuario_id, evento):
+        with self._lock:
+            suscripciones = list(self._suscripciones.get(usuario_id, ()))
+        for suscripcion in suscripciones:
+            try:
+                suscripcion.loop.call_soon_threadsafe(suscripcion._entregar, evento)
+            except RuntimeError:
+                # El bucle de la conexión ya se cerró
+                self.cancelar(suscripcion)
+
+
+hub = Hub()
+
+
+def _evento(notificacion):
+    """Una notificación como evento SSE, con su id para Last-Event-ID."""
+    from .serializers import NotificacionSerializer
+
+    datos = json.dumps(NotificacionSerializer(notificacion).data)
+    return f'id: {notificacion.id}\nevent: notificacion\ndata: {datos}\n\n'
+
+
+@receiver(post_save, sender='basketconecta.Notificacion')
+def _notificacion_creada(sender, instance, created, **kwargs):
+    if created:
+        evento = (instance.id, _evento(instance))
+        transaction.on_commit(lambda: hub.publicar(instance.usuario_id, evento))
+
+
+def _pendientes(usuario, ultimo_id):
+    from .models import Notificacion
+
+    notificaciones = Notificacion.objects.filter(usuario=usuario, id__gt=ultimo_id).order_by('id')
+    return [(n.id, _evento(n)) for n in notificaciones[:MAX_RECUPERADAS]]
+
+
+def _token(request):
+    autorizacion = request.headers.get('Authorization', '')
+    if autorizacion.startswith('Bearer '):
+        return autorizacion[len('Bearer '):]
+    return request.GET.get('token')
+
+
+class Flujo:
+    """Contenido de la respuesta: los eventos de una suscripción, que se cancela al cerrarla."""
+
+    def __init__(self, suscripcion, pendientes):
+        self.suscripcion = suscripcion
+        self.pendientes = pendientes
+
+    def __aiter__(self):
+        return _eventos(self.suscripcion, self.pendientes)
+
+    def close(self):
+        self.suscripcion.close()
+
+
+async def _eventos(suscripcion, pendientes):
+    latido = getattr(settings, 'NOTIFICACIONES_FLUJO_LATIDO', LATIDO)
+    try:
+        # Abre la conexión en el cliente aunque no haya nada que mandar
+        yield ': conectado\n\n'
+        enviado_hasta = 0
+        for id, texto in pendientes:
+            enviado_hasta = id
+            yield texto
+        while True:
+            try:
+                evento = await asyncio.wait_for(suscripcion.cola.get(), latido)
+            except asyncio.TimeoutError:
+                yield ': latido\n\n'
+                continue
+            if evento is _EXPULSADA:
+                yield 'event: expulsado\ndata: {}\n\n'
+                return
+            id, texto = evento
+            # Las creadas mientras se leían las pendientes llegan por las dos vías
+            if id > enviado_hasta:
+                yield texto
+    finally:
+        suscripcion.close()
+
+
+async def vista_flujo_notificaciones(request):
+    """
+    Flujo SSE con las notificaciones nuevas del usuario. Se autentica con el
+    JWT de acceso en `Authorization: Bearer` o en `?token=` (EventSource no
+    permite cabeceras). Con Last-Event-ID (o `?ultimo_id=`) envía antes las
+    notificaciones posteriores a ese id.
+    """
+    usuario = await sync_to_async(usuario_del_token)(_token(request))
+    if not usuario.is_authenticated:
+        return JsonResponse({'detail': 'Token no válido.'}, status=401)
+
+    # Suscribirse antes de leer las pendientes para no perder ninguna entre medias
+    suscripcion = hub.suscribir(usuario.id)
+    pendientes = []
+    ultimo_id = request.headers.get('Last-Event-ID') or request.GET.get('ultimo_id')
+    if ultimo_id and ultimo_id.isdigit():
+        pendientes = await sync_to_async(_pendientes)(usuario, int(ultimo_id))
+
+    respuesta = StreamingHttpResponse(Flujo(suscripcion, pendientes), content_type='text/event-stream')
+    respuesta['Cache-Control'] = 'no-cache'
+    # Sin buffer en nginx
+    respuesta['X-Accel-Buffering'] = 'no'
+    return respuesta
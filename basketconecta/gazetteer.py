@@ -0,0 +1,163 @@
+import csv
+import difflib
+import re
+from array import array
+
+from .geocoding import normalizar_direccion
+
+
+CODIGO_POSTAL = re.compile(r'\b\d{5}\b')
+NUMERO_PORTAL = re.compile(r'\b(?:n|no|num)?\d{1,4}[a-z]?\b')
+
+# Candidatos que se comparan en la búsqueda aproximada
+VENTANA_APROXIMADA = 64
+SIMILITUD_MINIMA = 0.85
+# Letras mínimas de la calle para buscarla por prefijo, y entradas que se
+# recorren como mucho con ese prefijo antes de darla por ambigua
+PREFIJO_MINIMO = 4
+CANDIDATOS_PREFIJO = 64
+
+
+class Gazetteer:
+    """
+    Índice en memoria de calles, municipios y códigos postales.
+
+    Las claves normalizadas se guardan ordenadas y concatenadas en un único
+    bloque de bytes con un array de desplazamientos, y las coordenadas en
+    dos arrays de doubles: unos pocos objetos Python en total, en vez de
+    varios por entrada. La búsqueda exacta y por prefijo es una búsqueda
+    binaria sobre ese bloque.
+    """
+
+    def __init__(self, entradas):
+        filas = {}
+        for nombre, lat, lon in entradas:
+            clave = normalizar_direccion(nombre)
+            if clave:
+                # Con claves repetidas se queda la primera
+                filas.setdefault(clave.encode(), (lat, lon))
+
+        claves = sorted(filas)
+        self._bloque = b''.join(claves)
+        self._desplazamientos = array('Q', [0])
+        self._latitudes = array('d')
+        self._longitudes = array('d')
+        for clave in claves:
+            self._desplazamientos.append(self._desplazamientos[-1] + len(clave))
+            lat, lon = filas[clave]
+            self._latitudes.append(lat)
+            self._longitudes.append(lon)
+
+    @classmethod
+    def desde_fichero(cls, ruta):
+        """
+        Carga un fichero TSV con columnas `nombre`, `latitud`, `longitud`.
+        El nombre puede incluir el municipio ("Calle Mayor, Madrid").
+        """
+        with open(ruta, newline='', encoding='utf-8') as fichero:
+            lector = csv.reader(fichero, delimiter='\t')
+            return cls((nombre, float(lat), float(lon)) for nombre, lat, lon, *_ in lector)
+
+    def __len__(self):
+        return len(self._latitudes)
+
+    def _clave(self, i):
+        return self._bloque[self._desplazamientos[i]:self._desplazamientos[i + 1]]
+
+    def _bisect(self, clave):
+        # bisect_left sobre las claves sin materializarlas en una lista
+        bajo, alto = 0, len(self)
+        while bajo < alto:
+            medio = (bajo + alto) // 2
+            if self._clave(medio) < clave:
+                bajo = medio + 1
+            else:
+                alto = medio
+        return bajo
+
+    def _coordenadas(self, i):
+        return (self._latitudes[i], self._longitudes[i])
+
+    def exacta(self, texto):
+        clave = texto.encode()
+        i = self._bisect(clave)
+        if i < len(self) and self._clave(i) == clave:
+            return self._coordenadas(i)
+        return None
+
+    def prefijo(self, calle, municipio):
+        """
+        Única entrada del municipio cuya calle empieza por `calle`. Con un
+        prefijo corto, sin municipio o con varias candidatas devuelve None.
+        """
+        if len(calle) < PREFIJO_MINIMO or not municipio:
+            return None
+        clave = calle.encode()
+        sufijo = f' {municipio}'.encode()
+        encontrada = None
+        i = self._bisect(clave)
+        for j in range(i, len(self)):
+            candidata = self._clave(j)
+            if not candidata.startswith(clave):
+                break
+            if j - i >= CANDIDATOS_PREFIJO:
+                # Demasiadas calles con ese prefijo para decidir
+                return None
+            if candidata.endswith(sufijo):
+                if encontrada is not None:
+                    return None
+                encontrada = j
+        return self._coordenadas(encontrada) if encontrada is not None else None
+
+    def aproximada(self, calle, municipio):
+        """
+        Calle del municipio más parecida a `calle` entre las vecinas
+        alfabéticas. Si se parecen varias, o no hay municipio, devuelve None.
+        """
+        if not calle or not municipio:
+            return None
+        sufijo = f' {municipio}'
+        i = self._bisect(f'{calle}{sufijo}'.encode())
+        mitad = VENTANA_APROXIMADA // 2
+        candidatos = {}
+        for j in range(max(0, i - mitad), min(i + mitad, len(self))):
+            clave = self._clave(j).decode()
+            if clave.endswith(sufijo) and len(clave) > len(sufijo):
+                candidatos[clave[:-len(sufijo)]] = j
+        parecidas = difflib.get_close_matches(calle, candidatos, n=2, cutoff=SIMILITUD_MINIMA)
+        return self._coordenadas(candidatos[parecidas[0]]) if len(parecidas) == 1 else None
+
+    def buscar(self, direccion):
+        """
+        Resuelve una dirección de más a menos específico: calle y municipio
+        exactos, calle por prefijo o aproximada dentro del municipio, código
+        postal y, por último, municipio. Devuelve `(lat, lon)` o None.
+        """
+        partes = [normalizar_direccion(p) for p in direccion.split(',')]
+        partes = [p for p in partes if p]
+        if not partes:
+            return None
+        completa = ' '.join(partes)
+        sin_portal = _sin_portal(completa)
+        municipio = _sin_portal(partes[-1])
+
+        encontrada = self.exacta(completa)
+        if encontrada is None and sin_portal:
+            encontrada = self.exacta(sin_portal)
+        if encontrada is None and len(partes) > 1:
+            calle = _sin_portal(' '.join(partes[:-1]))
+            encontrada = self.prefijo(calle, municipio) or self.aproximada(calle, municipio)
+        if encontrada:
+            return encontrada
+        codigo_postal = CODIGO_POSTAL.search(completa)
+        if codigo_postal:
+            encontrada = self.exacta(codigo_postal.group())
+            if encontrada:
+                return encontrada
+        if municipio and len(partes) > 1:
+            return self.exacta(municipio)
+        return None
+
+
+def _sin_portal(texto):
+    return ' '.join(NUMERO_PORTAL.sub(' ', CODIGO_POSTAL.sub(' ', texto)).split())
@@ -0,0 +1,199 @@
+from math import radians, degrees, cos, sin, asin, sqrt, ceil, pi
+
+import numpy as np
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+
+RADIO_TIERRA_KM = 6371
+
+# Precisión con la que se guarda el geohash de cada anuncio (~38 m x 19 m)
+PRECISION_GEOHASH = 8
+# Máximo de celdas que se consultan por búsqueda de radio
+MAX_CELDAS_BUSQUEDA = 16
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * asin(sqrt(a))
+
+
+def distancias_km(lat, lon, lats, lons):
+    """
+    Haversine vectorizado: distancia en km desde (lat, lon) a cada punto de
+    los arrays `lats`/`lons`.
+    """
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    lat0 = radians(lat)
+    lon0 = radians(lon)
+    a = np.sin((lats - lat0) / 2) ** 2 + cos(lat0) * np.cos(lats) * np.sin((lons - lon0) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def seleccionar_cercanos(distancias, radio_km, k=None):
+    """
+    Índices de `distancias` que quedan dentro del radio, ordenados de más
+    cerca a más lejos. Con `k` solo se devuelven los k más cercanos, usando
+    `argpartition` para no ordenar el resto.
+    """
+    distancias = np.asarray(distancias)
+    dentro = np.flatnonzero(distancias <= radio_km)
+    if k is not None and k < len(dentro):
+        dentro = dentro[np.argpartition(distancias[dentro], k - 1)[:k]]
+    return dentro[np.argsort(distancias[dentro], kind='stable')]
+
+
+def geohash(lat, lon, precision=PRECISION_GEOHASH):
+    """
+    Codifica unas coordenadas como geohash. Dos puntos cercanos comparten
+    prefijo, así que una búsqueda por zona es un `LIKE 'prefijo%'` indexado.
+    """
+    lat_rango = [-90.0, 90.0]
+    lon_rango = [-180.0, 180.0]
+    resultado = []
+    bits = 0
+    n_bits = 0
+    par = True
+    while len(resultado) < precision:
+        rango, valor = (lon_rango, lon) if par else (lat_rango, lat)
+        medio = (rango[0] + rango[1]) / 2
+        if valor >= medio:
+            bits = (bits << 1) | 1
+            rango[0] = medio
+        else:
+            bits <<= 1
+            rango[1] = medio
+        par = not par
+        n_bits += 1
+        if n_bits == 5:
+            resultado.append(_BASE32[bits])
+            bits = 0
+            n_bits = 0
+    return ''.join(resultado)
+
+
+def _tamano_celda(precision):
+    # Devuelve (alto, ancho) en grados de una celda geohash de esa precisión
+    total_bits = 5 * precision
+    bits_lon = ceil(total_bits / 2)
+    bits_lat = total_bits // 2
+    return 180.0 / (2 ** bits_lat), 360.0 / (2 ** bits_lon)
+
+
+def caja_envolvente(lat, lon, radio_km):
+    """
+    Devuelve (lat_min, lat_max, lon_min, lon_max) del rectángulo que contiene
+    el círculo de `radio_km` alrededor del punto. Se calcula sobre la misma
+    esfera que haversine_km para no dejar fuera puntos del borde del radio.
+    """
+    angulo = radio_km / RADIO_TIERRA_KM
+    dlat = degrees(angulo)
+    cos_lat = cos(radians(lat))
+    if angulo >= pi / 2 or sin(angulo) >= cos_lat:
+        # El círculo contiene un polo: todas las longitudes
+        dlon = 180.0
+    else:
+        dlon = degrees(asin(sin(angulo) / cos_lat))
+    return (
+        max(-90.0, lat - dlat), min(90.0, lat + dlat),
+        lon - dlon, lon + dlon,
+    )
+
+
+def _normalizar_longitud(lon):
+    return ((lon + 180.0) % 360.0) - 180.0
+
+
+def celdas_en_radio(lat, lon, radio_km):
+    """
+    Conjunto de prefijos geohash que cubren el círculo de `radio_km`.
+    Se elige la precisión más fina que no supere MAX_CELDAS_BUSQUEDA celdas.
+    """
+    lat_min, lat_max, lon_min, lon_max = caja_envolvente(lat, lon, radio_km)
+    for precision in range(PRECISION_GEOHASH, 0, -1):
+        alto, ancho = _tamano_celda(precision)
+        filas = ceil((lat_max - lat_min) / alto) + 1
+        columnas = ceil((lon_max - lon_min) / ancho) + 1
+        if filas * columnas <= MAX_CELDAS_BUSQUEDA:
+            break
+
+    celdas = set()
+    for i in range(filas + 1):
+        la = min(lat_min + i * alto, lat_max)
+        for j in range(columnas + 1):
+            lo = min(lon_min + j * ancho, lon_max)
+            celdas.add(geohash(la, _normalizar_longitud(lo), precision))
+    return celdas
+
+
+def filtro_celdas(campo, lat, lon, radio_km):
+    """
+    Q que selecciona las filas cuyo geohash (`campo`) cae en alguna de las
+    celdas que cubren el radio. Es un prefiltro: hay que comprobar después
+    la distancia exacta.
+
+    Cada prefijo se expresa como un rango (`>= celda` y `< celda + '~'`) en
+    vez de `startswith`, para que cualquier índice B-tree sirva.
+    """
+    filtro = Q()
+    for celda in celdas_en_radio(lat, lon, radio_km):
+        filtro |= Q(**{f'{campo}__gte': celda, f'{campo}__lt': celda + '~'})
+    return filtro
+
+
+def filtro_caja(campo_lat, campo_lon, lat, lon, radio_km):
+    """
+    Q con el rectángulo envolvente del radio sobre dos columnas de
+    coordenadas. Si el rectángulo cruza el antimeridiano se parte en dos.
+    """
+    lat_min, lat_max, lon_min, lon_max = caja_envolvente(lat, lon, radio_km)
+    filtro = Q(**{f'{campo_lat}__gte': lat_min, f'{campo_lat}__lte': lat_max})
+    if lon_max - lon_min >= 360.0:
+        return filtro
+    if lon_min < -180.0:
+        filtro_lon = Q(**{f'{campo_lon}__gte': lon_min + 360.0}) | Q(**{f'{campo_lon}__lte': lon_max})
+    elif lon_max > 180.0:
+        filtro_lon = Q(**{f'{campo_lon}__gte': lon_min}) | Q(**{f'{campo_lon}__lte': lon_max - 360.0})
+    else:
+        filtro_lon = Q(**{f'{campo_lon}__gte': lon_min, f'{campo_lon}__lte': lon_max})
+    return filtro & filtro_lon
+
+
+def expresion_distancia_km(campo_lat, campo_lon, lat, lon):
+    """
+    Haversine como expresión SQL. Usa funciones que Django soporta tanto en
+    PostgreSQL como en SQLite, así que se puede anotar, filtrar y ordenar
+    en la base de datos.
+    """
+    lat_origen = radians(lat)
+    lon_origen = radians(lon)
+    lat_destino = Radians(F(campo_lat))
+    lon_destino = Radians(F(campo_lon))
+    a = (
+        Power(Sin((lat_destino - Value(lat_origen)) / Value(2.0)), 2)
+        + Value(cos(lat_origen)) * Cos(lat_destino)
+        * Power(Sin((lon_destino - Value(lon_origen)) / Value(2.0)), 2)
+    )
+    # Least evita un NaN por redondeo cuando a se pasa ligeramente de 1
+    return Value(2.0 * RADIO_TIERRA_KM) * ASin(Sqrt(Least(a, Value(1.0))), output_field=FloatField())
+
+
+def filtrar_por_radio(queryset, campo_lat, campo_lon, lat, lon, radio_km):
+    """
+    Filtra `queryset` a las filas a menos de `radio_km` del punto, anota la
+    distancia en `distancia` y ordena de más cerca a más lejos, todo en una
+    sola consulta.
+    """
+    return (
+        queryset
+        .filter(filtro_caja(campo_lat, campo_lon, lat, lon, radio_km))
+        .annotate(distancia=expresion_distancia_km(campo_lat, campo_lon, lat, lon))
+        .filter(distancia__lte=radio_km)
+        .order_by('distancia', 'pk')
+    )
@@ -0,0 +1,440 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from geopy.geocoders import Nominatim
+from geopy.exc import GeocoderServiceError
+
+
+# Cuánto vale una dirección resuelta y cuánto se recuerda que una dirección
+# no existe. Son los valores por defecto de GEOCODIFICACION_TTL,
+# GEOCODIFICACION_TTL_NEGATIVO y GEOCODIFICACION_TAMANO_LRU, que se leen en
+# cada uso.
+TTL = timedelta(days=30)
+TTL_NEGATIVO = timedelta(days=1)
+TAMANO_LRU = 2048
+
+# Cada consulta a un backend remoto envía esta señal con los argumentos
+# `backend` (nombre de la clase), `duracion` (segundos), `resultado`
+# ('encontrada', 'no_encontrada', 'no_disponible' o 'circuito_abierto') y
+# `circuito` (estado del circuit breaker tras la llamada).
+geocodificacion_realizada = Signal()
+# Cada llamada a `geocodificar` envía esta señal con `resultado`: el nivel de
+# caché que respondió ('memoria', 'local', 'bd') o 'fallo' si hubo que ir a
+# los backends remotos.
+cache_consultada = Signal()
+
+# Función que se llama justo antes de cada consulta a un backend remoto. La
+# cola de geocodificación pone aquí su limitador de frecuencia, para esperar
+# solo cuando la dirección no está en ninguna caché.
+_antes_de_consultar = ContextVar('antes_de_consultar', default=None)
+
+
+class GeocodificadorNoDisponible(Exception):
+    pass
+
+
+def normalizar_direccion(direccion):
+    """
+    Clave de caché de una dirección: minúsculas, sin tildes, sin signos de
+    puntuación y con los espacios colapsados, para que "C/ Mayor, 1" y
+    "c/ mayor 1" compartan entrada.
+    """
+    texto = unicodedata.normalize('NFKD', direccion or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    texto = re.sub(r'[^\w/]+', ' ', texto)
+    return ' '.join(texto.split())[:255]
+
+
+class CacheLRU:
+    """
+    LRU en memoria con caducidad por entrada. Guarda `(lat, lon)` o
+    `(None, None)` para las direcciones que no se encontraron. Sin `tamano`
+    se toma GEOCODIFICACION_TAMANO_LRU en cada escritura.
+    """
+
+    def __init__(self, tamano=None):
+        self._tamano = tamano
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            coordenadas, expira = entrada
+            if expira <= time.monotonic():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return coordenadas
+
+    @property
+    def tamano(self):
+        if self._tamano is not None:
+            return self._tamano
+        return getattr(settings, 'GEOCODIFICACION_TAMANO_LRU', TAMANO_LRU)
+
+    def guardar(self, clave, coordenadas, ttl_segundos):
+        tamano = self.tamano
+        with self._lock:
+            self._datos[clave] = (coordenadas, time.monotonic() + ttl_segundos)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > tamano:
+                self._datos.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+class CircuitBreaker:
+    """
+    Tras `umbral` fallos seguidos deja de llamar al backend durante
+    `enfriamiento` segundos. Pasado ese tiempo deja pasar una única llamada
+    de prueba: si va bien se cierra y si falla vuelve a abrirse.
+    """
+    CERRADO = 'cerrado'
+    ABIERTO = 'abierto'
+    SEMIABIERTO = 'semiabierto'
+
+    def __init__(self, umbral, enfriamiento):
+        self.umbral = umbral
+        self.enfriamiento = enfriamiento
+        self._lock = threading.Lock()
+        self._fallos = 0
+        self._abierto_hasta = None
+        self._sondeando = False
+
+    def _estado(self):
+        if self._abierto_hasta is None:
+            return self.CERRADO
+        if time.monotonic() < self._abierto_hasta:
+            return self.ABIERTO
+        return self.SEMIABIERTO
+
+    @property
+    def estado(self):
+        with self._lock:
+            return self._estado()
+
+    def permitir(self):
+        with self._lock:
+            estado = self._estado()
+            if estado == self.CERRADO:
+                return True
+            if estado == self.SEMIABIERTO and not self._sondeando:
+                self._sondeando = True
+                return True
+            return False
+
+    def exito(self):
+        with self._lock:
+            self._fallos = 0
+            self._abierto_hasta = None
+            self._sondeando = False
+
+    def fallo(self):
+        with self._lock:
+            self._fallos += 1
+            if self._sondeando or self._fallos >= self.umbral:
+                self._abierto_hasta = time.monotonic() + self.enfriamiento
+            self._sondeando = False
+
+
+_lru = CacheLRU()
+# Duraciones de las últimas llamadas remotas, para los percentiles
+_latencias = deque(maxlen=1000)
+_contadores_lock = threading.Lock()
+_contadores = {
+    'aciertos_memoria': 0,
+    'aciertos_local': 0,
+    'aciertos_bd': 0,
+    'fallos': 0,
+    'llamadas_geocodificador': 0,
+}
+
+_cliente = None
+
+
+def _incrementar(contador):
+    with _contadores_lock:
+        _contadores[contador] += 1
+
+
+def _percentil(valores, percentil):
+    if not valores:
+        return None
+    i = min(len(valores) - 1, int(round(percentil / 100 * (len(valores) - 1))))
+    return valores[i]
+
+
+def estadisticas():
+    with _contadores_lock:
+        datos = dict(_contadores)
+        latencias = sorted(_latencias)
+    for percentil in (50, 95, 99):
+        valor = _percentil(latencias, percentil)
+        datos[f'latencia_p{percentil}_ms'] = round(valor * 1000, 1) if valor is not None else None
+    datos['circuitos'] = {
+        type(backend).__name__: backend.circuito.estado
+        for backend in backends() if not backend.es_local
+    }
+    aciertos = datos['aciertos_memoria'] + datos['aciertos_local'] + datos['aciertos_bd']
+    consultas = aciertos + datos['fallos']
+    datos['consultas'] = consultas
+    datos['tasa_aciertos'] = aciertos / consultas if consultas else 0.0
+    return datos
+
+
+def reiniciar_cache():
+    """
+    Vacía la LRU, pone los contadores a cero y cierra los circuitos
+    (la tabla no se toca).
+    """
+    _lru.limpiar()
+    with _contadores_lock:
+        for contador in _contadores:
+            _contadores[contador] = 0
+        _latencias.clear()
+    for backend in backends():
+        backend.circuito.exito()
+
+
+def _geolocator():
+    global _cliente
+    if _cliente is None:
+        _cliente = Nominatim(
+            user_agent="basketconecta",
+            timeout=getattr(settings, 'GEOCODIFICACION_TIMEOUT', 3),
+        )
+    return _cliente
+
+
+class Geocodificador:
+    """
+    Interfaz de los backends de geocodificación. `geocodificar` devuelve
+    `(lat, lon)`, None si la dirección no existe para este backend, o lanza
+    GeocodificadorNoDisponible si no se pudo consultar.
+
+    Los backends locales (`es_local = True`) se consultan antes que la caché
+    porque responden en microsegundos; los remotos solo tras un fallo de caché
+    y protegidos por un circuit breaker.
+    """
+    es_local = False
+
+    def __init__(self):
+        self.circuito = CircuitBreaker(
+            umbral=getattr(settings, 'GEOCODIFICACION_UMBRAL_FALLOS', 5),
+            enfriamiento=getattr(settings, 'GEOCODIFICACION_ENFRIAMIENTO', 30),
+        )
+
+    def geocodificar(self, direccion):
+        raise NotImplementedError
+
+
+class GeocodificadorNominatim(Geocodificador):
+    def geocodificar(self, direccion):
+        try:
+            location = _geolocator().geocode(direccion)
+        except GeocoderServiceError as e:
+            # Incluye timeouts, límites de uso y servicio caído
+            raise GeocodificadorNoDisponible(str(e)) from e
+        return (location.latitude, location.longitude) if location else None
+
+
+class GeocodificadorLocal(Geocodificador):
+    """Busca en el gazetteer de GEOCODIFICACION_GAZETTEER, cargado una vez por proceso."""
+    es_local = True
+
+    _gazetteer = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def gazetteer(cls):
+        with cls._lock:
+            if cls._gazetteer is None:
+                from .gazetteer import Gazetteer
+                ruta = getattr(settings, 'GEOCODIFICACION_GAZETTEER', None)
+                cls._gazetteer = Gazetteer.desde_fichero(ruta) if ruta else Gazetteer([])
+            return cls._gazetteer
+
+    def geocodificar(self, direccion):
+        return self.gazetteer().buscar(direccion)
+
+
+_backends = None
+
+
+def backends():
+    global _backends
+    if _backends is None:
+        rutas = getattr(settings, 'GEOCODIFICACION_BACKENDS', ['basketconecta.geocoding.GeocodificadorNominatim'])
+        _backends = [import_string(ruta)() for ruta in rutas]
+    return _backends
+
+
+def _consultar_locales(direccion):
+    for backend in backends():
+        if backend.es_local:
+            coordenadas = backend.geocodificar(direccion)
+            if coordenadas is not None:
+                return coordenadas
+    return None
+
+
+@contextmanager
+def antes_de_consultar(funcion):
+    """Dentro del bloque, llama a `funcion()` antes de cada consulta a un backend remoto."""
+    token = _antes_de_consultar.set(funcion)
+    try:
+        yield
+    finally:
+        _antes_de_consultar.reset(token)
+
+
+def _consultar_backend(backend, direccion):
+    if not backend.circuito.permitir():
+        geocodificacion_realizada.send(
+            sender=type(backend), backend=type(backend).__name__,
+            duracion=0.0, resultado='circuito_abierto', circuito=backend.circuito.estado,
+        )
+        raise GeocodificadorNoDisponible(f"Circuito abierto para {type(backend).__name__}")
+
+    esperar = _antes_de_consultar.get()
+    if esperar is not None:
+        esperar()
+    _incrementar('llamadas_geocodificador')
+    inicio = time.perf_counter()
+    try:
+        coordenadas = backend.geocodificar(direccion)
+    except Exception as e:
+        # Cualquier error del backend cuenta como caída para el circuito
+        backend.circuito.fallo()
+        resultado = 'no_disponible'
+        if isinstance(e, GeocodificadorNoDisponible):
+            raise
+        raise GeocodificadorNoDisponible(str(e)) from e
+    else:
+        backend.circuito.exito()
+        resultado = 'encontrada' if coordenadas is not None else 'no_encontrada'
+        return coordenadas
+    finally:
+        duracion = time.perf_counter() - inicio
+        with _contadores_lock:
+            _latencias.append(duracion)
+        geocodificacion_realizada.send(
+            sender=type(backend), backend=type(backend).__name__,
+            duracion=duracion, resultado=resultado, circuito=backend.circuito.estado,
+        )
+
+
+def _consultar_geocodificador(direccion):
+    """
+    Pregunta a los backends remotos en orden. Solo lanza
+    GeocodificadorNoDisponible si ninguno pudo responder.
+    """
+    no_disponible = None
+    respondio = False
+    for backend in backends():
+        if backend.es_local:
+            continue
+        try:
+            coordenadas = _consultar_backend(backend, direccion)
+        except GeocodificadorNoDisponible as e:
+            no_disponible = e
+            continue
+        respondio = True
+        if coordenadas is not None:
+            return coordenadas
+    if no_disponible is not None and not respondio:
+        raise no_disponible
+    return (None, None)
+
+
+def _ttl(coordenadas):
+    if coordenadas[0] is not None:
+        return getattr(settings, 'GEOCODIFICACION_TTL', TTL)
+    return getattr(settings, 'GEOCODIFICACION_TTL_NEGATIVO', TTL_NEGATIVO)
+
+
+def geocodificar(direccion):
+    """
+    Devuelve `(latitud, longitud)` de una dirección o `(None, None)` si no
+    existe. Consulta primero la LRU en memoria, luego los backends locales,
+    la tabla GeocodificacionCache y solo en último caso los backends remotos.
+
+    Si ningún backend remoto responde (caído, timeout o circuito abierto) se
+    devuelve el dato caducado de la caché si lo hay y, si no, se lanza
+    GeocodificadorNoDisponible.
+    """
+    clave = normalizar_direccion(direccion)
+    if not clave:
+        return (None, None)
+
+    coordenadas = _lru.obtener(clave)
+    if coordenadas is not None:
+        _incrementar('aciertos_memoria')
+        cache_consultada.send(sender=None, resultado='memoria')
+        return coordenadas
+
+    coordenadas = _consultar_locales(direccion)
+    if coordenadas is not None:
+        _incrementar('aciertos_local')
+        cache_consultada.send(sender=None, resultado='local')
+        _lru.guardar(clave, coordenadas, _ttl(coordenadas).total_seconds())
+        return coordenadas
+
+    from .models import GeocodificacionCache
+
+    fila = GeocodificacionCache.objects.filter(direccion=clave).first()
+    if fila is not None:
+        coordenadas = (fila.latitud, fila.longitud)
+        restante = (fila.actualizada + _ttl(coordenadas) - timezone.now()).total_seconds()
+        if restante > 0:
+            _incrementar('aciertos_bd')
+            cache_consultada.send(sender=None, resultado='bd')
+            _lru.guardar(clave, coordenadas, restante)
+            return coordenadas
+
+    _incrementar('fallos')
+    cache_consultada.send(sender=None, resultado='fallo')
+    try:
+        coordenadas = _consultar_geocodificador(direccion)
+    except GeocodificadorNoDisponible:
+        # Mejor un dato caducado que ninguno; los fallos de red no se cachean
+        if fila is not None:
+            return (fila.latitud, fila.longitud)
+        raise
+
+    GeocodificacionCache.objects.update_or_create(
+        direccion=clave,
+        defaults={
+            'latitud': coordenadas[0],
+            'longitud': coordenadas[1],
+            'encontrada': coordenadas[0] is not None,
+        },
+    )
+    _lru.guardar(clave, coordenadas, _ttl(coordenadas).total_seconds())
+    return coordenadas
+
+
+def geocodificar_direccion(direccion):
+    """
+    Como `geocodificar`, pero sin excepciones: devuelve `(None, None)` también
+    cuando el geocodificador no está disponible.
+    """
+    try:
+        return geocodificar(direccion)
+    except GeocodificadorNoDisponible:
+        return (None, None)
@@ -0,0 +1,190 @@
+import json
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.dispatch import receiver
+
+from .geocoding import geocodificacion_realizada
+
+
+logger = logging.getLogger(__name__)
+logger_lentas = logging.getLogger(f'{__name__}.lentas')
+
+UMBRAL_LENTO_MS = 500
+MUESTREO_LENTAS = 1.0
+CONSULTAS_LENTAS = 5
+
+# Medición de la petición en curso; None fuera de MedicionMiddleware
+_medicion = ContextVar('medicion', default=None)
+# True mientras un SerializacionMedidaMixin está midiendo
+_serializando = ContextVar('serializando', default=False)
+
+
+class Medicion:
+    """Lo que se acumula durante una petición: consultas, geocodificador y serializadores."""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        # (sql, parámetros, segundos) de cada consulta, en orden
+        self.consultas = []
+        self.geocodificador = 0.0
+        self.llamadas_geocodificador = 0
+        self.serializacion = 0.0
+
+    def registrar_consulta(self, execute, sql, params, many, context):
+        # execute_wrapper de Django: envuelve cada consulta de la conexión
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.consultas.append((sql, params, time.perf_counter() - inicio))
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.inicio
+
+    @property
+    def tiempo_bd(self):
+        return sum(duracion for _, _, duracion in self.consultas)
+
+    @property
+    def duplicadas(self):
+        """Consultas repetidas con el mismo SQL y los mismos parámetros."""
+        vistas = Counter((sql, repr(params)) for sql, params, _ in self.consultas)
+        return sum(n - 1 for n in vistas.values())
+
+    def peores_consultas(self, n):
+        """Las `n` sentencias que más tiempo suman, agrupando las que solo cambian en parámetros."""
+        por_sql = defaultdict(lambda: [0, 0.0])
+        for sql, _, duracion in self.consultas:
+            por_sql[sql][0] += 1
+            por_sql[sql][1] += duracion
+        peores = sorted(por_sql.items(), key=lambda item: item[1][1], reverse=True)[:n]
+        return [
+            {'sql': sql, 'veces': veces, 'ms': round(segundos * 1000, 2)}
+            for sql, (veces, segundos) in peores
+        ]
+
+
+def medicion_actual():
+    return _medicion.get()
+
+
+def nombre_vista(request):
+    """
+    Vista que atendió la petición como 'Clase.accion' (`MensajeViewSet.create`,
+    `AnunciosCercanosView.get`), o None si la URL no resolvió.
+    """
+    coincidencia = getattr(request, 'resolver_match', None)
+    if coincidencia is None:
+        return None
+    funcion = coincidencia.func
+    clase = getattr(funcion, 'cls', None)
+    if clase is None:
+        return coincidencia.view_name or funcion.__name__
+    metodo = request.method.lower()
+    # Los ViewSets traducen el método HTTP a su acción (list, create, bandeja...)
+    accion = (getattr(funcion, 'actions', None) or {}).get(metodo, metodo)
+    return f'{clase.__name__}.{accion}'
+
+
+def server_timing(medicion):
+    """Cabecera Server-Timing con los tiempos de la medición en milisegundos."""
+    consultas = len(medicion.consultas)
+    metricas = [
+        f'db;dur={medicion.tiempo_bd * 1000:.1f};desc="{consultas} consultas, {medicion.duplicadas} duplicadas"',
+        f'geo;dur={medicion.geocodificador * 1000:.1f};desc="{medicion.llamadas_geocodificador} llamadas"',
+        f'ser;dur={medicion.serializacion * 1000:.1f}',
+        f'total;dur={medicion.total * 1000:.1f}',
+    ]
+    return ', '.join(metricas)
+
+
+class MedicionMiddleware:
+    """
+    Mide cada petición: número de consultas SQL, tiempo en base de datos,
+    consultas duplicadas, tiempo en el geocodificador y en los serializadores.
+    Lo devuelve en la cabecera Server-Timing y en una línea JSON del logger
+    `basketconecta.instrumentacion`. Las peticiones más lentas que
+    INSTRUMENTACION_UMBRAL_LENTO_MS se escriben, muestreadas, en
+    `basketconecta.instrumentacion.lentas` con sus peores consultas.
+
+    Solo se carga con INSTRUMENTACION_ACTIVA = True.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'INSTRUMENTACION_ACTIVA', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.umbral_lento = getattr(settings, 'INSTRUMENTACION_UMBRAL_LENTO_MS', UMBRAL_LENTO_MS) / 1000
+        self.muestreo = getattr(settings, 'INSTRUMENTACION_MUESTREO_LENTAS', MUESTREO_LENTAS)
+        self.consultas_lentas = getattr(settings, 'INSTRUMENTACION_CONSULTAS_LENTAS', CONSULTAS_LENTAS)
+
+    def __call__(self, request):
+        medicion = Medicion()
+        token = _medicion.set(medicion)
+        try:
+            with ExitStack() as pila:
+                for conexion in connections.all():
+                    pila.enter_context(conexion.execute_wrapper(medicion.registrar_consulta))
+                response = self.get_response(request)
+        finally:
+            _medicion.reset(token)
+
+        response['Server-Timing'] = server_timing(medicion)
+        datos = self._datos(request, response, medicion)
+        logger.info(json.dumps(datos))
+        if medicion.total >= self.umbral_lento and random.random() < self.muestreo:
+            datos['peores_consultas'] = medicion.peores_consultas(self.consultas_lentas)
+            logger_lentas.warning(json.dumps(datos))
+        return response
+
+    def _datos(self, request, response, medicion):
+        return {
+            'metodo': request.method,
+            'ruta': request.path,
+            'vista': nombre_vista(request),
+            'estado': response.status_code,
+            'total_ms': round(medicion.total * 1000, 1),
+            'consultas': len(medicion.consultas),
+            'duplicadas': medicion.duplicadas,
+            'bd_ms': round(medicion.tiempo_bd * 1000, 1),
+            'geocodificador_ms': round(medicion.geocodificador * 1000, 1),
+            'serializacion_ms': round(medicion.serializacion * 1000, 1),
+        }
+
+
+@receiver(geocodificacion_realizada)
+def _geocodificacion_realizada(sender, duracion, **kwargs):
+    medicion = _medicion.get()
+    if medicion is not None:
+        medicion.geocodificador += duracion
+        medicion.llamadas_geocodificador += 1
+
+
+class SerializacionMedidaMixin:
+    """
+    Suma a la medición en curso el tiempo de `to_representation`. Solo cuenta
+    el serializador más externo: los anidados ya están dentro de su tiempo, y
+    con many=True se suma cada elemento. Las consultas perezosas que se lancen
+    al serializar cuentan también como tiempo de BD.
+    """
+
+    def to_representation(self, instance):
+        medicion = _medicion.get()
+        if medicion is None or _serializando.get():
+            return super().to_representation(instance)
+        token = _serializando.set(True)
+        inicio = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            medicion.serializacion += time.perf_counter() - inicio
+            _serializando.reset(token)
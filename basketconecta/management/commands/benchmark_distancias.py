@@ -0,0 +1,72 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from haversine import haversine, Unit
+
+from basketconecta.geo import distancias_km, seleccionar_cercanos
+
+
+LAT_MIN, LAT_MAX = 36.0, 43.8
+LON_MIN, LON_MAX = -9.3, 3.3
+
+CENTRO = (40.4168, -3.7038)  # Madrid
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara el cálculo de distancias de anuncios-cercanos con un bucle de "
+        "haversine() por anuncio frente a la versión vectorizada con NumPy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', nargs='+', type=int, default=[10000, 100000, 1000000])
+        parser.add_argument('--radio', type=float, default=10.0, help='Radio de búsqueda en km')
+        parser.add_argument('--k', type=int, default=20, help='Número de anuncios más cercanos')
+        parser.add_argument('--repeticiones', type=int, default=3)
+        parser.add_argument('--semilla', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['semilla'])
+        radio = options['radio']
+        k = options['k']
+        self.stdout.write(f"{'anuncios':>10} {'bucle (ms)':>12} {'numpy (ms)':>12} {'mejora':>8}")
+        for tamano in options['tamanos']:
+            lats = rng.uniform(LAT_MIN, LAT_MAX, tamano)
+            lons = rng.uniform(LON_MIN, LON_MAX, tamano)
+            # Las filas llegan de la base de datos como tuplas de floats
+            filas = list(zip(lats.tolist(), lons.tolist()))
+
+            bucle, esperado = self._medir(lambda: self._bucle(filas, radio, k), options['repeticiones'])
+            vectorizado, obtenido = self._medir(lambda: self._vectorizado(filas, radio, k), options['repeticiones'])
+            if esperado != obtenido:
+                self.stderr.write(f"Resultados distintos con {tamano} anuncios")
+            self.stdout.write(f"{tamano:>10} {bucle:>12.2f} {vectorizado:>12.2f} {bucle / vectorizado:>7.1f}x")
+
+    def _medir(self, funcion, repeticiones):
+        tiempos = []
+        resultado = None
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            resultado = funcion()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        return min(tiempos), resultado
+
+    def _bucle(self, filas, radio, k):
+        # Equivalente al cálculo anterior de AnunciosCercanosView
+        cercanos = []
+        for i, (lat, lon) in enumerate(filas):
+            distancia = haversine(
+                (float(CENTRO[0]), float(CENTRO[1])),
+                (float(lat), float(lon)),
+                unit=Unit.KILOMETERS
+            )
+            if distancia <= radio:
+                cercanos.append((distancia, i))
+        cercanos.sort()
+        return [i for _, i in cercanos[:k]]
+
+    def _vectorizado(self, filas, radio, k):
+        coordenadas = np.array(filas, dtype=np.float64).reshape(-1, 2)
+        distancias = distancias_km(CENTRO[0], CENTRO[1], coordenadas[:, 0], coordenadas[:, 1])
+        return seleccionar_cercanos(distancias, radio, k=k).tolist()
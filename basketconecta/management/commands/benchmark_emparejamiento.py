@@ -0,0 +1,120 @@
+import random
+import time
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from basketconecta import emparejamiento
+from basketconecta.disponibilidad import TODA_LA_SEMANA
+from basketconecta.geo import geohash
+from basketconecta.models import AnuncioEquipo, AnuncioJugador, Emparejamiento, Equipo, Jugador
+
+
+# Rectángulo aproximado de la península
+LAT_MIN, LAT_MAX = 36.0, 43.8
+LON_MIN, LON_MAX = -9.3, 3.3
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el emparejamiento jugador-equipo tal como lo usa la API: la "
+        "reconstrucción de la tabla, la lectura de recomendaciones por su índice "
+        "y el recálculo incremental al guardar un anuncio. Los datos se crean "
+        "dentro de una transacción que se deshace al terminar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', nargs='+', type=int, default=[1000, 10000],
+                            help='Anuncios de jugador y de equipo que se crean')
+        parser.add_argument('--n', type=int, default=10, help='Recomendaciones por consulta')
+        parser.add_argument('--consultas', type=int, default=200)
+        parser.add_argument('--semilla', type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options['semilla'])
+        self.stdout.write(
+            f"{'anuncios':>10} {'filas':>10} {'reconstruir (s)':>16} {'lectura (ms)':>13} {'p95 (ms)':>10} "
+            f"{'jugador (ms)':>13} {'equipo (ms)':>12}"
+        )
+        for tamano in options['tamanos']:
+            with transaction.atomic():
+                jugadores, equipos = self._poblar(tamano)
+                inicio = time.perf_counter()
+                filas = emparejamiento.reconstruir()
+                reconstruccion = time.perf_counter() - inicio
+
+                muestra = range(options['consultas'])
+                lectura = self._medir(lambda: self._recomendaciones(random.choice(jugadores), options['n']), muestra)
+                # Lo que cuesta cada guardado de un anuncio (señales post_save)
+                incremental_jugador = self._medir(lambda: emparejamiento.emparejar_jugador(random.choice(jugadores)), muestra)
+                incremental_equipo = self._medir(lambda: emparejamiento.emparejar_equipo(random.choice(equipos)), muestra)
+
+                self.stdout.write(
+                    f"{tamano:>10} {filas:>10} {reconstruccion:>16.2f} {np.median(lectura):>13.2f} "
+                    f"{np.percentile(lectura, 95):>10.2f} {np.median(incremental_jugador):>13.2f} "
+                    f"{np.median(incremental_equipo):>12.2f}"
+                )
+                transaction.set_rollback(True)
+
+    def _medir(self, funcion, muestra):
+        tiempos = []
+        for _ in muestra:
+            inicio = time.perf_counter()
+            funcion()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        return tiempos
+
+    def _recomendaciones(self, anuncio_jugador_id, n):
+        # La misma consulta que RecomendacionesView
+        return list(
+            Emparejamiento.objects.filter(anuncio_jugador_id=anuncio_jugador_id)
+            .select_related('anuncio_equipo').order_by('-puntuacion', 'anuncio_equipo')[:n]
+        )
+
+    def _poblar(self, tamano, lote=5000):
+        # bulk_create no lanza señales: la tabla se llena después con reconstruir()
+        prefijo = f"bench-{time.time_ns()}"
+        sexos = [sexo for sexo, _ in Jugador.SEXOS]
+        niveles = [nivel for nivel, _ in Jugador.NIVELES]
+        sexos_equipo = [sexo for sexo, _ in Equipo.SEXOS]
+        jugadores, equipos = [], []
+        for inicio in range(0, tamano, lote):
+            fin = min(inicio + lote, tamano)
+            usuarios = User.objects.bulk_create(
+                [User(username=f"{prefijo}-{i}") for i in range(inicio, fin)]
+            )
+            creados = Jugador.objects.bulk_create([
+                Jugador(
+                    user=u, nombre=u.username, edad=25, altura='1.80', posicion='base',
+                    direccion='benchmark', nivel=random.choice(niveles), correo='benchmark@example.com',
+                    sexo=random.choice(sexos),
+                    latitud=random.uniform(LAT_MIN, LAT_MAX), longitud=random.uniform(LON_MIN, LON_MAX),
+                )
+                for u in usuarios
+            ])
+            jugadores += [a.pk for a in AnuncioJugador.objects.bulk_create([
+                AnuncioJugador(
+                    jugador=jugador, disponibilidad_dia='indiferente', disponibilidad_horaria='indiferente',
+                    disponibilidad=random.randint(1, TODA_LA_SEMANA), sexo='indiferente',
+                )
+                for jugador in creados
+            ])]
+            creados = Equipo.objects.bulk_create([
+                Equipo(creador=u, nombre=u.username, categoria='senior', primera_camiseta='blanca',
+                       primera_pantalon='negro', sexo=random.choice(sexos_equipo))
+                for u in usuarios
+            ])
+            anuncios = []
+            for equipo in creados:
+                lat = random.uniform(LAT_MIN, LAT_MAX)
+                lon = random.uniform(LON_MIN, LON_MAX)
+                anuncios.append(AnuncioEquipo(
+                    equipo=equipo, dia_partido='indiferente', horario_partido='indiferente',
+                    disponibilidad_partido=random.randint(1, TODA_LA_SEMANA),
+                    direccion_partido='benchmark', latitud_partido=lat, longitud_partido=lon,
+                    celda_partido=geohash(lat, lon),
+                ))
+            equipos += [a.pk for a in AnuncioEquipo.objects.bulk_create(anuncios)]
+        return jugadores, equipos
@@ -0,0 +1,83 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from basketconecta.models import AnuncioEquipo, Equipo, Jugador
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide la latencia y el número de consultas de mis-equipos y "
+        "mis-equipos-creados para un usuario en 1, 20 y 200 equipos. Los datos "
+        "se crean dentro de una transacción que se deshace al terminar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--equipos', nargs='+', type=int, default=[1, 20, 200])
+        parser.add_argument('--plantilla', type=int, default=10, help='Jugadores por equipo')
+        parser.add_argument('--repeticiones', type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'equipos':>8} {'endpoint':<26} {'consultas':>10} {'ms':>8}")
+        for n in options['equipos']:
+            with transaction.atomic():
+                usuario = self._crear_datos(n, options['plantilla'])
+                client = APIClient()
+                client.force_authenticate(usuario)
+                for url in ('/api/mis-equipos/', '/api/mis-equipos-creados/'):
+                    consultas, ms = self._medir(client, url, options['repeticiones'])
+                    self.stdout.write(f"{n:>8} {url:<26} {consultas:>10} {ms:>8.1f}")
+                transaction.set_rollback(True)
+
+    def _medir(self, client, url, repeticiones):
+        tiempos = []
+        for _ in range(repeticiones):
+            with CaptureQueriesContext(connection) as consultas:
+                inicio = time.perf_counter()
+                respuesta = client.get(url, HTTP_HOST='localhost')
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            assert respuesta.status_code == 200, respuesta.status_code
+        return len(consultas), min(tiempos)
+
+    def _crear_datos(self, n, plantilla):
+        # bulk_create y la tabla intermedia directamente: sin señales ni geocodificación
+        usuario = User.objects.create(username='benchmark_equipos')
+        usuarios = User.objects.bulk_create(
+            [User(username=f'benchmark_equipos_{i}') for i in range(n * plantilla)]
+        )
+        jugadores = Jugador.objects.bulk_create([
+            Jugador(
+                user=u, nombre=u.username, edad=25, altura='1.80', posicion='base',
+                direccion='benchmark', nivel='intermedio', correo='benchmark@example.com',
+                sexo='masculino', latitud=40.4, longitud=-3.7,
+            )
+            for u in [usuario] + usuarios
+        ])
+        equipos = Equipo.objects.bulk_create([
+            Equipo(
+                creador=usuario, nombre=f'Equipo {i}', categoria='senior',
+                primera_camiseta='blanca', primera_pantalon='negro', sexo='mixto',
+            )
+            for i in range(n)
+        ])
+        AnuncioEquipo.objects.bulk_create([
+            AnuncioEquipo(
+                equipo=equipo, dia_partido='sabado', horario_partido='manana', disponibilidad_partido=1 << 10,
+                direccion_partido='benchmark', latitud_partido=40.4, longitud_partido=-3.7,
+            )
+            for equipo in equipos
+        ])
+        plantillas = []
+        for i, equipo in enumerate(equipos):
+            # El usuario juega en todos sus equipos
+            plantillas.append(Equipo.jugadores.through(equipo=equipo, jugador=jugadores[0]))
+            plantillas.extend(
+                Equipo.jugadores.through(equipo=equipo, jugador=jugador)
+                for jugador in jugadores[1 + i * plantilla:1 + (i + 1) * plantilla]
+            )
+        Equipo.jugadores.through.objects.bulk_create(plantillas)
+        return usuario
@@ -0,0 +1,91 @@
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from basketconecta.gazetteer import Gazetteer
+
+
+TIPOS_VIA = ['calle', 'avenida', 'plaza', 'paseo', 'camino', 'ronda', 'travesia']
+SILABAS = ['ma', 'dri', 'val', 'le', 'sa', 'ra', 'go', 'za', 'to', 'le', 'do', 'bur', 'gos', 'al', 'ca', 'la', 'ri', 'o', 'ja', 'ne', 'vi', 'lla', 'nue', 'va']
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera un gazetteer sintético del tamaño de un país y mide el tiempo de "
+        "carga, la memoria del índice y la latencia de las búsquedas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--municipios', type=int, default=8000)
+        parser.add_argument('--calles', type=int, default=1000000)
+        parser.add_argument('--busquedas', type=int, default=20000)
+        parser.add_argument('--semilla', type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options['semilla'])
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, 'gazetteer.tsv')
+            direcciones = self._generar(ruta, options['municipios'], options['calles'])
+            self.stdout.write(f"Fichero: {os.path.getsize(ruta) / 2 ** 20:.1f} MiB")
+
+            inicio = time.perf_counter()
+            gazetteer = Gazetteer.desde_fichero(ruta)
+            carga = time.perf_counter() - inicio
+            self.stdout.write(f"Entradas: {len(gazetteer)}")
+            self.stdout.write(f"Carga: {carga:.2f} s")
+
+            del gazetteer
+            tracemalloc.start()
+            gazetteer = Gazetteer.desde_fichero(ruta)
+            memoria, pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stdout.write(f"Memoria del índice: {memoria / 2 ** 20:.1f} MiB (pico durante la carga {pico / 2 ** 20:.1f} MiB)")
+
+        muestra = random.sample(direcciones, min(options['busquedas'], len(direcciones)))
+        self._medir("exacta (calle, portal, municipio)", gazetteer, muestra)
+        self._medir("código postal", gazetteer, [f"Calle Inexistente 1, {d.split(', ')[-1].split()[0]} Pueblo Perdido" for d in muestra])
+        self._medir("con errata (aproximada)", gazetteer, [self._errata(d) for d in muestra[:2000]])
+
+    def _nombre(self):
+        return ''.join(random.choice(SILABAS) for _ in range(random.randint(2, 4))).capitalize()
+
+    def _generar(self, ruta, n_municipios, n_calles):
+        municipios = []
+        nombres = set()
+        with open(ruta, 'w', encoding='utf-8') as fichero:
+            for i in range(n_municipios):
+                nombre = f"{self._nombre()} {self._nombre()}"
+                while nombre in nombres:
+                    nombre = f"{self._nombre()} {self._nombre()}"
+                nombres.add(nombre)
+                codigo_postal = f"{(i % 52) + 1:02d}{i % 1000:03d}"
+                lat, lon = random.uniform(36.0, 43.8), random.uniform(-9.3, 3.3)
+                municipios.append((nombre, codigo_postal, lat, lon))
+                fichero.write(f"{nombre}\t{lat:.6f}\t{lon:.6f}\n")
+                fichero.write(f"{codigo_postal}\t{lat:.6f}\t{lon:.6f}\n")
+            direcciones = []
+            for _ in range(n_calles):
+                municipio, codigo_postal, lat, lon = random.choice(municipios)
+                calle = f"{random.choice(TIPOS_VIA).capitalize()} {self._nombre()} {self._nombre()}"
+                fichero.write(f"{calle}, {municipio}\t{lat + random.uniform(-.02, .02):.6f}\t{lon + random.uniform(-.02, .02):.6f}\n")
+                direcciones.append(f"{calle} {random.randint(1, 200)}, {codigo_postal} {municipio}")
+        return direcciones
+
+    def _errata(self, direccion):
+        calle = direccion.split(',')[0]
+        i = random.randrange(len(calle) // 2, len(calle) - 1)
+        return calle[:i] + calle[i + 1:] + ',' + direccion.split(',', 1)[1]
+
+    def _medir(self, nombre, gazetteer, direcciones):
+        inicio = time.perf_counter()
+        resultados = [gazetteer.buscar(d) for d in direcciones]
+        total = time.perf_counter() - inicio
+        encontradas = sum(1 for r in resultados if r is not None)
+        self.stdout.write(
+            f"Búsqueda {nombre}: {total / len(direcciones) * 1e6:.1f} µs de media, "
+            f"{encontradas}/{len(direcciones)} resueltas"
+        )
@@ -0,0 +1,94 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from basketconecta.disponibilidad import desde_opciones
+from basketconecta.geo import geohash, haversine_km
+from basketconecta.models import Equipo, AnuncioEquipo
+
+
+# Rectángulo aproximado de la península
+LAT_MIN, LAT_MAX = 36.0, 43.8
+LON_MIN, LON_MAX = -9.3, 3.3
+
+CENTRO = (40.4168, -3.7038)  # Madrid
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el tiempo de una búsqueda por radio de anuncios de equipo con y sin "
+        "el índice de celdas geohash. Los datos se crean dentro de una transacción "
+        "que se deshace al terminar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', nargs='+', type=int, default=[1000, 100000, 1000000])
+        parser.add_argument('--radio', type=float, default=10.0, help='Radio de búsqueda en km')
+        parser.add_argument('--repeticiones', type=int, default=5)
+        parser.add_argument('--semilla', type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options['semilla'])
+        radio = options['radio']
+        self.stdout.write(f"{'anuncios':>10} {'escaneo (ms)':>14} {'indice (ms)':>13} {'resultados':>11}")
+        for tamano in options['tamanos']:
+            with transaction.atomic():
+                self._poblar(tamano)
+                escaneo, n_escaneo = self._medir(self._escaneo_completo, radio, options['repeticiones'])
+                indice, n_indice = self._medir(self._con_indice, radio, options['repeticiones'])
+                if n_escaneo != n_indice:
+                    self.stderr.write(f"Resultados distintos: escaneo={n_escaneo} indice={n_indice}")
+                self.stdout.write(f"{tamano:>10} {escaneo:>14.2f} {indice:>13.2f} {n_indice:>11}")
+                transaction.set_rollback(True)
+
+    def _poblar(self, tamano, lote=5000):
+        prefijo = f"bench-{time.time_ns()}"
+        for inicio in range(0, tamano, lote):
+            fin = min(inicio + lote, tamano)
+            usuarios = User.objects.bulk_create(
+                [User(username=f"{prefijo}-{i}") for i in range(inicio, fin)]
+            )
+            equipos = Equipo.objects.bulk_create([
+                Equipo(creador=u, nombre=u.username, categoria='senior',
+                       primera_camiseta='blanca', primera_pantalon='negro', sexo='mixto')
+                for u in usuarios
+            ])
+            anuncios = []
+            for equipo in equipos:
+                lat = random.uniform(LAT_MIN, LAT_MAX)
+                lon = random.uniform(LON_MIN, LON_MAX)
+                # bulk_create no llama a save(), se calculan la celda y la disponibilidad a mano
+                anuncios.append(AnuncioEquipo(
+                    equipo=equipo, dia_partido='sabado', horario_partido='manana',
+                    disponibilidad_partido=desde_opciones('sabado', 'manana'),
+                    direccion_partido='benchmark', latitud_partido=lat, longitud_partido=lon,
+                    celda_partido=geohash(lat, lon),
+                ))
+            AnuncioEquipo.objects.bulk_create(anuncios)
+
+    def _medir(self, funcion, radio, repeticiones):
+        tiempos = []
+        resultado = None
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            resultado = funcion(radio)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        return min(tiempos), resultado
+
+    def _escaneo_completo(self, radio):
+        lat, lon = CENTRO
+        filas = AnuncioEquipo.objects.values_list('latitud_partido', 'longitud_partido')
+        return sum(
+            1 for lat_p, lon_p in filas
+            if lat_p is not None and haversine_km(lat, lon, lat_p, lon_p) <= radio
+        )
+
+    def _con_indice(self, radio):
+        lat, lon = CENTRO
+        filas = AnuncioEquipo.objects.candidatos_partido(lat, lon, radio).values_list(
+            'latitud_partido', 'longitud_partido'
+        )
+        return sum(1 for lat_p, lon_p in filas if haversine_km(lat, lon, lat_p, lon_p) <= radio)
@@ -0,0 +1,99 @@
+import asyncio
+import statistics
+import time
+import tracemalloc
+
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.tokens import AccessToken
+
+from basketconecta.models import Chat, Equipo, Jugador, Mensaje
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga de los websockets de chat dentro de un proceso: abre N "
+        "conexiones autenticadas a un mismo chat con la aplicación ASGI completa y "
+        "mide el tiempo de conexión, la latencia de reparto de cada mensaje nuevo "
+        "a todas ellas y, con --memoria, la memoria por conexión. Los datos se "
+        "crean al empezar y se borran al terminar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conexiones', nargs='+', type=int, default=[100, 1000, 5000])
+        parser.add_argument('--mensajes', type=int, default=20)
+        parser.add_argument(
+            '--memoria', action='store_true',
+            help='Mide la memoria por conexión con tracemalloc (hace más lenta la conexión)',
+        )
+
+    def handle(self, *args, **options):
+        from basket.asgi import application
+
+        usuario, chat = self._crear_datos()
+        try:
+            token = str(AccessToken.for_user(usuario))
+            self.stdout.write(
+                f"{'conexiones':>10} {'conectar (s)':>13} {'KB/conexión':>12} "
+                f"{'reparto p50 (ms)':>17} {'reparto p99 (ms)':>17} {'entregas/s':>11}"
+            )
+            for n in options['conexiones']:
+                fila = asyncio.run(self._medir(application, chat, usuario, token, n, options))
+                self.stdout.write(
+                    f"{n:>10} {fila['conectar']:>13.2f} {fila['kb']:>12.1f} "
+                    f"{fila['p50']:>17.1f} {fila['p99']:>17.1f} {fila['entregas']:>11.0f}"
+                )
+        finally:
+            User.objects.filter(username__startswith='benchmark_websockets').delete()
+
+    async def _medir(self, application, chat, usuario, token, n, options):
+        url = f'/ws/chats/{chat.id}/?token={token}'
+        cabeceras = [(b'origin', b'http://localhost')]
+
+        if options['memoria']:
+            tracemalloc.start()
+        inicio = time.perf_counter()
+        comunicadores = [WebsocketCommunicator(application, url, headers=cabeceras) for _ in range(n)]
+        resultados = await asyncio.gather(*(c.connect(timeout=60) for c in comunicadores))
+        conectar = time.perf_counter() - inicio
+        kb = float('nan')
+        if options['memoria']:
+            kb = tracemalloc.get_traced_memory()[0] / 1024 / n
+            tracemalloc.stop()
+        if not all(conectado for conectado, _ in resultados):
+            raise RuntimeError(f"{sum(not c for c, _ in resultados)} conexiones rechazadas")
+
+        crear = sync_to_async(Mensaje.objects.create)
+        latencias = []
+        inicio_total = time.perf_counter()
+        for i in range(options['mensajes']):
+            inicio = time.perf_counter()
+            await crear(chat=chat, emisor=usuario, contenido=f'mensaje {i}')
+            # Cuánto tarda el mensaje en llegar a la última conexión
+            await asyncio.gather(*(c.receive_json_from(timeout=60) for c in comunicadores))
+            latencias.append((time.perf_counter() - inicio) * 1000)
+        entregas = n * options['mensajes'] / (time.perf_counter() - inicio_total)
+
+        await asyncio.gather(*(c.disconnect() for c in comunicadores))
+        return {
+            'conectar': conectar,
+            'kb': kb,
+            'p50': statistics.median(latencias),
+            'p99': statistics.quantiles(latencias, n=100)[98] if len(latencias) > 1 else latencias[0],
+            'entregas': entregas,
+        }
+
+    def _crear_datos(self):
+        usuario = User.objects.create(username='benchmark_websockets')
+        jugador = Jugador.objects.create(
+            user=User.objects.create(username='benchmark_websockets_jugador'), nombre='benchmark', edad=25,
+            altura='1.80', posicion='base', direccion='benchmark', nivel='intermedio',
+            correo='benchmark@example.com', sexo='masculino', latitud=40.4, longitud=-3.7,
+        )
+        equipo = Equipo.objects.create(
+            creador=usuario, nombre='benchmark', categoria='senior',
+            primera_camiseta='blanca', primera_pantalon='negro', sexo='mixto',
+        )
+        return usuario, Chat.objects.create(jugador=jugador, equipo=equipo)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from basketconecta.emparejamiento import comprobar, emparejar_jugador
+
+
+class Command(BaseCommand):
+    help = (
+        "Comprueba que la tabla de emparejamientos coincide con las parejas "
+        "recalculadas desde cero y, con --reparar, rehace los anuncios afectados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reparar', action='store_true')
+
+    def handle(self, *args, **options):
+        resultado = comprobar()
+        afectados = resultado['anuncios_jugador']
+        self.stdout.write(
+            f"Faltan {resultado['faltan']}, sobran {resultado['sobran']}, "
+            f"con otra puntuación {resultado['distintas']} "
+            f"({len(afectados)} anuncios de jugador afectados)"
+        )
+        if not afectados:
+            return
+        if not options['reparar']:
+            raise CommandError("La tabla de emparejamientos no es consistente.")
+        for anuncio_jugador_id in afectados:
+            emparejar_jugador(anuncio_jugador_id)
+        self.stdout.write(f"{len(afectados)} anuncios de jugador reparados")
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from basketconecta.cola_geocodificacion import procesar_pendientes
+
+
+class Command(BaseCommand):
+    help = "Geocodifica los jugadores y anuncios de equipo que están pendientes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limite', type=int, default=None, help='Máximo de filas a procesar')
+        parser.add_argument(
+            '--continuo', action='store_true',
+            help='No terminar: seguir drenando la cola cada --espera segundos',
+        )
+        parser.add_argument('--espera', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        while True:
+            procesadas = procesar_pendientes(limite=options['limite'])
+            if procesadas:
+                self.stdout.write(f"{procesadas} filas geocodificadas")
+            if not options['continuo']:
+                break
+            time.sleep(options['espera'])
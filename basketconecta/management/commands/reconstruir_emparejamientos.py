@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from basketconecta.emparejamiento import reconstruir
+
+
+class Command(BaseCommand):
+    help = "Recalcula desde cero la tabla de emparejamientos entre anuncios de jugador y de equipo."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=5000, help='Filas por bulk_create')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        total = reconstruir(lote=options['lote'])
+        self.stdout.write(f"{total} emparejamientos creados en {time.perf_counter() - inicio:.1f} s")
@@ -0,0 +1,250 @@
+from math import floor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, F, Q
+from django.db.models.functions import Floor
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import cola_geocodificacion, metricas
+
+
+ZOOM_MAXIMO = 20
+# Celdas de agrupación por tesela de 256 px (una cada 64 px)
+CELDAS_POR_TESELA = 4
+# Lado, en celdas, de los bloques en que se cachea la rejilla
+CELDAS_POR_BLOQUE = 16
+# Bloques que puede leer una petición; con cajas mayores se agrupa a menos zoom
+MAX_BLOQUES = 1024
+# A partir de este zoom se devuelven los anuncios sueltos si no pasan de MAX_PUNTOS
+ZOOM_PUNTOS = 14
+MAX_PUNTOS = 500
+CACHE_TIMEOUT = 600
+
+_CLAVE_VERSION = 'mapa:version'
+
+# (tipo, campo de latitud, campo de longitud) de cada clase de anuncio
+CAPAS = [
+    ('equipos', 'latitud_partido', 'longitud_partido'),
+    ('jugadores', 'jugador__latitud', 'jugador__longitud'),
+]
+
+
+def _anuncios(tipo):
+    from .models import AnuncioEquipo, AnuncioJugador
+
+    if tipo == 'equipos':
+        return AnuncioEquipo.objects.exclude(estado_geocodificacion=cola_geocodificacion.PENDIENTE)
+    return AnuncioJugador.objects.exclude(jugador__estado_geocodificacion=cola_geocodificacion.PENDIENTE)
+
+
+def tamano_celda(zoom):
+    """Lado en grados de las celdas de agrupación a ese zoom."""
+    return 360.0 / (2 ** zoom * CELDAS_POR_TESELA)
+
+
+def _agregar(zoom):
+    """
+    Celdas con anuncios a ese zoom: `{(x, y): [equipos, jugadores, lat, lon]}`,
+    con el centroide de los anuncios de cada celda. Una consulta GROUP BY por capa.
+    """
+    tamano = tamano_celda(zoom)
+    celdas = {}
+    for tipo, campo_lat, campo_lon in CAPAS:
+        filas = (
+            _anuncios(tipo)
+            .filter(**{f'{campo_lat}__isnull': False, f'{campo_lon}__isnull': False})
+            .annotate(x=Floor(F(campo_lon) / tamano), y=Floor(F(campo_lat) / tamano))
+            .values('x', 'y')
+            .annotate(cantidad=Count('id'), lat=Avg(campo_lat), lon=Avg(campo_lon))
+            .order_by()
+        )
+        for fila in filas:
+            celda = celdas.setdefault((int(fila['x']), int(fila['y'])), [0, 0, 0.0, 0.0])
+            total = celda[0] + celda[1]
+            n = fila['cantidad']
+            # Centroide ponderado de las dos capas
+            celda[2] = (celda[2] * total + fila['lat'] * n) / (total + n)
+            celda[3] = (celda[3] * total + fila['lon'] * n) / (total + n)
+            celda[0 if tipo == 'equipos' else 1] += n
+    return celdas
+
+
+def _bloques(zoom):
+    """Rejilla del zoom repartida en bloques de CELDAS_POR_BLOQUE x CELDAS_POR_BLOQUE celdas."""
+    bloques = {}
+    for (x, y), celda in _agregar(zoom).items():
+        bloques.setdefault((x // CELDAS_POR_BLOQUE, y // CELDAS_POR_BLOQUE), []).append(celda)
+    return bloques
+
+
+def _rangos_x(caja, tamano):
+    lon_min, _, lon_max, _ = caja
+    if lon_min <= lon_max:
+        return [(floor(lon_min / tamano), floor(lon_max / tamano))]
+    # La caja cruza el antimeridiano
+    return [(floor(lon_min / tamano), floor(180.0 / tamano)), (floor(-180.0 / tamano), floor(lon_max / tamano))]
+
+
+def celdas(caja, zoom):
+    """
+    Celdas agregadas de los bloques que tocan la caja: `[equipos, jugadores, lat, lon]`.
+
+    La rejilla de cada zoom se calcula una vez y se cachea por bloques, así
+    que cada petición solo lee los bloques de su caja. Las claves llevan la
+    versión del mapa, que sube con cada cambio de un anuncio.
+    """
+    version = cache.get_or_set(_CLAVE_VERSION, 1, timeout=None)
+    prefijo = f'mapa:{version}:{zoom}'
+    timeout = getattr(settings, 'MAPA_CACHE_TIMEOUT', CACHE_TIMEOUT)
+    tamano = tamano_celda(zoom) * CELDAS_POR_BLOQUE
+    y_min, y_max = floor(caja[1] / tamano), floor(caja[3] / tamano)
+    en_caja = lambda bx, by: y_min <= by <= y_max and any(a <= bx <= b for a, b in _rangos_x(caja, tamano))
+
+    # Índice del zoom: bloques que tienen algún anuncio
+    indice = cache.get(prefijo)
+    if indice is not None:
+        claves = [f'{prefijo}:{bx}:{by}' for bx, by in indice if en_caja(bx, by)]
+        encontrados = cache.get_many(claves)
+        if len(encontrados) == len(claves):
+            metricas.cache_consultada('mapa', 'acierto')
+            return [celda for bloque in encontrados.values() for celda in bloque]
+
+    # Primera petición del zoom, o algún bloque expulsado de la caché
+    metricas.cache_consultada('mapa', 'fallo')
+    bloques = _bloques(zoom)
+    cache.set_many({f'{prefijo}:{bx}:{by}': bloque for (bx, by), bloque in bloques.items()}, timeout)
+    cache.set(prefijo, set(bloques), timeout)
+    return [celda for (bx, by), bloque in bloques.items() if en_caja(bx, by) for celda in bloque]
+
+
+def invalidar():
+    try:
+        cache.incr(_CLAVE_VERSION)
+    except ValueError:
+        cache.set(_CLAVE_VERSION, 1, timeout=None)
+
+
+def _en_caja(lat, lon, caja):
+    lon_min, lat_min, lon_max, lat_max = caja
+    if not lat_min <= lat <= lat_max:
+        return False
+    if lon_min <= lon_max:
+        return lon_min <= lon <= lon_max
+    return lon >= lon_min or lon <= lon_max
+
+
+def clusters(caja, zoom):
+    """Agrupaciones de la rejilla del zoom con el centroide dentro de la caja."""
+    return [
+        {
+            'latitud': lat,
+            'longitud': lon,
+            'cantidad': equipos + jugadores,
+            'equipos': equipos,
+            'jugadores': jugadores,
+        }
+        for equipos, jugadores, lat, lon in celdas(caja, zoom)
+        if _en_caja(lat, lon, caja)
+    ]
+
+
+def _filtro_caja(campo_lat, campo_lon, caja):
+    lon_min, lat_min, lon_max, lat_max = caja
+    filtro = Q(**{f'{campo_lat}__gte': lat_min, f'{campo_lat}__lte': lat_max})
+    if lon_min <= lon_max:
+        return filtro & Q(**{f'{campo_lon}__gte': lon_min, f'{campo_lon}__lte': lon_max})
+    return filtro & (Q(**{f'{campo_lon}__gte': lon_min}) | Q(**{f'{campo_lon}__lte': lon_max}))
+
+
+def puntos(caja, limite):
+    """
+    Anuncios sueltos dentro de la caja, sobre los índices de coordenadas.
+    Devuelve None si hay más de `limite`.
+    """
+    resultado = []
+    for tipo, campo_lat, campo_lon in CAPAS:
+        filas = (
+            _anuncios(tipo)
+            .filter(_filtro_caja(campo_lat, campo_lon, caja))
+            .values_list('id', campo_lat, campo_lon)[:limite + 1 - len(resultado)]
+        )
+        resultado.extend(
+            {'tipo': tipo, 'id': id, 'latitud': lat, 'longitud': lon}
+            for id, lat, lon in filas
+        )
+        if len(resultado) > limite:
+            return None
+    return resultado
+
+
+def mapa(caja, zoom):
+    """
+    Contenido del mapa para una caja `(lon_min, lat_min, lon_max, lat_max)`:
+    anuncios sueltos con zoom alto y pocos anuncios, si no agrupaciones.
+    """
+    zoom = max(0, min(int(zoom), ZOOM_MAXIMO))
+    if zoom >= getattr(settings, 'MAPA_ZOOM_PUNTOS', ZOOM_PUNTOS):
+        sueltos = puntos(caja, getattr(settings, 'MAPA_MAX_PUNTOS', MAX_PUNTOS))
+        if sueltos is not None:
+            return {'zoom': zoom, 'clusters': [], 'puntos': sueltos}
+    while zoom > 0 and _numero_bloques(caja, zoom) > MAX_BLOQUES:
+        zoom -= 1
+    return {'zoom': zoom, 'clusters': clusters(caja, zoom), 'puntos': []}
+
+
+def _numero_bloques(caja, zoom):
+    tamano = tamano_celda(zoom) * CELDAS_POR_BLOQUE
+    filas = floor(caja[3] / tamano) - floor(caja[1] / tamano) + 1
+    columnas = sum(b - a + 1 for a, b in _rangos_x(caja, tamano))
+    return filas * columnas
+
+
+# Campos que mueven un anuncio en el mapa o lo muestran u ocultan. Los demás
+# cambios (descripción, horarios, perfil del jugador...) no invalidan la rejilla.
+CAMPOS_MAPA = {
+    'basketconecta.AnuncioEquipo': ('latitud_partido', 'longitud_partido', 'estado_geocodificacion'),
+    'basketconecta.AnuncioJugador': ('jugador_id',),
+    'basketconecta.Jugador': ('latitud', 'longitud', 'estado_geocodificacion'),
+}
+
+
+@receiver(pre_save, sender='basketconecta.AnuncioEquipo')
+@receiver(pre_save, sender='basketconecta.AnuncioJugador')
+@receiver(pre_save, sender='basketconecta.Jugador')
+def _guardandose(sender, instance, **kwargs):
+    campos = CAMPOS_MAPA[sender._meta.label]
+    if instance._state.adding:
+        # Un jugador nuevo aún no tiene anuncio
+        instance._cambia_mapa = sender._meta.label != 'basketconecta.Jugador'
+    else:
+        anteriores = sender._base_manager.filter(pk=instance.pk).values_list(*campos).first()
+        instance._cambia_mapa = anteriores != tuple(getattr(instance, c) for c in campos)
+
+
+@receiver(post_save, sender='basketconecta.AnuncioEquipo')
+@receiver(post_save, sender='basketconecta.AnuncioJugador')
+@receiver(post_save, sender='basketconecta.Jugador')
+def _guardado(sender, instance, **kwargs):
+    if not getattr(instance, '_cambia_mapa', True):
+        return
+    if sender._meta.label == 'basketconecta.Jugador':
+        from .models import AnuncioJugador
+
+        # La ubicación de un jugador solo cuenta si tiene anuncio
+        if not AnuncioJugador.objects.filter(jugador=instance).exists():
+            return
+    invalidar()
+
+
+# Al borrar un jugador se borra en cascada su anuncio, que ya invalida
+@receiver(post_delete, sender='basketconecta.AnuncioEquipo')
+@receiver(post_delete, sender='basketconecta.AnuncioJugador')
+def _anuncio_borrado(sender, **kwargs):
+    invalidar()
+
+
+@receiver(cola_geocodificacion.fila_geocodificada)
+def _fila_geocodificada(sender, **kwargs):
+    invalidar()
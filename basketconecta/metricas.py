@@ -0,0 +1,157 @@
+import hmac
+import os
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+
+from .geocoding import cache_consultada as geocoding_cache_consultada, geocodificacion_realizada
+from .instrumentacion import nombre_vista
+
+
+# Métricas Prometheus de la aplicación, servidas en /metrics.
+#
+# Con varios workers (gunicorn, uwsgi) hay que exportar
+# PROMETHEUS_MULTIPROC_DIR apuntando a un directorio vacío antes de arrancar:
+# cada proceso escribe sus valores en ficheros mmap de ese directorio y
+# /metrics los suma al responder, sin locks entre procesos.
+
+# Cubre desde respuestas servidas por caché hasta las que pasan por Nominatim
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+peticiones = Counter(
+    'basketconecta_peticiones_total', 'Peticiones atendidas',
+    ['vista', 'metodo', 'estado'],
+)
+errores = Counter(
+    'basketconecta_errores_total', 'Peticiones que acabaron en un 5xx',
+    ['vista', 'estado'],
+)
+latencia = Histogram(
+    'basketconecta_latencia_segundos', 'Duración de las peticiones',
+    ['vista'], buckets=BUCKETS_LATENCIA,
+)
+consultas_bd = Counter(
+    'basketconecta_consultas_bd_total', 'Consultas SQL lanzadas por las peticiones',
+    ['vista'],
+)
+tiempo_bd = Counter(
+    'basketconecta_tiempo_bd_segundos_total', 'Tiempo en base de datos de las peticiones',
+    ['vista'],
+)
+geocodificaciones = Counter(
+    'basketconecta_geocodificaciones_total', 'Llamadas a geocodificadores remotos',
+    ['backend', 'resultado'],
+)
+latencia_geocodificador = Histogram(
+    'basketconecta_geocodificador_segundos', 'Duración de las llamadas a geocodificadores remotos',
+    ['backend'], buckets=BUCKETS_LATENCIA,
+)
+consultas_cache = Counter(
+    'basketconecta_cache_consultas_total',
+    'Consultas a cachés. En geocodificacion el resultado es el nivel que respondió '
+    '(memoria, local, bd) o fallo; en mapa, acierto o fallo',
+    ['cache', 'resultado'],
+)
+
+# Vistas sin resolver (404) comparten etiqueta para no crear una serie por URL
+VISTA_DESCONOCIDA = 'desconocida'
+# Igual con los métodos: cualquier otro (lo elige el cliente) cuenta como 'otro'
+METODOS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+METODO_DESCONOCIDO = 'otro'
+
+
+def cache_consultada(cache, resultado):
+    consultas_cache.labels(cache, resultado).inc()
+
+
+class _ContadorConsultas:
+    """execute_wrapper que solo cuenta y cronometra, para dejarlo siempre puesto."""
+
+    def __init__(self):
+        self.consultas = 0
+        self.segundos = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.consultas += 1
+            self.segundos += time.perf_counter() - inicio
+
+
+class MetricasMiddleware:
+    """
+    Cuenta peticiones, errores, latencia y consultas SQL por vista DRF
+    ('AnunciosCercanosView.get', 'MensajeViewSet.create'). Se desactiva con
+    METRICAS_ACTIVAS = False.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICAS_ACTIVAS', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        contador = _ContadorConsultas()
+        inicio = time.perf_counter()
+        with ExitStack() as pila:
+            for conexion in connections.all():
+                pila.enter_context(conexion.execute_wrapper(contador))
+            response = self.get_response(request)
+        duracion = time.perf_counter() - inicio
+
+        vista = nombre_vista(request) or VISTA_DESCONOCIDA
+        estado = str(response.status_code)
+        metodo = request.method if request.method in METODOS else METODO_DESCONOCIDO
+        peticiones.labels(vista, metodo, estado).inc()
+        if response.status_code >= 500:
+            errores.labels(vista, estado).inc()
+        latencia.labels(vista).observe(duracion)
+        if contador.consultas:
+            consultas_bd.labels(vista).inc(contador.consultas)
+            tiempo_bd.labels(vista).inc(contador.segundos)
+        return response
+
+
+@receiver(geocodificacion_realizada)
+def _geocodificacion_realizada(sender, backend, duracion, resultado, **kwargs):
+    geocodificaciones.labels(backend, resultado).inc()
+    if resultado != 'circuito_abierto':
+        latencia_geocodificador.labels(backend).observe(duracion)
+
+
+@receiver(geocoding_cache_consultada)
+def _cache_geocodificacion_consultada(sender, resultado, **kwargs):
+    cache_consultada('geocodificacion', resultado)
+
+
+def _registro():
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    # Un registro nuevo por scrape que suma los ficheros de todos los workers
+    registro = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registro)
+    return registro
+
+
+def vista_metricas(request):
+    """
+    Métricas en formato de texto de Prometheus. Pide `Authorization: Bearer
+    <METRICAS_TOKEN>`; sin token configurado solo responde con DEBUG.
+    """
+    token = getattr(settings, 'METRICAS_TOKEN', None)
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponseForbidden()
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(_registro()), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.1 on 2026-10-17 17:59
+
+from django.db import migrations, models
+
+from basketconecta.geo import geohash
+
+
+def rellenar_celdas(apps, schema_editor):
+    AnuncioEquipo = apps.get_model('basketconecta', 'AnuncioEquipo')
+    anuncios = []
+    for anuncio in AnuncioEquipo.objects.all().iterator():
+        if anuncio.latitud_partido is not None and anuncio.longitud_partido is not None:
+            anuncio.celda_partido = geohash(anuncio.latitud_partido, anuncio.longitud_partido)
+        if anuncio.latitud_entrenamiento is not None and anuncio.longitud_entrenamiento is not None:
+            anuncio.celda_entrenamiento = geohash(anuncio.latitud_entrenamiento, anuncio.longitud_entrenamiento)
+        anuncios.append(anuncio)
+    AnuncioEquipo.objects.bulk_update(anuncios, ['celda_partido', 'celda_entrenamiento'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basketconecta', '0016_reporte'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='anuncioequipo',
+            name='celda_entrenamiento',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='anuncioequipo',
+            name='celda_partido',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.RunPython(rellenar_celdas, migrations.RunPython.noop),
+    ]
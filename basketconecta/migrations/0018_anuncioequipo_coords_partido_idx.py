@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basketconecta', '0017_anuncioequipo_celdas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='anuncioequipo',
+            index=models.Index(fields=['latitud_partido', 'longitud_partido'], name='anuncioeq_coords_partido_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basketconecta', '0018_anuncioequipo_coords_partido_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodificacionCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('direccion', models.CharField(max_length=255, unique=True)),
+                ('latitud', models.FloatField(blank=True, null=True)),
+                ('longitud', models.FloatField(blank=True, null=True)),
+                ('encontrada', models.BooleanField(default=True)),
+                ('actualizada', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:05
+
+from django.db import migrations, models
+
+
+def marcar_fallidas(apps, schema_editor):
+    # Las filas con dirección pero sin coordenadas no se pudieron geocodificar
+    Jugador = apps.get_model('basketconecta', 'Jugador')
+    AnuncioEquipo = apps.get_model('basketconecta', 'AnuncioEquipo')
+    Jugador.objects.exclude(direccion='').filter(latitud__isnull=True).update(estado_geocodificacion='fallida')
+    AnuncioEquipo.objects.exclude(direccion_partido='').filter(latitud_partido__isnull=True).update(estado_geocodificacion='fallida')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basketconecta', '0019_geocodificacioncache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='anuncioequipo',
+            name='estado_geocodificacion',
+            field=models.CharField(choices=[('resuelta', 'Resuelta'), ('pendiente', 'Pendiente'), ('fallida', 'Fallida')], db_index=True, default='resuelta', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='jugador',
+            name='estado_geocodificacion',
+            field=models.CharField(choices=[('resuelta', 'Resuelta'), ('pendiente', 'Pendiente'), ('fallida', 'Fallida')], db_index=True, default='resuelta', max_length=10),
+        ),
+        migrations.RunPython(marcar_fallidas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basketconecta', '0020_estado_geocodificacion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='jugador',
+            index=models.Index(fields=['latitud', 'longitud'], name='jugador_coords_idx'),
+        ),
+    ]
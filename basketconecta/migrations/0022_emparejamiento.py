@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basketconecta', '0021_jugador_coords_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Emparejamiento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('puntuacion', models.FloatField()),
+                ('distancia', models.FloatField(blank=True, null=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('anuncio_equipo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='emparejamientos', to='basketconecta.anuncioequipo')),
+                ('anuncio_jugador', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='emparejamientos', to='basketconecta.anunciojugador')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['anuncio_jugador', '-puntuacion', 'anuncio_equipo'], name='emparejamiento_jugador_idx'), models.Index(fields=['anuncio_equipo', '-puntuacion', 'anuncio_jugador'], name='emparejamiento_equipo_idx')],
+                'constraints': [models.UniqueConstraint(fields=('anuncio_jugador', 'anuncio_equipo'), name='emparejamiento_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:21
+
+import basketconecta.disponibilidad
+from django.db import migrations
+
+from basketconecta.disponibilidad import DIAS, desde_opciones
+
+
+def rellenar_disponibilidad(apps, schema_editor):
+    # Un UPDATE por cada combinación de día y horario antiguos
+    AnuncioJugador = apps.get_model('basketconecta', 'AnuncioJugador')
+    AnuncioEquipo = apps.get_model('basketconecta', 'AnuncioEquipo')
+    campos = [
+        (AnuncioJugador, 'disponibilidad', 'disponibilidad_dia', 'disponibilidad_horaria'),
+        (AnuncioEquipo, 'disponibilidad_partido', 'dia_partido', 'horario_partido'),
+        (AnuncioEquipo, 'disponibilidad_entrenamiento', 'dia_entrenamiento', 'horario_entrenamiento'),
+    ]
+    for modelo, campo, campo_dia, campo_horario in campos:
+        for dia in DIAS + ['indiferente']:
+            for horario in ['manana', 'tarde', 'todo_dia', 'indiferente']:
+                modelo.objects.filter(**{campo_dia: dia, campo_horario: horario}).update(
+                    **{campo: desde_opciones(dia, horario)}
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basketconecta', '0022_emparejamiento'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='anuncioequipo',
+            name='disponibilidad_entrenamiento',
+            field=basketconecta.disponibilidad.DisponibilidadField(default=0),
+        ),
+        migrations.AddField(
+            model_name='anuncioequipo',
+            name='disponibilidad_partido',
+            field=basketconecta.disponibilidad.DisponibilidadField(default=0),
+        ),
+        migrations.AddField(
+            model_name='anunciojugador',
+            name='disponibilidad',
+            field=basketconecta.disponibilidad.DisponibilidadField(default=0),
+        ),
+        migrations.RunPython(rellenar_disponibilidad, migrations.RunPython.noop),
+    ]
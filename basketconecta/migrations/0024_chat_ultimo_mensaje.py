@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def rellenar_ultimo_mensaje(apps, schema_editor):
+    Chat = apps.get_model('basketconecta', 'Chat')
+    Mensaje = apps.get_model('basketconecta', 'Mensaje')
+    ultimos = Mensaje.objects.filter(chat=OuterRef('pk')).order_by('-timestamp', '-id')
+    Chat.objects.update(
+        ultimo_mensaje=Subquery(ultimos.values('id')[:1]),
+        ultima_actividad=Subquery(ultimos.values('timestamp')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basketconecta', '0023_disponibilidad'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='ultima_actividad',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='ultimo_mensaje',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='basketconecta.mensaje'),
+        ),
+        migrations.RunPython(rellenar_ultimo_mensaje, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def crear_lecturas(apps, schema_editor):
+    # Los mensajes que ya existían cuentan como leídos
+    Chat = apps.get_model('basketconecta', 'Chat')
+    LecturaChat = apps.get_model('basketconecta', 'LecturaChat')
+    lecturas = []
+    chats = Chat.objects.values_list('id', 'jugador__user_id', 'equipo__creador_id', 'ultimo_mensaje_id')
+    for chat_id, jugador_user_id, creador_id, ultimo_mensaje_id in chats.iterator():
+        for usuario_id in {jugador_user_id, creador_id}:
+            lecturas.append(LecturaChat(chat_id=chat_id, usuario_id=usuario_id, ultimo_leido=ultimo_mensaje_id or 0))
+    LecturaChat.objects.bulk_create(lecturas, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basketconecta', '0024_chat_ultimo_mensaje'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LecturaChat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ultimo_leido', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='mensaje',
+            index=models.Index(fields=['chat', 'id'], name='mensaje_chat_id_idx'),
+        ),
+        migrations.AddField(
+            model_name='lecturachat',
+            name='chat',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lecturas', to='basketconecta.chat'),
+        ),
+        migrations.AddField(
+            model_name='lecturachat',
+            name='usuario',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lecturas_chat', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='lecturachat',
+            constraint=models.UniqueConstraint(fields=('chat', 'usuario'), name='lectura_chat_unica'),
+        ),
+        migrations.RunPython(crear_lecturas, migrations.RunPython.noop),
+    ]
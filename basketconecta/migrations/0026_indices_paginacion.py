@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basketconecta', '0025_lecturachat'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mensaje',
+            index=models.Index(fields=['chat', 'timestamp', 'id'], name='mensaje_chat_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mensajechatequipo',
+            index=models.Index(fields=['chat', 'timestamp', 'id'], name='mensaje_equipo_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificacion',
+            index=models.Index(fields=['usuario', 'creada', 'id'], name='notificacion_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basketconecta', '0026_indices_paginacion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mensajechatequipo',
+            index=models.Index(fields=['chat', 'id'], name='mensaje_equipo_chat_id_idx'),
+        ),
+    ]
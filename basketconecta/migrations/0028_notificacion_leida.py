@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basketconecta', '0027_mensajechatequipo_chat_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notificacion',
+            index=models.Index(fields=['usuario', 'leida', 'creada'], name='notificacion_leida_idx'),
+        ),
+    ]
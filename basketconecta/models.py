@@ -1,18 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import User
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderUnavailable
+from .geo import geohash, filtro_celdas, filtrar_por_radio
+from .geocoding import geocodificar, geocodificar_direccion, GeocodificadorNoDisponible
+from . import cola_geocodificacion, disponibilidad
+from .disponibilidad import DisponibilidadField
 
 
-def geocodificar_direccion(direccion):
-    try:
-        geolocator = Nominatim(user_agent="basketconecta")
-        location = geolocator.geocode(direccion)
-        return (location.latitude, location.longitude) if location else (None, None)
-    except GeocoderUnavailable:
-        return (None, None)
-
-class Jugador(models.Model):
+class Jugador(cola_geocodificacion.EstadoGeocodificacionMixin, models.Model):
     POSICIONES = [
         ('base', 'Base'),
         ('escolta', 'Escolta'),
@@ -45,17 +39,48 @@ class Jugador(models.Model):
     foto_jugador = models.ImageField(upload_to='jugadores/', blank=True, null=True)
     latitud = models.FloatField(null=True, blank=True)
     longitud = models.FloatField(null=True, blank=True)
-    
-    def save(self, *args, **kwargs):
-        if self.direccion and (not self.latitud or not self.longitud):
-            self.latitud, self.longitud = geocodificar_direccion(self.direccion)
-        super().save(*args, **kwargs)
+    estado_geocodificacion = models.CharField(
+        max_length=10, choices=cola_geocodificacion.ESTADOS, default=cola_geocodificacion.RESUELTA, db_index=True
+    )
+
+    CAMPOS_GEOCODIFICACION = ['latitud', 'longitud', 'estado_geocodificacion']
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitud', 'longitud'], name='jugador_coords_idx'),
+        ]
+
+    def _faltan_coordenadas(self):
+        return self.direccion and (not self.latitud or not self.longitud)
+
+    def _tiene_coordenadas(self):
+        return self.latitud is not None and self.longitud is not None
+
+    def geocodificar(self):
+        try:
+            self.latitud, self.longitud = geocodificar(self.direccion)
+        except GeocodificadorNoDisponible:
+            # Modo degradado: se guarda sin coordenadas y se reintenta más tarde
+            self.estado_geocodificacion = cola_geocodificacion.PENDIENTE
+            return
+        resuelta = self.latitud is not None and self.longitud is not None
+        self.estado_geocodificacion = cola_geocodificacion.RESUELTA if resuelta else cola_geocodificacion.FALLIDA
+
+    def direcciones(self):
+        return {'direccion': self.direccion}
 
     def __str__(self):
         return self.nombre
     
 
 
+class AnuncioJugadorQuerySet(models.QuerySet):
+    def cerca_de(self, lat, lon, radio_km):
+        # Por las coordenadas del jugador; añade el campo `distancia`
+        publicados = self.exclude(jugador__estado_geocodificacion=cola_geocodificacion.PENDIENTE)
+        return filtrar_por_radio(publicados, 'jugador__latitud', 'jugador__longitud', lat, lon, radio_km)
+
+
 class AnuncioJugador(models.Model):
     DISPONIBILIDAD_DIAS = [
         ('lunes', 'Lunes'),
@@ -85,14 +110,33 @@ class AnuncioJugador(models.Model):
     jugador = models.OneToOneField(Jugador, on_delete=models.CASCADE, related_name='anuncio')
     disponibilidad_dia = models.CharField(max_length=20, choices=DISPONIBILIDAD_DIAS)
     disponibilidad_horaria = models.CharField(max_length=20, choices=DISPONIBILIDAD_HORAS)
+    # Franjas de la semana (ver disponibilidad.py); los dos campos anteriores son su resumen
+    disponibilidad = DisponibilidadField(default=0)
     descripcion = models.TextField(blank=True)
     sexo = models.CharField(max_length=15, choices=SEXOS)
 
     creado = models.DateTimeField(auto_now_add=True)
 
+    objects = AnuncioJugadorQuerySet.as_manager()
+
+    CAMPOS_DISPONIBILIDAD = {'disponibilidad': ('disponibilidad_dia', 'disponibilidad_horaria')}
+
+    def save(self, *args, **kwargs):
+        disponibilidad.sincronizar(self)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Anuncio de {self.jugador.nombre}"
     
+class EquipoQuerySet(models.QuerySet):
+    def para_serializar(self):
+        # Lo que anida EquipoSerializer: el anuncio (inverso 1:1) en el mismo
+        # JOIN y la plantilla en una sola consulta más para todos los equipos
+        return self.select_related('anuncio').prefetch_related(
+            models.Prefetch('jugadores', queryset=Jugador.objects.only('id', 'nombre', 'posicion'))
+        )
+
+
 class Equipo(models.Model):
     CATEGORIAS = [
         ('infantil', 'Infantil'),
@@ -121,10 +165,26 @@ class Equipo(models.Model):
 
     jugadores = models.ManyToManyField(Jugador, blank=True, related_name='equipos')
 
+    objects = EquipoQuerySet.as_manager()
+
     def __str__(self):
         return self.nombre
     
-class AnuncioEquipo(models.Model):
+class AnuncioEquipoQuerySet(models.QuerySet):
+    def candidatos_partido(self, lat, lon, radio_km):
+        # Prefiltro por celdas geohash; la distancia exacta se comprueba aparte
+        return self.filter(filtro_celdas('celda_partido', lat, lon, radio_km))
+
+    def candidatos_entrenamiento(self, lat, lon, radio_km):
+        return self.filter(filtro_celdas('celda_entrenamiento', lat, lon, radio_km))
+
+    def cerca_del_partido(self, lat, lon, radio_km):
+        # Filtro, distancia y orden resueltos en SQL; añade el campo `distancia`
+        publicados = self.exclude(estado_geocodificacion=cola_geocodificacion.PENDIENTE)
+        return filtrar_por_radio(publicados, 'latitud_partido', 'longitud_partido', lat, lon, radio_km)
+
+
+class AnuncioEquipo(cola_geocodificacion.EstadoGeocodificacionMixin, models.Model):
     DIAS_SEMANA = [
         ('lunes', 'Lunes'),
         ('martes', 'Martes'),
@@ -146,31 +206,96 @@ class AnuncioEquipo(models.Model):
     equipo = models.OneToOneField(Equipo, on_delete=models.CASCADE, related_name='anuncio')
     dia_partido = models.CharField(max_length=15, choices=DIAS_SEMANA)
     horario_partido = models.CharField(max_length=15, choices=HORARIOS)
+    disponibilidad_partido = DisponibilidadField(default=0)
     direccion_partido = models.CharField(max_length=255)
     latitud_partido = models.FloatField(null=True, blank=True)
     longitud_partido = models.FloatField(null=True, blank=True)
+    celda_partido = models.CharField(max_length=12, null=True, blank=True, db_index=True, editable=False)
 
     # Entrenamientos (opcionales)
     dia_entrenamiento = models.CharField(max_length=15, choices=DIAS_SEMANA, blank=True, null=True)
     horario_entrenamiento = models.CharField(max_length=15, choices=HORARIOS, blank=True, null=True)
+    disponibilidad_entrenamiento = DisponibilidadField(default=0)
     direccion_entrenamiento = models.CharField(max_length=255, blank=True, null=True)
     latitud_entrenamiento = models.FloatField(null=True, blank=True)
     longitud_entrenamiento = models.FloatField(null=True, blank=True)
+    celda_entrenamiento = models.CharField(max_length=12, null=True, blank=True, db_index=True, editable=False)
+    estado_geocodificacion = models.CharField(
+        max_length=10, choices=cola_geocodificacion.ESTADOS, default=cola_geocodificacion.RESUELTA, db_index=True
+    )
 
     descripcion = models.TextField(blank=True)
     creado = models.DateTimeField(auto_now_add=True)
 
+    objects = AnuncioEquipoQuerySet.as_manager()
 
-    def save(self, *args, **kwargs):
-        # Geolocalizar dirección de partido
-        if self.direccion_partido and (not self.latitud_partido or not self.longitud_partido):
-            self.latitud_partido, self.longitud_partido = geocodificar_direccion(self.direccion_partido)
-        # Geolocalizar dirección de entrenamiento (si existe)
-        if self.direccion_entrenamiento and (not self.latitud_entrenamiento or not self.longitud_entrenamiento):
-            self.latitud_entrenamiento, self.longitud_entrenamiento = geocodificar_direccion(self.direccion_entrenamiento)
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitud_partido', 'longitud_partido'], name='anuncioeq_coords_partido_idx'),
+        ]
+
+    CAMPOS_GEOCODIFICACION = [
+        'latitud_partido', 'longitud_partido', 'celda_partido',
+        'latitud_entrenamiento', 'longitud_entrenamiento', 'celda_entrenamiento',
+        'estado_geocodificacion',
+    ]
+
+    CAMPOS_DISPONIBILIDAD = {
+        'disponibilidad_partido': ('dia_partido', 'horario_partido'),
+        'disponibilidad_entrenamiento': ('dia_entrenamiento', 'horario_entrenamiento'),
+    }
 
+    def save(self, *args, **kwargs):
+        disponibilidad.sincronizar(self)
         super().save(*args, **kwargs)
 
+    def _preparar_geocodificacion(self):
+        super()._preparar_geocodificacion()
+        # Mantener actualizadas las celdas del índice espacial
+        self._actualizar_celdas()
+
+    def _faltan_coordenadas(self):
+        return (
+            (self.direccion_partido and (not self.latitud_partido or not self.longitud_partido))
+            or (self.direccion_entrenamiento and (not self.latitud_entrenamiento or not self.longitud_entrenamiento))
+        )
+
+    def _tiene_coordenadas(self):
+        return self.latitud_partido is not None and self.longitud_partido is not None
+
+    def geocodificar(self):
+        try:
+            # Geolocalizar dirección de partido
+            if self.direccion_partido and (not self.latitud_partido or not self.longitud_partido):
+                self.latitud_partido, self.longitud_partido = geocodificar(self.direccion_partido)
+            # Geolocalizar dirección de entrenamiento (si existe)
+            if self.direccion_entrenamiento and (not self.latitud_entrenamiento or not self.longitud_entrenamiento):
+                self.latitud_entrenamiento, self.longitud_entrenamiento = geocodificar(self.direccion_entrenamiento)
+        except GeocodificadorNoDisponible:
+            # Modo degradado: se guarda con lo que haya y se reintenta más tarde
+            self._actualizar_celdas()
+            self.estado_geocodificacion = cola_geocodificacion.PENDIENTE
+            return
+        self._actualizar_celdas()
+        resuelta = self.latitud_partido is not None and self.longitud_partido is not None
+        self.estado_geocodificacion = cola_geocodificacion.RESUELTA if resuelta else cola_geocodificacion.FALLIDA
+
+    def direcciones(self):
+        return {
+            'direccion_partido': self.direccion_partido,
+            'direccion_entrenamiento': self.direccion_entrenamiento,
+        }
+
+    def _actualizar_celdas(self):
+        self.celda_partido = self._celda(self.latitud_partido, self.longitud_partido)
+        self.celda_entrenamiento = self._celda(self.latitud_entrenamiento, self.longitud_entrenamiento)
+
+    @staticmethod
+    def _celda(lat, lon):
+        if lat is None or lon is None:
+            return None
+        return geohash(lat, lon)
+
     def __str__(self):
         return f"Anuncio del equipo {self.equipo.nombre}"
     
@@ -180,6 +305,9 @@ class Chat(models.Model):
     anuncio_jugador = models.ForeignKey('AnuncioJugador', on_delete=models.SET_NULL, null=True, blank=True, related_name='chats_jugador')
     anuncio_equipo = models.ForeignKey('AnuncioEquipo', on_delete=models.SET_NULL, null=True, blank=True, related_name='chats_equipo')
     creado = models.DateTimeField(auto_now_add=True)
+    # Desnormalizados para listar chats sin consultar sus mensajes (ver chats.py)
+    ultimo_mensaje = models.ForeignKey('Mensaje', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    ultima_actividad = models.DateTimeField(null=True, blank=True, db_index=True)
 
     class Meta:
         unique_together = ('jugador', 'equipo', 'anuncio_jugador', 'anuncio_equipo')
@@ -194,8 +322,31 @@ class Mensaje(models.Model):
     contenido = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Mensajes de un chat posteriores al último leído (no leídos)
+            models.Index(fields=['chat', 'id'], name='mensaje_chat_id_idx'),
+            # Paginación por (timestamp, id) dentro de un chat
+            models.Index(fields=['chat', 'timestamp', 'id'], name='mensaje_chat_fecha_idx'),
+        ]
+
     def __str__(self):
         return f"Mensaje de {self.emisor.username} en {self.chat}"
+
+
+class LecturaChat(models.Model):
+    # Cursor de lectura de cada participante: id del último mensaje leído
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='lecturas')
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='lecturas_chat')
+    ultimo_leido = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['chat', 'usuario'], name='lectura_chat_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.usuario.username} ha leído {self.chat_id} hasta {self.ultimo_leido}"
     
 
 class Invitacion(models.Model):
@@ -244,6 +395,14 @@ class Notificacion(models.Model):
     leida = models.BooleanField(default=False)
     creada = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Paginación por (creada, id) de las notificaciones de un usuario
+            models.Index(fields=['usuario', 'creada', 'id'], name='notificacion_fecha_idx'),
+            # Recuento de no leídas y operaciones en bloque sobre leídas/no leídas
+            models.Index(fields=['usuario', 'leida', 'creada'], name='notificacion_leida_idx'),
+        ]
+
     def __str__(self):
         return f"Notificación para {self.usuario.username}: {self.mensaje[:50]}"
 
@@ -260,6 +419,14 @@ class MensajeChatEquipo(models.Model):
     contenido = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Paginación por (timestamp, id) dentro de un chat grupal
+            models.Index(fields=['chat', 'timestamp', 'id'], name='mensaje_equipo_fecha_idx'),
+            # Mensajes de un chat grupal posteriores a un id (sincronización)
+            models.Index(fields=['chat', 'id'], name='mensaje_equipo_chat_id_idx'),
+        ]
+
     def __str__(self):
         return f"Mensaje de {self.emisor.username} en {self.chat.equipo.nombre}"
 
@@ -278,4 +445,36 @@ class Reporte(models.Model):
     fecha_creacion = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Reporte sobre {self.reportado.username} por {self.reportante.username} ({self.estado})"
\ No newline at end of file
+        return f"Reporte sobre {self.reportado.username} por {self.reportante.username} ({self.estado})"
+
+class GeocodificacionCache(models.Model):
+    # Clave: dirección normalizada (ver geocoding.normalizar_direccion)
+    direccion = models.CharField(max_length=255, unique=True)
+    latitud = models.FloatField(null=True, blank=True)
+    longitud = models.FloatField(null=True, blank=True)
+    encontrada = models.BooleanField(default=True)
+    actualizada = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.direccion} -> ({self.latitud}, {self.longitud})"
+
+
+class Emparejamiento(models.Model):
+    # Tabla materializada de emparejamientos; la mantiene emparejamiento.py
+    anuncio_jugador = models.ForeignKey(AnuncioJugador, on_delete=models.CASCADE, related_name='emparejamientos')
+    anuncio_equipo = models.ForeignKey(AnuncioEquipo, on_delete=models.CASCADE, related_name='emparejamientos')
+    puntuacion = models.FloatField()
+    distancia = models.FloatField(null=True, blank=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['anuncio_jugador', 'anuncio_equipo'], name='emparejamiento_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['anuncio_jugador', '-puntuacion', 'anuncio_equipo'], name='emparejamiento_jugador_idx'),
+            models.Index(fields=['anuncio_equipo', '-puntuacion', 'anuncio_jugador'], name='emparejamiento_equipo_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.anuncio_jugador_id} - {self.anuncio_equipo_id} ({self.puntuacion:.2f})"
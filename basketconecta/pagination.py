@@ -0,0 +1,137 @@
+import base64
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+
+
+class PaginacionOpcional(LimitOffsetPagination):
+    """
+    Paginación por límite/desplazamiento que solo se activa si la petición
+    trae `?limite=`. Sin él la respuesta sigue siendo la lista completa.
+    """
+    default_limit = None
+    max_limit = 100
+    limit_query_param = 'limite'
+    offset_query_param = 'desplazamiento'
+
+
+def crear_cursor_distancia(distancia, id):
+    """Cursor opaco con la última posición (distancia, id) de una página."""
+    return base64.urlsafe_b64encode(f"{distancia!r}:{id}".encode()).decode()
+
+
+def leer_cursor_distancia(cursor):
+    """Posición `(distancia, id)` de un cursor; ValueError si no es un cursor válido."""
+    try:
+        distancia, id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        return float(distancia), int(id)
+    except ValueError as e:
+        # También binascii.Error (base64 mal formado) y UnicodeDecodeError
+        raise ValueError('Cursor no válido.') from e
+
+
+def crear_cursor_fecha(fecha, id):
+    """Cursor opaco con la última posición (fecha, id) de una página."""
+    return base64.urlsafe_b64encode(f"{fecha.isoformat()}|{id}".encode()).decode()
+
+
+def leer_cursor_fecha(cursor):
+    fecha, id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(fecha), int(id)
+
+
+class PaginacionCursor(BasePagination):
+    """
+    Paginación por keyset sobre `(campo, id)`, de lo más reciente a lo más
+    antiguo. La primera página son los `?limite=` elementos más recientes y
+    `siguiente` es el cursor para pedir los anteriores con `?cursor=`. Cada
+    página es una sola consulta por índice, así que cuesta lo mismo al
+    principio que al final de un historial largo, y los cursores no se
+    desplazan aunque lleguen elementos nuevos.
+
+    Para sincronizar, `?despues_de=<id>` o `?desde=<fecha ISO>` devuelven en
+    cambio lo llegado después, de más antiguo a más reciente y hasta `limite`;
+    `hay_mas` indica si quedan más por pedir a partir del último.
+    """
+    campo = 'timestamp'
+    # Si es True, cada página se devuelve de más antiguo a más reciente
+    cronologico = False
+    limit_query_param = 'limite'
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        limite = self._limite(request)
+        self.siguiente = None
+        self.hay_mas = None
+        despues_de = request.query_params.get('despues_de')
+        desde = request.query_params.get('desde')
+        if despues_de or desde:
+            return self._nuevos(queryset, limite, despues_de, desde)
+
+        queryset = queryset.order_by(f'-{self.campo}', '-id')
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            try:
+                fecha, id = leer_cursor_fecha(cursor)
+            except (ValueError, UnicodeDecodeError):
+                raise ValidationError({'cursor': 'Cursor no válido.'})
+            queryset = queryset.filter(
+                Q(**{f'{self.campo}__lt': fecha}) | Q(**{self.campo: fecha, 'id__lt': id})
+            )
+
+        filas = list(queryset[:limite + 1])
+        if len(filas) > limite:
+            filas = filas[:limite]
+            ultima = filas[-1]
+            self.siguiente = crear_cursor_fecha(getattr(ultima, self.campo), ultima.id)
+        if self.cronologico:
+            filas.reverse()
+        return filas
+
+    def _nuevos(self, queryset, limite, despues_de, desde):
+        if despues_de:
+            try:
+                queryset = queryset.filter(id__gt=int(despues_de))
+            except ValueError:
+                raise ValidationError({'despues_de': 'Debe ser un id.'})
+        if desde:
+            fecha = parse_datetime(desde)
+            if fecha is None:
+                raise ValidationError({'desde': 'Debe ser una fecha ISO 8601.'})
+            if timezone.is_naive(fecha):
+                fecha = timezone.make_aware(fecha)
+            queryset = queryset.filter(**{f'{self.campo}__gt': fecha})
+        # Con despues_de se recorre por id, que siempre crece; con desde, por fecha
+        orden = ('id',) if despues_de else (self.campo, 'id')
+        filas = list(queryset.order_by(*orden)[:limite + 1])
+        self.hay_mas = len(filas) > limite
+        return filas[:limite]
+
+    def _limite(self, request):
+        por_defecto = getattr(settings, 'PAGINACION_CURSOR_LIMITE', 50)
+        maximo = getattr(settings, 'PAGINACION_CURSOR_LIMITE_MAXIMO', 200)
+        try:
+            limite = int(request.query_params.get(self.limit_query_param, por_defecto))
+        except ValueError:
+            limite = por_defecto
+        return max(1, min(limite, maximo))
+
+    def get_paginated_response(self, data):
+        if self.hay_mas is not None:
+            return Response({'hay_mas': self.hay_mas, 'results': data})
+        return Response({'siguiente': self.siguiente, 'results': data})
+
+
+class PaginacionMensajes(PaginacionCursor):
+    """Últimos mensajes de un chat, en el orden en que se muestran."""
+    cronologico = True
+
+
+class PaginacionNotificaciones(PaginacionCursor):
+    campo = 'creada'
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from .consumers import ChatConsumer, ChatEquipoConsumer
+
+
+websocket_urlpatterns = [
+    path('ws/chats/<int:chat_id>/', ChatConsumer.as_asgi()),
+    path('ws/chats-equipo/<int:chat_id>/', ChatEquipoConsumer.as_asgi()),
+]
@@ -1,27 +1,138 @@
 from rest_framework import serializers
-from .models import Jugador, Equipo, AnuncioJugador, AnuncioEquipo, Chat, Mensaje, Invitacion, EventoCalendario, Notificacion, geocodificar_direccion, ChatEquipo, MensajeChatEquipo, Reporte
-
-
-class JugadorMiniSerializer(serializers.ModelSerializer):
+from .models import Jugador, Equipo, AnuncioJugador, AnuncioEquipo, Chat, Mensaje, Invitacion, EventoCalendario, Notificacion, ChatEquipo, MensajeChatEquipo, Reporte
+from . import cola_geocodificacion, disponibilidad, geocoding
+from .instrumentacion import SerializacionMedidaMixin
+
+
+class CoordenadasValidadasMixin:
+    """
+    Guarda las coordenadas obtenidas al validar cada dirección y las pasa a
+    validated_data, para que el modelo no vuelva a geocodificar al guardar.
+    `campos_coordenadas` relaciona cada campo de dirección con sus campos de
+    latitud y longitud.
+    """
+    campos_coordenadas = {}
+
+    def geocodificar_campo(self, campo, direccion):
+        """
+        Devuelve `(lat, lon)` de la dirección, o None si no se puede validar
+        ahora (geocodificación diferida o geocodificador caído): entonces las
+        coordenadas se vacían y el modelo deja la fila pendiente para
+        resolverla en segundo plano.
+        """
+        diferida = bool(direccion) and cola_geocodificacion.es_diferida()
+        coordenadas = (None, None)
+        if direccion and not diferida:
+            try:
+                coordenadas = geocoding.geocodificar(direccion)
+            except geocoding.GeocodificadorNoDisponible:
+                diferida = True
+        self._coordenadas_validadas = getattr(self, '_coordenadas_validadas', {})
+        self._coordenadas_validadas[campo] = coordenadas
+        self._campos_diferidos = getattr(self, '_campos_diferidos', set())
+        if diferida:
+            self._campos_diferidos.add(campo)
+        return None if diferida else coordenadas
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        for campo, (campo_lat, campo_lon) in self.campos_coordenadas.items():
+            coordenadas = getattr(self, '_coordenadas_validadas', {}).get(campo)
+            if campo in attrs and coordenadas is not None:
+                attrs[campo_lat], attrs[campo_lon] = coordenadas
+            if campo in attrs and campo in getattr(self, '_campos_diferidos', ()):
+                # Ya pendiente: el modelo no vuelve a llamar al geocodificador al guardar
+                attrs['estado_geocodificacion'] = cola_geocodificacion.PENDIENTE
+        return attrs
+
+
+class DisponibilidadField(serializers.Field):
+    """
+    Máscara de disponibilidad como lista de franjas (`["sabado_manana", ...]`).
+    Al escribir admite también la máscara como entero.
+    """
+    default_error_messages = {
+        'invalida': 'Disponibilidad no válida: se espera una lista de franjas como "sabado_manana".',
+    }
+
+    def to_representation(self, value):
+        return disponibilidad.a_lista(value)
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = [franja for franja in data.split(',') if franja]
+        # bool es subclase de int: `true` no es una máscara
+        if isinstance(data, int) and not isinstance(data, bool) and 0 <= data <= disponibilidad.TODA_LA_SEMANA:
+            return data
+        if not isinstance(data, list) or not all(isinstance(franja, str) for franja in data):
+            self.fail('invalida')
+        try:
+            return disponibilidad.desde_lista(data)
+        except ValueError:
+            self.fail('invalida')
+
+
+class DisponibilidadMixin:
+    """
+    Acepta la disponibilidad como máscara o con los antiguos campos de día y
+    horario, y rellena lo que falte. `campos_disponibilidad` relaciona cada
+    máscara con sus campos antiguos; las de `disponibilidad_obligatoria` hay
+    que darlas al crear, de una forma u otra.
+    """
+    campos_disponibilidad = {}
+    disponibilidad_obligatoria = ()
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        for campo, (campo_dia, campo_horario) in self.campos_disponibilidad.items():
+            if attrs.get(campo):
+                attrs[campo_dia], attrs[campo_horario] = disponibilidad.a_opciones(attrs[campo])
+            elif campo_dia in attrs or campo_horario in attrs:
+                dia = attrs.get(campo_dia, getattr(self.instance, campo_dia, None))
+                horario = attrs.get(campo_horario, getattr(self.instance, campo_horario, None))
+                attrs[campo] = disponibilidad.desde_opciones(dia, horario)
+            elif self.instance is None and campo in self.disponibilidad_obligatoria:
+                raise serializers.ValidationError({campo: "Indica la disponibilidad."})
+        return attrs
+
+
+class DistanciaAnotadaMixin:
+    def get_distancia(self, obj):
+        # Solo viene anotada cuando se filtra por radio
+        distancia = getattr(obj, 'distancia', None)
+        return round(distancia, 2) if distancia is not None else None
+
+
+class JugadorMiniSerializer(SerializacionMedidaMixin, serializers.ModelSerializer):
     class Meta:
         model = Jugador
         fields = ['id', 'nombre', 'posicion','nivel','altura','descripcion']
 
-class AnuncioJugadorSerializer(serializers.ModelSerializer):
+class AnuncioJugadorSerializer(SerializacionMedidaMixin, DisponibilidadMixin, DistanciaAnotadaMixin, serializers.ModelSerializer):
+    campos_disponibilidad = {'disponibilidad': ('disponibilidad_dia', 'disponibilidad_horaria')}
+    disponibilidad_obligatoria = ('disponibilidad',)
+
     jugador = JugadorMiniSerializer(read_only=True)
     jugador_id = serializers.PrimaryKeyRelatedField(
         queryset=Jugador.objects.all(), source='jugador', write_only=True
     )
+    disponibilidad = DisponibilidadField(required=False)
+    distancia = serializers.SerializerMethodField()
 
     class Meta:
         model = AnuncioJugador
         fields = [
             'id', 'jugador', 'jugador_id',
-            'disponibilidad_dia', 'disponibilidad_horaria',
-            'descripcion', 'sexo', 'creado'
+            'disponibilidad_dia', 'disponibilidad_horaria', 'disponibilidad',
+            'descripcion', 'sexo', 'creado', 'distancia'
         ]
         read_only_fields = ['id', 'jugador', 'creado']
-class JugadorSerializer(serializers.ModelSerializer):
+        extra_kwargs = {
+            'disponibilidad_dia': {'required': False},
+            'disponibilidad_horaria': {'required': False},
+        }
+class JugadorSerializer(SerializacionMedidaMixin, CoordenadasValidadasMixin, serializers.ModelSerializer):
+    campos_coordenadas = {'direccion': ('latitud', 'longitud')}
 
     anuncio = AnuncioJugadorSerializer(read_only=True)
     class Meta:
@@ -29,66 +140,75 @@ class JugadorSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'user', 'nombre', 'edad', 'altura', 'posicion',
             'direccion', 'nivel', 'descripcion', 'correo',
-            'sexo', 'foto_jugador', 'latitud', 'longitud','anuncio'
+            'sexo', 'foto_jugador', 'latitud', 'longitud', 'estado_geocodificacion', 'anuncio'
         ]
-        read_only_fields = ['user', 'id', 'latitud', 'longitud']
-
-    def update(self, instance, validated_data):
-        direccion = validated_data.get('direccion', instance.direccion)
-        if direccion != instance.direccion:
-            from .models import geocodificar_direccion
-            lat, lon = geocodificar_direccion(direccion)
-            instance.latitud = lat
-            instance.longitud = lon
-        return super().update(instance, validated_data)
-    
+        read_only_fields = ['user', 'id', 'latitud', 'longitud', 'estado_geocodificacion']
+
     def validate_direccion(self, value):
-        lat, lon = geocodificar_direccion(value)
-        if lat is None or lon is None:
+        # Las coordenadas llegan a validated_data en validate()
+        coordenadas = self.geocodificar_campo('direccion', value)
+        if coordenadas is not None and None in coordenadas:
             raise serializers.ValidationError("La dirección no es válida o no se pudo geolocalizar.")
         return value
     
 
-class JugadorMiniSerializer(serializers.ModelSerializer):
+class JugadorMiniSerializer(SerializacionMedidaMixin, serializers.ModelSerializer):
     class Meta:
         model = Jugador
         fields = ['id', 'nombre', 'posicion']
 
 
-class AnuncioEquipoSerializer(serializers.ModelSerializer):
+class AnuncioEquipoSerializer(SerializacionMedidaMixin, CoordenadasValidadasMixin, DisponibilidadMixin, DistanciaAnotadaMixin, serializers.ModelSerializer):
+    campos_coordenadas = {
+        'direccion_partido': ('latitud_partido', 'longitud_partido'),
+        'direccion_entrenamiento': ('latitud_entrenamiento', 'longitud_entrenamiento'),
+    }
+    campos_disponibilidad = {
+        'disponibilidad_partido': ('dia_partido', 'horario_partido'),
+        'disponibilidad_entrenamiento': ('dia_entrenamiento', 'horario_entrenamiento'),
+    }
+    disponibilidad_obligatoria = ('disponibilidad_partido',)
+
     equipo_id = serializers.PrimaryKeyRelatedField(
         queryset=Equipo.objects.all(), source='equipo', write_only=True
     )
+    disponibilidad_partido = DisponibilidadField(required=False)
+    disponibilidad_entrenamiento = DisponibilidadField(required=False)
+    distancia = serializers.SerializerMethodField()
 
     class Meta:
         model = AnuncioEquipo
         fields = [
             'id', 'equipo', 'equipo_id',
-            'dia_partido', 'horario_partido', 'direccion_partido',
+            'dia_partido', 'horario_partido', 'disponibilidad_partido', 'direccion_partido',
             'latitud_partido', 'longitud_partido',
-            'dia_entrenamiento', 'horario_entrenamiento', 'direccion_entrenamiento',
-            'latitud_entrenamiento', 'longitud_entrenamiento',
-            'descripcion', 'creado'
+            'dia_entrenamiento', 'horario_entrenamiento', 'disponibilidad_entrenamiento', 'direccion_entrenamiento',
+            'latitud_entrenamiento', 'longitud_entrenamiento', 'estado_geocodificacion',
+            'descripcion', 'creado', 'distancia'
         ]
-        read_only_fields = ['id', 'equipo', 'creado', 'latitud_partido', 'longitud_partido', 'latitud_entrenamiento', 'longitud_entrenamiento']
+        read_only_fields = ['id', 'equipo', 'creado', 'latitud_partido', 'longitud_partido', 'latitud_entrenamiento', 'longitud_entrenamiento', 'estado_geocodificacion']
+        extra_kwargs = {
+            'dia_partido': {'required': False},
+            'horario_partido': {'required': False},
+        }
 
 
     def validate_direccion_partido(self, value):
-        lat, lon = geocodificar_direccion(value)
-        if lat is None or lon is None:
+        coordenadas = self.geocodificar_campo('direccion_partido', value)
+        if coordenadas is not None and None in coordenadas:
             raise serializers.ValidationError("La dirección del partido no es válida o no se pudo geolocalizar.")
         return value
 
     def validate_direccion_entrenamiento(self, value):
+        coordenadas = self.geocodificar_campo('direccion_entrenamiento', value)
         if value:  # solo validamos si se ha introducido
-            lat, lon = geocodificar_direccion(value)
-            if lat is None or lon is None:
+            if coordenadas is not None and None in coordenadas:
                 raise serializers.ValidationError("La dirección del entrenamiento no es válida.")
         return value
 
 
 
-class EquipoSerializer(serializers.ModelSerializer):
+class EquipoSerializer(SerializacionMedidaMixin, serializers.ModelSerializer):
     jugadores = JugadorMiniSerializer(many=True, read_only=True)
     anuncio = AnuncioEquipoSerializer(read_only=True)
     class Meta:
@@ -106,7 +226,7 @@ class EquipoSerializer(serializers.ModelSerializer):
 
 
 
-class MensajeSerializer(serializers.ModelSerializer):
+class MensajeSerializer(SerializacionMedidaMixin, serializers.ModelSerializer):
     emisor_username = serializers.CharField(source='emisor.username', read_only=True)
 
     class Meta:
@@ -115,7 +235,7 @@ class MensajeSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'timestamp', 'emisor', 'emisor_username']
 
 
-class ChatSerializer(serializers.ModelSerializer):
+class ChatSerializer(SerializacionMedidaMixin, serializers.ModelSerializer):
     jugador_nombre = serializers.CharField(source='jugador.nombre', read_only=True)
     equipo_nombre = serializers.CharField(source='equipo.nombre', read_only=True)
     ultimo_mensaje = serializers.SerializerMethodField()
@@ -134,7 +254,8 @@ class ChatSerializer(serializers.ModelSerializer):
         ]
 
     def get_ultimo_mensaje(self, obj):
-        mensaje = obj.mensajes.order_by('-timestamp').first()
+        # Campo desnormalizado: con select_related('ultimo_mensaje__emisor') no hace consultas
+        mensaje = obj.ultimo_mensaje
         if mensaje:
             return {
                 'contenido': mensaje.contenido,
@@ -142,9 +263,17 @@ class ChatSerializer(serializers.ModelSerializer):
                 'emisor': mensaje.emisor.username
             }
         return None
-    
 
-class InvitacionSerializer(serializers.ModelSerializer):
+
+class BandejaChatSerializer(ChatSerializer):
+    # Anotado por chats.bandeja()
+    no_leidos = serializers.IntegerField(read_only=True)
+
+    class Meta(ChatSerializer.Meta):
+        fields = ChatSerializer.Meta.fields + ['ultima_actividad', 'no_leidos']
+
+
+class InvitacionSerializer(SerializacionMedidaMixin, serializers.ModelSerializer):
     equipo_nombre = serializers.CharField(source='equipo.nombre', read_only=True)
     jugador_nombre = serializers.CharField(source='jugador.nombre', read_only=True)
 
@@ -159,7 +288,7 @@ class InvitacionSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'equipo_nombre', 'jugador_nombre', 'enviada']
 
 
-class EventoCalendarioSerializer(serializers.ModelSerializer):
+class EventoCalendarioSerializer(SerializacionMedidaMixin, serializers.ModelSerializer):
     equipo_nombre = serializers.CharField(source='equipo.nombre', read_only=True)
 
     class Meta:
@@ -174,26 +303,26 @@ class EventoCalendarioSerializer(serializers.ModelSerializer):
 
 
 
-class NotificacionSerializer(serializers.ModelSerializer):
+class NotificacionSerializer(SerializacionMedidaMixin, serializers.ModelSerializer):
     class Meta:
         model = Notificacion
         fields = ['id', 'mensaje', 'leida', 'creada']
         read_only_fields = ['id', 'mensaje', 'creada']
 
-class ChatEquipoSerializer(serializers.ModelSerializer):
+class ChatEquipoSerializer(SerializacionMedidaMixin, serializers.ModelSerializer):
     equipo_nombre = serializers.CharField(source='equipo.nombre', read_only=True)
     class Meta:
         model = ChatEquipo
         fields = ['id', 'equipo', 'equipo_nombre', 'creado']
 
-class MensajeChatEquipoSerializer(serializers.ModelSerializer):
+class MensajeChatEquipoSerializer(SerializacionMedidaMixin, serializers.ModelSerializer):
     emisor_username = serializers.CharField(source='emisor.username', read_only=True)
     class Meta:
         model = MensajeChatEquipo
         fields = ['id', 'chat', 'emisor', 'emisor_username', 'contenido', 'timestamp']
         read_only_fields = ['id', 'timestamp', 'emisor', 'emisor_username']
 
-class ReporteSerializer(serializers.ModelSerializer):
+class ReporteSerializer(SerializacionMedidaMixin, serializers.ModelSerializer):
     reportado_username = serializers.CharField(source='reportado.username', read_only=True)
     reportante_username = serializers.CharField(source='reportante.username', read_only=True)
     class Meta:
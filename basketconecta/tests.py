@@ -1,3 +1,1365 @@
-from django.test import TestCase
+import asyncio
+import json
+import math
+import random
+from collections import namedtuple
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from geopy.exc import GeocoderTimedOut
+from prometheus_client import REGISTRY
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import geo, geocoding, cola_geocodificacion, consumers, disponibilidad, emparejamiento, flujo_notificaciones, instrumentacion, serializers
+from .gazetteer import Gazetteer
+from .routing import websocket_urlpatterns
+from .tiempo_real import JWTAuthMiddleware
+from .models import (
+    Jugador, Equipo, AnuncioEquipo, AnuncioJugador, Emparejamiento, Chat, Mensaje,
+    Invitacion, EventoCalendario, ChatEquipo, MensajeChatEquipo, Reporte, Notificacion, GeocodificacionCache,
+)
+
+
+UbicacionFalsa = namedtuple('UbicacionFalsa', ['latitude', 'longitude'])
+
+
+class GeocodificacionPorEscrituraTests(TestCase):
+    """Cada dirección se resuelve una sola vez por petición."""
+
+    def setUp(self):
+        geocoding.reiniciar_cache()
+        self.user = User.objects.create_user(username='jugador', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        parche = mock.patch.object(geocoding, '_geolocator')
+        self.geolocator = parche.start().return_value
+        self.geolocator.geocode.return_value = UbicacionFalsa(40.4, -3.7)
+        self.addCleanup(parche.stop)
+
+    def test_crear_jugador_geocodifica_una_vez(self):
+        respuesta = self.client.post('/api/jugadores/', {
+            'nombre': 'Ana', 'edad': 25, 'altura': '1.75', 'posicion': 'base',
+            'direccion': 'Calle Mayor 1, Madrid', 'nivel': 'intermedio',
+            'correo': 'ana@example.com', 'sexo': 'femenino',
+        })
+
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual(geocoding.estadisticas()['consultas'], 1)
+        self.assertEqual(self.geolocator.geocode.call_count, 1)
+        jugador = Jugador.objects.get(user=self.user)
+        self.assertEqual((jugador.latitud, jugador.longitud), (40.4, -3.7))
+
+    def test_actualizar_direccion_jugador_geocodifica_una_vez(self):
+        jugador = Jugador.objects.create(
+            user=self.user, nombre='Ana', edad=25, altura='1.75', posicion='base',
+            direccion='Calle Mayor 1, Madrid', nivel='intermedio',
+            correo='ana@example.com', sexo='femenino', latitud=40.4, longitud=-3.7,
+        )
+        self.geolocator.geocode.return_value = UbicacionFalsa(41.38, 2.17)
+
+        respuesta = self.client.patch(f'/api/jugadores/{jugador.id}/', {'direccion': 'Rambla 1, Barcelona'})
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(geocoding.estadisticas()['consultas'], 1)
+        jugador.refresh_from_db()
+        self.assertEqual((jugador.latitud, jugador.longitud), (41.38, 2.17))
+
+    def test_crear_anuncio_equipo_geocodifica_cada_direccion_una_vez(self):
+        equipo = Equipo.objects.create(
+            creador=self.user, nombre='Los Pivots', categoria='senior',
+            primera_camiseta='blanca', primera_pantalon='negro', sexo='mixto',
+        )
+
+        respuesta = self.client.post('/api/anuncios-equipo/', {
+            'equipo_id': equipo.id, 'dia_partido': 'sabado', 'horario_partido': 'manana',
+            'direccion_partido': 'Pabellón Norte', 'dia_entrenamiento': 'martes',
+            'horario_entrenamiento': 'tarde', 'direccion_entrenamiento': 'Pabellón Sur',
+        })
+
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual(geocoding.estadisticas()['consultas'], 2)
+        self.assertEqual(self.geolocator.geocode.call_count, 2)
+        anuncio = AnuncioEquipo.objects.get(equipo=equipo)
+        self.assertEqual(anuncio.latitud_partido, 40.4)
+        self.assertEqual(anuncio.latitud_entrenamiento, 40.4)
+
+
+class CacheGeocodificacionTests(TestCase):
+    def setUp(self):
+        geocoding.reiniciar_cache()
+        self.addCleanup(geocoding.reiniciar_cache)
+
+        parche = mock.patch.object(geocoding, '_geolocator')
+        self.geolocator = parche.start().return_value
+        self.geolocator.geocode.return_value = UbicacionFalsa(40.4, -3.7)
+        self.addCleanup(parche.stop)
+
+    def envejecer(self, direccion, dias):
+        GeocodificacionCache.objects.filter(direccion=geocoding.normalizar_direccion(direccion)).update(
+            actualizada=timezone.now() - timedelta(days=dias),
+        )
+
+    @override_settings(GEOCODIFICACION_TAMANO_LRU=2)
+    def test_la_lru_descarta_la_menos_usada(self):
+        for direccion in ('Calle A', 'Calle B', 'Calle C'):
+            geocoding.geocodificar(direccion)
+
+        geocoding.geocodificar('Calle C')
+        geocoding.geocodificar('Calle A')
+
+        estadisticas = geocoding.estadisticas()
+        self.assertEqual(estadisticas['aciertos_memoria'], 1)
+        # Calle A salió de la LRU y se recupera de la tabla
+        self.assertEqual(estadisticas['aciertos_bd'], 1)
+        self.assertEqual(self.geolocator.geocode.call_count, 3)
+
+    @override_settings(GEOCODIFICACION_TTL=timedelta(days=1))
+    def test_una_fila_caducada_se_vuelve_a_consultar(self):
+        geocoding.geocodificar('Calle Mayor 1, Madrid')
+        self.envejecer('Calle Mayor 1, Madrid', 2)
+        geocoding._lru.limpiar()
+        self.geolocator.geocode.return_value = UbicacionFalsa(40.5, -3.6)
+
+        self.assertEqual(geocoding.geocodificar('Calle Mayor 1, Madrid'), (40.5, -3.6))
+
+        self.assertEqual(self.geolocator.geocode.call_count, 2)
+        fila = GeocodificacionCache.objects.get()
+        self.assertEqual((fila.latitud, fila.longitud), (40.5, -3.6))
+        self.assertGreater(fila.actualizada, timezone.now() - timedelta(minutes=1))
+
+    def test_las_direcciones_inexistentes_tambien_se_cachean(self):
+        self.geolocator.geocode.return_value = None
+
+        self.assertEqual(geocoding.geocodificar('Calle Inventada'), (None, None))
+        self.assertEqual(geocoding.geocodificar('Calle Inventada'), (None, None))
+        geocoding._lru.limpiar()
+        self.assertEqual(geocoding.geocodificar('Calle Inventada'), (None, None))
+        self.assertEqual(self.geolocator.geocode.call_count, 1)
+        self.assertFalse(GeocodificacionCache.objects.get().encontrada)
+
+        # El resultado negativo dura GEOCODIFICACION_TTL_NEGATIVO, menos que uno positivo
+        self.envejecer('Calle Inventada', 2)
+        geocoding._lru.limpiar()
+        geocoding.geocodificar('Calle Inventada')
+        self.assertEqual(self.geolocator.geocode.call_count, 2)
+
+
+@override_settings(GEOCODIFICACION_MODO='cola', GEOCODIFICACION_INTERVALO_MINIMO=0)
+class GeocodificacionDiferidaTests(TestCase):
+    def setUp(self):
+        geocoding.reiniciar_cache()
+        self.user = User.objects.create_user(username='jugador', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        parche = mock.patch.object(geocoding, '_geolocator')
+        self.geolocator = parche.start().return_value
+        self.geolocator.geocode.return_value = UbicacionFalsa(40.4, -3.7)
+        self.addCleanup(parche.stop)
+
+    def test_la_escritura_no_espera_al_geocodificador(self):
+        respuesta = self.client.post('/api/jugadores/', {
+            'nombre': 'Ana', 'edad': 25, 'altura': '1.75', 'posicion': 'base',
+            'direccion': 'Calle Mayor 1, Madrid', 'nivel': 'intermedio',
+            'correo': 'ana@example.com', 'sexo': 'femenino',
+        })
+
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual(respuesta.data['estado_geocodificacion'], cola_geocodificacion.PENDIENTE)
+        self.geolocator.geocode.assert_not_called()
+
+        self.assertEqual(cola_geocodificacion.procesar_pendientes(), 1)
+        jugador = Jugador.objects.get(user=self.user)
+        self.assertEqual(jugador.estado_geocodificacion, cola_geocodificacion.RESUELTA)
+        self.assertEqual((jugador.latitud, jugador.longitud), (40.4, -3.7))
+
+    def test_solo_espera_antes_de_las_llamadas_remotas(self):
+        for i in range(3):
+            Jugador.objects.create(
+                user=User.objects.create(username=f'jugador{i}'), nombre=f'Jugador {i}', edad=25, altura='1.75',
+                posicion='base', direccion='Calle Mayor 1, Madrid', nivel='intermedio',
+                correo='ana@example.com', sexo='femenino',
+            )
+
+        with mock.patch.object(cola_geocodificacion._limitador, 'esperar') as esperar:
+            self.assertEqual(cola_geocodificacion.procesar_pendientes(), 3)
+
+        # La misma dirección: una llamada remota y dos aciertos de caché sin esperar
+        self.assertEqual(self.geolocator.geocode.call_count, 1)
+        self.assertEqual(esperar.call_count, 1)
+
+    def test_anuncios_pendientes_no_aparecen_en_cercanos(self):
+        Jugador.objects.create(
+            user=self.user, nombre='Ana', edad=25, altura='1.75', posicion='base',
+            direccion='Calle Mayor 1, Madrid', nivel='intermedio',
+            correo='ana@example.com', sexo='femenino', latitud=40.4, longitud=-3.7,
+        )
+        equipo = Equipo.objects.create(
+            creador=self.user, nombre='Los Pivots', categoria='senior',
+            primera_camiseta='blanca', primera_pantalon='negro', sexo='mixto',
+        )
+        anuncio = AnuncioEquipo.objects.create(
+            equipo=equipo, dia_partido='sabado', horario_partido='manana',
+            direccion_partido='Pabellón Norte',
+        )
+        self.assertEqual(anuncio.estado_geocodificacion, cola_geocodificacion.PENDIENTE)
+
+        respuesta = self.client.get('/api/anuncios-cercanos/?distancia=5')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.data['anuncios_cercanos'], [])
+
+        cola_geocodificacion.procesar_pendientes()
+        respuesta = self.client.get('/api/anuncios-cercanos/?distancia=5')
+        self.assertEqual([a['id'] for a in respuesta.data['anuncios_cercanos']], [anuncio.id])
+
+
+@override_settings(GEOCODIFICACION_INTERVALO_MINIMO=0)
+class GeocodificadorCaidoTests(TestCase):
+    def setUp(self):
+        geocoding.reiniciar_cache()
+        self.addCleanup(geocoding.reiniciar_cache)
+
+        parche = mock.patch.object(geocoding, '_geolocator')
+        self.geolocator = parche.start().return_value
+        self.geolocator.geocode.side_effect = GeocoderTimedOut()
+        self.addCleanup(parche.stop)
+
+    def crear_jugador(self, username):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username=username))
+        return client.post('/api/jugadores/', {
+            'nombre': username, 'edad': 25, 'altura': '1.75', 'posicion': 'base',
+            'direccion': f'Calle {username}, Madrid', 'nivel': 'intermedio',
+            'correo': 'ana@example.com', 'sexo': 'femenino',
+        })
+
+    def test_el_circuito_corta_las_llamadas_y_las_escrituras_siguen(self):
+        backend = geocoding.backends()[0]
+        for i in range(backend.circuito.umbral + 3):
+            respuesta = self.crear_jugador(f'jugador{i}')
+            self.assertEqual(respuesta.status_code, 201)
+            self.assertEqual(respuesta.data['estado_geocodificacion'], cola_geocodificacion.PENDIENTE)
+
+        self.assertEqual(backend.circuito.estado, geocoding.CircuitBreaker.ABIERTO)
+        self.assertEqual(self.geolocator.geocode.call_count, backend.circuito.umbral)
+
+    def test_una_sola_llamada_por_escritura_degradada(self):
+        respuesta = self.crear_jugador('ana')
+
+        self.assertEqual(respuesta.data['estado_geocodificacion'], cola_geocodificacion.PENDIENTE)
+        self.assertEqual(self.geolocator.geocode.call_count, 1)
+
+    def test_en_modo_sincrono_se_reintenta_mas_tarde(self):
+        with mock.patch.object(cola_geocodificacion.threading, 'Timer') as temporizador, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.crear_jugador('ana')
+        jugador = Jugador.objects.get(nombre='ana')
+        enfriamiento = geocoding.backends()[0].circuito.enfriamiento
+        temporizador.assert_called_once_with(
+            enfriamiento, cola_geocodificacion._lanzar_reintento, ('basketconecta.Jugador', jugador.pk, 0),
+        )
+
+        # El reintento corre en un hilo del pool; aquí se ejecuta en línea
+        with mock.patch.object(cola_geocodificacion.threading, 'Timer') as temporizador, \
+                mock.patch.object(cola_geocodificacion.connections, 'close_all'):
+            cola_geocodificacion._reintentar('basketconecta.Jugador', jugador.pk, 0)
+            temporizador.assert_called_once_with(
+                enfriamiento * 2, cola_geocodificacion._lanzar_reintento, ('basketconecta.Jugador', jugador.pk, 1),
+            )
+
+            temporizador.reset_mock()
+            self.geolocator.geocode.side_effect = None
+            self.geolocator.geocode.return_value = UbicacionFalsa(40.4, -3.7)
+            cola_geocodificacion._reintentar('basketconecta.Jugador', jugador.pk, 1)
+            temporizador.assert_not_called()
+
+        jugador.refresh_from_db()
+        self.assertEqual(jugador.estado_geocodificacion, cola_geocodificacion.RESUELTA)
+
+    def test_reintento_con_el_geocodificador_recuperado(self):
+        self.crear_jugador('ana')
+        receptor = mock.Mock()
+        cola_geocodificacion.fila_geocodificada.connect(receptor)
+        self.addCleanup(cola_geocodificacion.fila_geocodificada.disconnect, receptor)
+
+        # Mientras siga caído la fila sigue pendiente y no se avisa a nadie
+        cola_geocodificacion.procesar_pendientes()
+        cola_geocodificacion.procesar_pendientes()
+        receptor.assert_not_called()
+
+        self.geolocator.geocode.side_effect = None
+        self.geolocator.geocode.return_value = UbicacionFalsa(40.4, -3.7)
+
+        cola_geocodificacion.procesar_pendientes()
+        self.assertEqual(receptor.call_count, 1)
+
+        jugador = Jugador.objects.get(nombre='ana')
+        self.assertEqual(jugador.estado_geocodificacion, cola_geocodificacion.RESUELTA)
+        self.assertEqual(jugador.latitud, 40.4)
+
+    def test_cambiar_la_direccion_con_el_geocodificador_recuperado(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username='ana'))
+        respuesta = client.post('/api/jugadores/', {
+            'nombre': 'ana', 'edad': 25, 'altura': '1.75', 'posicion': 'base',
+            'direccion': 'Calle Mal Escrita, Madrid', 'nivel': 'intermedio',
+            'correo': 'ana@example.com', 'sexo': 'femenino',
+        })
+        self.assertEqual(respuesta.data['estado_geocodificacion'], cola_geocodificacion.PENDIENTE)
+        self.geolocator.geocode.side_effect = None
+        self.geolocator.geocode.return_value = UbicacionFalsa(40.4, -3.7)
+
+        respuesta = client.patch(
+            f"/api/jugadores/{respuesta.data['id']}/", {'direccion': 'Calle Mayor 1, Madrid'}, format='json',
+        )
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.data['estado_geocodificacion'], cola_geocodificacion.RESUELTA)
+        self.assertEqual(respuesta.data['latitud'], 40.4)
+
+
+class GazetteerTests(SimpleTestCase):
+    def setUp(self):
+        self.gazetteer = Gazetteer([
+            ('Calle Mayor, Alcorcón', 40.35, -3.82),
+            ('Calle Mayor, Madrid', 40.415, -3.71),
+            ('Calle Mayo, Madrid', 40.42, -3.72),
+            ('Calle Real, Segovia', 40.95, -4.12),
+            ('Avenida de la Constitución, Alcorcón', 40.34, -3.83),
+            ('Paseo de la Castellana, Madrid', 40.44, -3.69),
+            ('Paseo de las Delicias, Madrid', 40.39, -3.69),
+            ('Alcorcón', 40.345, -3.824),
+            ('Madrid', 40.4168, -3.7038),
+            ('Segovia', 40.9429, -4.1088),
+            ('28001', 40.425, -3.68),
+        ])
+
+    def test_exacta_sin_portal_ni_tildes(self):
+        self.assertEqual(self.gazetteer.buscar('Calle Mayor 3, Alcorcon'), (40.35, -3.82))
+        self.assertEqual(self.gazetteer.buscar('Madrid'), (40.4168, -3.7038))
+
+    def test_prefijo_unico_dentro_del_municipio(self):
+        self.assertEqual(self.gazetteer.buscar('Paseo de la Caste 10, Madrid'), (40.44, -3.69))
+        # Empieza igual que las dos calles del paseo: ambigua, se queda en el municipio
+        self.assertEqual(self.gazetteer.buscar('Paseo de la, Madrid'), (40.4168, -3.7038))
+        # La avenida es de Alcorcón, no de Madrid
+        self.assertEqual(self.gazetteer.buscar('Avenida de la Const, Madrid'), (40.4168, -3.7038))
+
+    def test_textos_cortos_o_sin_municipio_no_aciertan_por_prefijo(self):
+        for texto in ('c', 'Ca', 'Calle', 'Calle Mayor', 'Paseo de la Caste'):
+            self.assertIsNone(self.gazetteer.buscar(texto), texto)
+
+    def test_aproximada_dentro_del_municipio(self):
+        self.assertEqual(self.gazetteer.buscar('Calle Mayr 2, Alcorcón'), (40.35, -3.82))
+        self.assertEqual(self.gazetteer.buscar('Calle Rael 1, Segovia'), (40.95, -4.12))
+        # Segura no está en el índice: no vale la calle parecida de Segovia
+        self.assertIsNone(self.gazetteer.buscar('Calle Real 1, Segura'))
+        # Se parece a Calle Mayor y a Calle Mayo: ambigua
+        self.assertEqual(self.gazetteer.buscar('Calle Mayoa, Madrid'), (40.4168, -3.7038))
+
+    def test_codigo_postal_y_municipio(self):
+        self.assertEqual(self.gazetteer.buscar('Calle Inexistente 1, 28001 Madrid'), (40.425, -3.68))
+        self.assertEqual(self.gazetteer.buscar('Calle Inexistente 1, Segovia'), (40.9429, -4.1088))
+        self.assertIsNone(self.gazetteer.buscar('Calle Inexistente 1, Pueblo Perdido'))
+
+
+def punto_a_distancia(lat, lon, km, rumbo):
+    """Punto a `km` de (lat, lon) en la dirección `rumbo` (grados), sobre la misma esfera que haversine_km."""
+    lat1, lon1, rumbo = math.radians(lat), math.radians(lon), math.radians(rumbo)
+    d = km / geo.RADIO_TIERRA_KM
+    lat2 = math.asin(math.sin(lat1) * math.cos(d) + math.cos(lat1) * math.sin(d) * math.cos(rumbo))
+    lon2 = lon1 + math.atan2(math.sin(rumbo) * math.sin(d) * math.cos(lat1), math.cos(d) - math.sin(lat1) * math.sin(lat2))
+    return math.degrees(lat2), (math.degrees(lon2) + 180) % 360 - 180
+
+
+class BusquedaPorRadioTests(TestCase):
+    """Las tres búsquedas por radio devuelven lo mismo que haversine_km fila a fila."""
+    RADIO_KM = 5
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='capitan', password='x')
+
+    def crear_anuncios(self, lat, lon):
+        rng = random.Random(7)
+        puntos = [(lat + rng.uniform(-.08, .08), lon + rng.uniform(-.1, .1)) for _ in range(40)]
+        # Justo dentro y justo fuera del radio (±1 m) en varias direcciones
+        for rumbo in range(0, 360, 45):
+            puntos += [punto_a_distancia(lat, lon, self.RADIO_KM + margen, rumbo) for margen in (-.001, .001)]
+        # A uno y otro lado de los bordes de las celdas geohash que contienen el centro
+        for precision in (5, 6, 7):
+            alto, ancho = geo._tamano_celda(precision)
+            borde_lat = math.floor((lat + 90) / alto) * alto - 90
+            borde_lon = math.floor((lon + 180) / ancho) * ancho - 180
+            for margen in (-1e-9, 1e-9):
+                puntos += [(borde_lat + margen, lon), (borde_lat + alto + margen, lon),
+                           (lat, borde_lon + margen), (lat, borde_lon + ancho + margen)]
+        puntos = [(la, (lo + 180) % 360 - 180) for la, lo in puntos]
+        return [
+            AnuncioEquipo.objects.create(
+                equipo=Equipo.objects.create(
+                    creador=self.user, nombre=f'Equipo {i}', categoria='senior',
+                    primera_camiseta='blanca', primera_pantalon='negro', sexo='mixto',
+                ),
+                dia_partido='sabado', horario_partido='manana', direccion_partido=f'Pabellón {i}',
+                latitud_partido=la, longitud_partido=lo,
+            )
+            for i, (la, lo) in enumerate(puntos)
+        ]
+
+    def comprobar_equivalencia(self, lat, lon):
+        anuncios = self.crear_anuncios(lat, lon)
+        referencia = sorted(
+            (geo.haversine_km(lat, lon, a.latitud_partido, a.longitud_partido), a.id) for a in anuncios
+        )
+        esperados = [id for distancia, id in referencia if distancia <= self.RADIO_KM]
+        # Hay puntos a ambos lados del radio
+        self.assertTrue(0 < len(esperados) < len(anuncios))
+
+        # Prefiltro por celdas geohash: no se pierde ningún anuncio del radio
+        candidatos = AnuncioEquipo.objects.candidatos_partido(lat, lon, self.RADIO_KM)
+        por_celdas = sorted(
+            (geo.haversine_km(lat, lon, a.latitud_partido, a.longitud_partido), a.id) for a in candidatos
+        )
+        self.assertEqual([id for distancia, id in por_celdas if distancia <= self.RADIO_KM], esperados)
+
+        # Caja envolvente + haversine en SQL, ordenado por distancia
+        en_sql = AnuncioEquipo.objects.cerca_del_partido(lat, lon, self.RADIO_KM)
+        self.assertEqual([a.id for a in en_sql], esperados)
+        for anuncio, (distancia, _) in zip(en_sql, referencia):
+            self.assertAlmostEqual(anuncio.distancia, distancia, places=6)
+
+        # Haversine vectorizado y selección con NumPy, con y sin k
+        ids = [a.id for a in anuncios]
+        distancias = geo.distancias_km(
+            lat, lon, [a.latitud_partido for a in anuncios], [a.longitud_partido for a in anuncios],
+        )
+        for (distancia, _), calculada in zip(referencia, sorted(distancias.tolist())):
+            self.assertAlmostEqual(calculada, distancia, places=9)
+        self.assertEqual([ids[i] for i in geo.seleccionar_cercanos(distancias, self.RADIO_KM)], esperados)
+        self.assertEqual([ids[i] for i in geo.seleccionar_cercanos(distancias, self.RADIO_KM, k=5)], esperados[:5])
+
+    def test_geohash(self):
+        self.assertEqual(geo.geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geo.geohash(40.4, -3.7), geo.geohash(40.4, -3.7, 12)[:geo.PRECISION_GEOHASH])
+
+    def test_equivalencia_en_madrid(self):
+        self.comprobar_equivalencia(40.4168, -3.7038)
+
+    def test_equivalencia_junto_al_antimeridiano(self):
+        self.comprobar_equivalencia(-16.5, 179.98)
+
+    def test_parametros_no_validos_en_anuncios_de_equipo(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for parametros in ('latitud=abc&longitud=-3.7&distancia=4', 'latitud=nan&longitud=-3.7&distancia=4',
+                           'latitud=40.4&longitud=-3.7&distancia=-1', 'latitud=40.4&longitud=-3.7&distancia=inf'):
+            respuesta = client.get(f'/api/anuncios-equipo/?{parametros}')
+            self.assertEqual(respuesta.status_code, 400, parametros)
+
+
+class AnunciosCercanosTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='jugador', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.jugador = Jugador.objects.create(
+            user=self.user, nombre='Ana', edad=25, altura='1.75', posicion='base',
+            direccion='Calle Mayor 1, Madrid', nivel='intermedio',
+            correo='ana@example.com', sexo='femenino', latitud=40.4, longitud=-3.7,
+        )
+        # Dos anuncios empatados a la misma distancia y uno fuera del radio
+        latitudes = [40.42, 40.405, 40.41, 40.41, 40.415, 41.0]
+        self.anuncios = [
+            AnuncioEquipo.objects.create(
+                equipo=Equipo.objects.create(
+                    creador=self.user, nombre=f'Equipo {i}', categoria='senior',
+                    primera_camiseta='blanca', primera_pantalon='negro', sexo='mixto',
+                ),
+                dia_partido='sabado', horario_partido='manana',
+                direccion_partido=f'Pabellón {i}', latitud_partido=latitud, longitud_partido=-3.7,
+            )
+            for i, latitud in enumerate(latitudes)
+        ]
+
+    def test_paginas_por_cursor_en_orden_de_distancia(self):
+        esperados = [a.id for a in sorted(self.anuncios[:5], key=lambda a: (a.latitud_partido, a.id))]
+        ids, url = [], '/api/anuncios-cercanos/?distancia=5&limite=2'
+        while url:
+            respuesta = self.client.get(url)
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertEqual(respuesta.data['total'], 5)
+            self.assertNotIn('debug_info', respuesta.data)
+            ids += [a['id'] for a in respuesta.data['anuncios_cercanos']]
+            siguiente = respuesta.data['siguiente']
+            url = f'/api/anuncios-cercanos/?distancia=5&limite=2&cursor={siguiente}' if siguiente else None
+
+        self.assertEqual(ids, esperados)
+
+    def test_parametros_no_validos(self):
+        for parametros in ('limite=0', 'limite=-1', 'limite=abc', 'cursor=abc', 'cursor=YWJj', 'distancia=abc', 'distancia=inf'):
+            respuesta = self.client.get(f'/api/anuncios-cercanos/?{parametros}')
+            self.assertEqual(respuesta.status_code, 400, parametros)
+            self.assertNotIn('debug_info', respuesta.data)
+
+    def test_respuesta_completa_solo_bajo_peticion(self):
+        respuesta = self.client.get('/api/anuncios-cercanos/?distancia=5&completo=true&limite=3')
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(respuesta.data['anuncios_cercanos']), 3)
+        self.assertEqual(len(respuesta.data['todos_los_anuncios']), 6)
+        self.assertEqual(respuesta.data['debug_info']['anuncios_cercanos_encontrados'], 3)
+
+    def test_sin_coordenadas_no_devuelve_depuracion(self):
+        Jugador.objects.filter(pk=self.jugador.pk).update(latitud=None, longitud=None)
+
+        respuesta = self.client.get('/api/anuncios-cercanos/?completo=true')
+
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertNotIn('debug_info', respuesta.data)
+
+
+class JugadoresCercanosTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='capitan', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        equipo = Equipo.objects.create(
+            creador=self.user, nombre='Los Pivots', categoria='senior',
+            primera_camiseta='blanca', primera_pantalon='negro', sexo='mixto',
+        )
+        self.anuncio_equipo = AnuncioEquipo.objects.create(
+            equipo=equipo, dia_partido='sabado', horario_partido='manana',
+            direccion_partido='Pabellón', latitud_partido=40.4, longitud_partido=-3.7,
+        )
+        # A unos 5,5 km, 1,1 km, 20 km y 3,3 km del pabellón
+        self.anuncios = [
+            AnuncioJugador.objects.create(
+                jugador=Jugador.objects.create(
+                    user=User.objects.create(username=f'jugador{i}'), nombre=f'Jugador {i}', edad=25,
+                    altura='1.75', posicion='base', direccion='Calle Mayor 1, Madrid', nivel='intermedio',
+                    correo='ana@example.com', sexo='femenino', latitud=latitud, longitud=-3.7,
+                ),
+                disponibilidad_dia='sabado', disponibilidad_horaria='manana', sexo='indiferente',
+            )
+            for i, latitud in enumerate([40.45, 40.41, 40.58, 40.43])
+        ]
+
+    def test_jugadores_cerca_de_un_anuncio_de_equipo(self):
+        respuesta = self.client.get(f'/api/anuncios-jugador/?anuncio_equipo={self.anuncio_equipo.id}')
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual([a['id'] for a in respuesta.data], [self.anuncios[i].id for i in (1, 3, 0)])
+        self.assertEqual([round(a['distancia']) for a in respuesta.data], [1, 3, 6])
+
+    def test_jugadores_cerca_de_unas_coordenadas(self):
+        respuesta = self.client.get('/api/anuncios-jugador/?latitud=40.4&longitud=-3.7&distancia=4')
+
+        self.assertEqual([a['id'] for a in respuesta.data], [self.anuncios[i].id for i in (1, 3)])
+
+    def test_parametros_no_validos(self):
+        for parametros in ('anuncio_equipo=abc', 'anuncio_equipo=-1', 'latitud=40.4&longitud=-3.7&distancia=abc',
+                           'latitud=abc&longitud=-3.7&distancia=4', 'latitud=40.4&longitud=-3.7&distancia=-1'):
+            respuesta = self.client.get(f'/api/anuncios-jugador/?{parametros}')
+            self.assertEqual(respuesta.status_code, 400, parametros)
+        self.assertEqual(self.client.get('/api/anuncios-jugador/?anuncio_equipo=999999').status_code, 404)
+
+
+class EmparejamientoTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='jugador', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        jugador = Jugador.objects.create(
+            user=self.user, nombre='Ana', edad=25, altura='1.75', posicion='base',
+            direccion='Calle Mayor 1, Madrid', nivel='intermedio',
+            correo='ana@example.com', sexo='femenino', latitud=40.4, longitud=-3.7,
+        )
+        AnuncioJugador.objects.create(
+            jugador=jugador, disponibilidad_dia='sabado', disponibilidad_horaria='manana', sexo='indiferente',
+        )
+
+    def crear_anuncio_equipo(self, nombre, sexo, dia, latitud):
+        equipo = Equipo.objects.create(
+            creador=self.user, nombre=nombre, categoria='senior',
+            primera_camiseta='blanca', primera_pantalon='negro', sexo=sexo,
+        )
+        return AnuncioEquipo.objects.create(
+            equipo=equipo, dia_partido=dia, horario_partido='manana', direccion_partido='Pabellón',
+            latitud_partido=latitud, longitud_partido=-3.7,
+        )
+
+    def test_recomienda_equipos_compatibles_por_puntuacion(self):
+        cerca = self.crear_anuncio_equipo('Cerca', 'femenino', 'sabado', 40.41)
+        lejos = self.crear_anuncio_equipo('Lejos', 'mixto', 'sabado', 40.5)
+        otro_dia = self.crear_anuncio_equipo('Otro día', 'femenino', 'lunes', 40.41)
+        self.crear_anuncio_equipo('Masculino', 'masculino', 'sabado', 40.41)
+
+        respuesta = self.client.get('/api/recomendaciones/')
+
+        self.assertEqual(respuesta.status_code, 200)
+        ids = [r['anuncio']['id'] for r in respuesta.data['recomendaciones']]
+        self.assertEqual(ids, [cerca.id, lejos.id, otro_dia.id])
+
+    def test_n_fuera_de_rango_o_no_valido(self):
+        cerca = self.crear_anuncio_equipo('Cerca', 'femenino', 'sabado', 40.41)
+        self.crear_anuncio_equipo('Lejos', 'mixto', 'sabado', 40.5)
+
+        for n, esperadas in (('abc', 2), ('-1', 1), ('0', 1), ('1', 1), ('1000', 2)):
+            respuesta = self.client.get(f'/api/recomendaciones/?n={n}')
+            self.assertEqual(respuesta.status_code, 200, n)
+            self.assertEqual(len(respuesta.data['recomendaciones']), esperadas, n)
+        self.assertEqual(respuesta.data['recomendaciones'][0]['anuncio']['id'], cerca.id)
+        self.assertEqual(self.client.get('/api/recomendaciones/?distancia=abc').status_code, 400)
+        self.assertEqual(self.client.get('/api/recomendaciones/?anuncio_equipo=abc').status_code, 400)
+
+    def test_guardar_y_borrar_anuncios_actualiza_la_tabla(self):
+        self.assertEqual(self.client.get('/api/recomendaciones/').data['recomendaciones'], [])
+        anuncio = self.crear_anuncio_equipo('Nuevo', 'mixto', 'sabado', 40.41)
+
+        respuesta = self.client.get('/api/recomendaciones/')
+        self.assertEqual([r['anuncio']['id'] for r in respuesta.data['recomendaciones']], [anuncio.id])
+
+        anuncio.latitud_partido, anuncio.celda_partido = 45.0, None
+        anuncio.save()
+        self.assertEqual(self.client.get('/api/recomendaciones/').data['recomendaciones'], [])
+        self.assertEqual(Emparejamiento.objects.count(), 0)
+
+    def test_la_tabla_incremental_coincide_con_la_reconstruccion(self):
+        self.crear_anuncio_equipo('Cerca', 'femenino', 'sabado', 40.41)
+        equipo = self.crear_anuncio_equipo('Plantilla', 'mixto', 'lunes', 40.45).equipo
+        equipo.jugadores.add(Jugador.objects.get(user=self.user))
+        self.assertEqual(emparejamiento.comprobar()['anuncios_jugador'], [])
+
+        Emparejamiento.objects.filter(anuncio_equipo__equipo=equipo).update(puntuacion=0)
+
+        comprobacion = emparejamiento.comprobar()
+        self.assertEqual(comprobacion['distintas'], 1)
+
+        emparejamiento.reconstruir()
+        self.assertEqual(emparejamiento.comprobar()['anuncios_jugador'], [])
+        self.assertEqual(Emparejamiento.objects.count(), 2)
+
+    def test_las_filas_de_un_jugador_pendiente_sobran_una_a_una(self):
+        self.crear_anuncio_equipo('Cerca', 'femenino', 'sabado', 40.41)
+        self.crear_anuncio_equipo('Lejos', 'mixto', 'sabado', 40.5)
+        jugador = Jugador.objects.get(user=self.user)
+        Jugador.objects.filter(pk=jugador.pk).update(estado_geocodificacion=cola_geocodificacion.PENDIENTE)
+
+        comprobacion = emparejamiento.comprobar()
+        self.assertEqual(comprobacion['sobran'], 2)
+        self.assertEqual(comprobacion['anuncios_jugador'], [jugador.anuncio.id])
+
+    def test_solo_se_puntua_de_nuevo_si_cambian_los_campos_que_cuentan(self):
+        equipo = self.crear_anuncio_equipo('Cerca', 'femenino', 'sabado', 40.41).equipo
+        jugador = Jugador.objects.get(user=self.user)
+
+        with mock.patch.object(emparejamiento, 'emparejar_jugador') as emparejar_jugador, \
+                mock.patch.object(emparejamiento, 'emparejar_equipo') as emparejar_equipo:
+            jugador.descripcion = 'Base zurda'
+            jugador.save()
+            equipo.nombre = 'Las de cerca'
+            equipo.save()
+            emparejar_jugador.assert_not_called()
+            emparejar_equipo.assert_not_called()
+
+            jugador.nivel = 'alto'
+            jugador.save()
+            emparejar_jugador.assert_called_once_with(jugador.anuncio.id)
+            equipo.sexo = 'mixto'
+            equipo.save()
+            emparejar_equipo.assert_called_once_with(equipo.anuncio.id)
+
+
+class DisponibilidadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='jugador', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.jugador = Jugador.objects.create(
+            user=self.user, nombre='Ana', edad=25, altura='1.75', posicion='base',
+            direccion='Calle Mayor 1, Madrid', nivel='intermedio',
+            correo='ana@example.com', sexo='femenino', latitud=40.4, longitud=-3.7,
+        )
+
+    def test_varios_dias_y_campos_antiguos(self):
+        respuesta = self.client.post('/api/anuncios-jugador/', {
+            'jugador_id': self.jugador.id, 'sexo': 'indiferente',
+            'disponibilidad': ['martes_tarde', 'sabado_manana'],
+        }, format='json')
+
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual(respuesta.data['disponibilidad'], ['martes_tarde', 'sabado_manana'])
+        self.assertEqual(respuesta.data['disponibilidad_dia'], 'indiferente')
+        self.assertEqual(respuesta.data['disponibilidad_horaria'], 'todo_dia')
+
+        respuesta = self.client.patch(f"/api/anuncios-jugador/{respuesta.data['id']}/", {
+            'disponibilidad_dia': 'domingo', 'disponibilidad_horaria': 'tarde',
+        }, format='json')
+        self.assertEqual(respuesta.data['disponibilidad'], ['domingo_tarde'])
+
+    def test_rechaza_disponibilidades_mal_formadas(self):
+        for valor in [[1], True, ['sabado_manana', None], {'sabado_manana': 1}, 'lunes_noche']:
+            respuesta = self.client.post('/api/anuncios-jugador/', {
+                'jugador_id': self.jugador.id, 'sexo': 'indiferente', 'disponibilidad': valor,
+            }, format='json')
+            self.assertEqual(respuesta.status_code, 400, valor)
+            self.assertIn('disponibilidad', respuesta.data)
+
+    def test_filtro_solapa(self):
+        anuncio = AnuncioJugador.objects.create(
+            jugador=self.jugador, disponibilidad_dia='sabado', disponibilidad_horaria='todo_dia', sexo='indiferente',
+        )
+        sabado_tarde = disponibilidad.bit('sabado', 'tarde')
+        lunes_manana = disponibilidad.bit('lunes', 'manana')
+
+        self.assertEqual(list(AnuncioJugador.objects.filter(disponibilidad__solapa=sabado_tarde | lunes_manana)), [anuncio])
+        self.assertFalse(AnuncioJugador.objects.filter(disponibilidad__solapa=lunes_manana).exists())
+        respuesta = self.client.get(f'/api/anuncios-jugador/?disponibilidad__solapa={sabado_tarde}')
+        self.assertEqual([a['id'] for a in respuesta.data], [anuncio.id])
+
+
+class MapaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='jugador', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def crear_anuncio_equipo(self, nombre, lat, lon):
+        equipo = Equipo.objects.create(
+            creador=self.user, nombre=nombre, categoria='senior',
+            primera_camiseta='blanca', primera_pantalon='negro', sexo='mixto',
+        )
+        return AnuncioEquipo.objects.create(
+            equipo=equipo, dia_partido='sabado', horario_partido='manana', direccion_partido='Pabellón',
+            latitud_partido=lat, longitud_partido=lon,
+        )
+
+    def test_agrupa_con_zoom_bajo_y_se_invalida_al_cambiar_un_anuncio(self):
+        self.crear_anuncio_equipo('A', 40.40, -3.70)
+        self.crear_anuncio_equipo('B', 40.42, -3.68)
+        self.crear_anuncio_equipo('Barcelona', 41.38, 2.17)
+
+        respuesta = self.client.get('/api/anuncios-mapa/?bbox=-4,40,-3,41&zoom=6')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual([c['cantidad'] for c in respuesta.data['clusters']], [2])
+        self.assertAlmostEqual(respuesta.data['clusters'][0]['latitud'], 40.41)
+
+        self.crear_anuncio_equipo('C', 40.41, -3.69)
+        respuesta = self.client.get('/api/anuncios-mapa/?bbox=-4,40,-3,41&zoom=6')
+        self.assertEqual([c['cantidad'] for c in respuesta.data['clusters']], [3])
+
+    def test_solo_invalidan_los_cambios_de_posicion_o_visibilidad(self):
+        anuncio = self.crear_anuncio_equipo('A', 40.40, -3.70)
+        jugador = Jugador.objects.create(
+            user=self.user, nombre='Ana', edad=25, altura='1.75', posicion='base',
+            direccion='Calle Mayor 1, Madrid', nivel='intermedio',
+            correo='ana@example.com', sexo='femenino', latitud=40.4, longitud=-3.7,
+        )
+        version = cache.get('mapa:version')
+
+        anuncio.descripcion = 'Buscamos base'
+        anuncio.save()
+        jugador.latitud = 40.5
+        jugador.save()
+        # Sin anuncio de jugador, su ubicación no sale en el mapa
+        self.assertEqual(cache.get('mapa:version'), version)
+
+        anuncio_jugador = AnuncioJugador.objects.create(
+            jugador=jugador, disponibilidad_dia='sabado', disponibilidad_horaria='manana', sexo='indiferente',
+        )
+        self.assertEqual(cache.get('mapa:version'), version + 1)
+        anuncio_jugador.sexo = 'mixto'
+        anuncio_jugador.save()
+        jugador.descripcion = 'Base zurda'
+        jugador.save()
+        self.assertEqual(cache.get('mapa:version'), version + 1)
+
+        jugador.latitud = 40.41
+        jugador.save()
+        anuncio.latitud_partido = 40.45
+        anuncio.save()
+        self.assertEqual(cache.get('mapa:version'), version + 3)
+
+    def test_puntos_sueltos_con_zoom_alto(self):
+        anuncio = self.crear_anuncio_equipo('A', 40.40, -3.70)
+
+        respuesta = self.client.get('/api/anuncios-mapa/?bbox=-3.71,40.39,-3.69,40.41&zoom=16')
+
+        self.assertEqual(respuesta.data['clusters'], [])
+        self.assertEqual(respuesta.data['puntos'], [
+            {'tipo': 'equipos', 'id': anuncio.id, 'latitud': 40.40, 'longitud': -3.70},
+        ])
+
+    def test_rechaza_cajas_no_validas(self):
+        for bbox in ['nan,40,-3,41', '-inf,40,-3,41', '-4,40,-3,inf', '-4,41,-3,40', '-4,-91,-3,41', '-200,40,-3,41']:
+            respuesta = self.client.get(f'/api/anuncios-mapa/?bbox={bbox}&zoom=6')
+            self.assertEqual(respuesta.status_code, 400, bbox)
+
+
+class ChatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='capitan', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def crear_chat(self, i):
+        jugador = Jugador.objects.create(
+            user=User.objects.create(username=f'jugador{i}'), nombre=f'Jugador {i}', edad=25, altura='1.75',
+            posicion='base', direccion='Calle Mayor 1, Madrid', nivel='intermedio',
+            correo='ana@example.com', sexo='femenino', latitud=40.4, longitud=-3.7,
+        )
+        equipo = Equipo.objects.create(
+            creador=self.user, nombre=f'Equipo {i}', categoria='senior',
+            primera_camiseta='blanca', primera_pantalon='negro', sexo='mixto',
+        )
+        chat = Chat.objects.create(jugador=jugador, equipo=equipo)
+        for texto in ('hola', 'adiós'):
+            Mensaje.objects.create(chat=chat, emisor=jugador.user, contenido=texto)
+        return chat
+
+    def test_listar_chats_con_consultas_constantes(self):
+        for i in range(3):
+            self.crear_chat(i)
+        with self.assertNumQueries(1):
+            respuesta = self.client.get('/api/chats/')
+        self.assertEqual(len(respuesta.data), 3)
+
+        for i in range(3, 20):
+            self.crear_chat(i)
+        with self.assertNumQueries(1):
+            respuesta = self.client.get('/api/chats/')
+        self.assertEqual(len(respuesta.data), 20)
+        primero = next(c for c in respuesta.data if c['equipo_nombre'] == 'Equipo 0')
+        self.assertEqual(primero['ultimo_mensaje']['contenido'], 'adiós')
+        self.assertEqual(primero['ultimo_mensaje']['emisor'], 'jugador0')
+
+    def test_borrar_el_ultimo_mensaje(self):
+        chat = self.crear_chat(0)
+        Mensaje.objects.filter(chat=chat, contenido='adiós').delete()
+        chat.refresh_from_db()
+        self.assertEqual(chat.ultimo_mensaje.contenido, 'hola')
+
+        chat.mensajes.all().delete()
+        chat.refresh_from_db()
+        self.assertIsNone(chat.ultimo_mensaje)
+        self.assertIsNone(chat.ultima_actividad)
+
+    def test_borrar_en_cascada_no_recalcula_por_mensaje(self):
+        consultas = []
+        for i, mensajes in enumerate((0, 20)):
+            chat = self.crear_chat(i)
+            Mensaje.objects.bulk_create([
+                Mensaje(chat=chat, emisor=self.user, contenido=f'mensaje {n}') for n in range(mensajes)
+            ])
+            with CaptureQueriesContext(connection) as contexto:
+                chat.equipo.delete()
+            consultas.append(len(contexto))
+            self.assertFalse(Mensaje.objects.filter(chat_id=chat.id).exists())
+        self.assertEqual(consultas[0], consultas[1])
+
+    def test_borrar_varios_mensajes_recalcula_una_vez(self):
+        chat = self.crear_chat(0)
+        Mensaje.objects.bulk_create([Mensaje(chat=chat, emisor=self.user, contenido='otro') for _ in range(10)])
+        primero = chat.mensajes.order_by('id').first()
+        Chat.objects.filter(pk=chat.pk).update(ultimo_mensaje=chat.mensajes.order_by('-id').first())
+
+        # Cargar los mensajes, poner a NULL el último, borrar y revisar el chat una vez (3 consultas)
+        with self.assertNumQueries(6):
+            chat.mensajes.exclude(pk=primero.pk).delete()
+        chat.refresh_from_db()
+        self.assertEqual(chat.ultimo_mensaje, primero)
+
+    def test_bandeja_por_actividad_con_no_leidos(self):
+        antiguo, reciente = self.crear_chat(0), self.crear_chat(1)
+        Mensaje.objects.create(chat=antiguo, emisor=self.user, contenido='mío, no cuenta')
+        Mensaje.objects.create(chat=reciente, emisor=reciente.jugador.user, contenido='otro más')
+
+        with self.assertNumQueries(1):
+            respuesta = self.client.get('/api/chats/bandeja/')
+        self.assertEqual([(c['id'], c['no_leidos']) for c in respuesta.data], [(reciente.id, 3), (antiguo.id, 2)])
+
+        respuesta = self.client.post(f'/api/chats/{reciente.id}/marcar-leido/')
+        self.assertEqual(respuesta.status_code, 200)
+        respuesta = self.client.get('/api/chats/bandeja/')
+        self.assertEqual([(c['id'], c['no_leidos']) for c in respuesta.data], [(reciente.id, 0), (antiguo.id, 2)])
+
+    def test_marcar_leido_hasta_un_mensaje(self):
+        chat = self.crear_chat(0)
+        primero, ultimo = chat.mensajes.order_by('id')
+        url = f'/api/chats/{chat.id}/marcar-leido/'
+
+        for mensaje in ('abc', True, 1.5, [1]):
+            self.assertEqual(self.client.post(url, {'mensaje': mensaje}, format='json').status_code, 400)
+
+        respuesta = self.client.post(url, {'mensaje': primero.id}, format='json')
+        self.assertEqual(respuesta.data['ultimo_leido'], primero.id)
+        # Un id inventado se queda en el último mensaje del chat
+        respuesta = self.client.post(url, {'mensaje': 10 ** 12}, format='json')
+        self.assertEqual(respuesta.data['ultimo_leido'], ultimo.id)
+
+        Mensaje.objects.create(chat=chat, emisor=chat.jugador.user, contenido='otro más')
+        respuesta = self.client.get('/api/chats/bandeja/')
+        self.assertEqual(respuesta.data[0]['no_leidos'], 1)
+
+    def test_mensajes_paginados_por_cursor(self):
+        chat = self.crear_chat(0)
+        # Mismo timestamp para todos: el desempate por id mantiene los cursores estables
+        Mensaje.objects.bulk_create([
+            Mensaje(chat=chat, emisor=self.user, contenido=str(i), timestamp=chat.mensajes.first().timestamp)
+            for i in range(7)
+        ])
+        esperados = list(chat.mensajes.order_by('timestamp', 'id').values_list('contenido', flat=True))
+
+        paginas, cursor = [], ''
+        while True:
+            respuesta = self.client.get(f'/api/mensajes/?chat={chat.id}&limite=4&cursor={cursor}')
+            paginas.insert(0, [m['contenido'] for m in respuesta.data['results']])
+            cursor = respuesta.data['siguiente']
+            if cursor is None:
+                break
+
+        # La primera página son los más recientes, cada una en orden cronológico
+        self.assertEqual([len(pagina) for pagina in paginas], [1, 4, 4])
+        self.assertEqual([m for pagina in paginas for m in pagina], esperados)
+        respuesta = self.client.get(f'/api/mensajes/?chat={chat.id}&cursor=roto')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('cursor', respuesta.data)
+
+    def test_mensajes_chat_equipo_solo_de_mis_equipos(self):
+        mio = ChatEquipo.objects.create(equipo=self.crear_chat(0).equipo)
+        otro_equipo = Equipo.objects.create(
+            creador=User.objects.create(username='otro'), nombre='Ajeno', categoria='senior',
+            primera_camiseta='blanca', primera_pantalon='negro', sexo='mixto',
+        )
+        ajeno = ChatEquipo.objects.create(equipo=otro_equipo)
+        MensajeChatEquipo.objects.create(chat=mio, emisor=self.user, contenido='mío')
+        MensajeChatEquipo.objects.create(chat=ajeno, emisor=otro_equipo.creador, contenido='ajeno')
+
+        respuesta = self.client.get('/api/mensajes-chat-equipo/')
+        self.assertEqual([m['contenido'] for m in respuesta.data['results']], ['mío'])
+        respuesta = self.client.post('/api/mensajes-chat-equipo/', {'chat': ajeno.id, 'contenido': 'hola'})
+        self.assertEqual(respuesta.status_code, 403)
+
+    def test_sincronizar_mensajes_nuevos(self):
+        chat = self.crear_chat(0)
+        ultimo = chat.mensajes.order_by('-id').first()
+        nuevos = [Mensaje.objects.create(chat=chat, emisor=self.user, contenido=str(i)) for i in range(3)]
+
+        respuesta = self.client.get(f'/api/mensajes/?chat={chat.id}&despues_de={ultimo.id}&limite=2')
+        self.assertEqual([m['id'] for m in respuesta.data['results']], [m.id for m in nuevos[:2]])
+        self.assertTrue(respuesta.data['hay_mas'])
+        respuesta = self.client.get(f'/api/mensajes/?chat={chat.id}&despues_de={nuevos[1].id}')
+        self.assertEqual([m['id'] for m in respuesta.data['results']], [nuevos[2].id])
+        self.assertFalse(respuesta.data['hay_mas'])
+
+    def test_novedades_en_una_consulta(self):
+        chat, otro = self.crear_chat(0), self.crear_chat(1)
+        grupal = ChatEquipo.objects.create(equipo=otro.equipo)
+        inicio = self.client.get('/api/chats/novedades/').data
+        self.assertEqual((inicio['chats'], inicio['chats_equipo']), ([], []))
+
+        Mensaje.objects.create(chat=chat, emisor=chat.jugador.user, contenido='nuevo')
+        ultimo = Mensaje.objects.create(chat=chat, emisor=chat.jugador.user, contenido='otro')
+        ultimo_grupal = MensajeChatEquipo.objects.create(chat=grupal, emisor=self.user, contenido='equipo')
+        url = f"/api/chats/novedades/?despues_de={inicio['despues_de']}&despues_de_equipo={inicio['despues_de_equipo']}"
+        with self.assertNumQueries(1):
+            respuesta = self.client.get(url)
+
+        self.assertEqual(respuesta.data['chats'], [{'chat': chat.id, 'nuevos': 2, 'ultimo': ultimo.id}])
+        self.assertEqual(respuesta.data['chats_equipo'], [{'chat': grupal.id, 'nuevos': 1, 'ultimo': ultimo_grupal.id}])
+        self.assertEqual((respuesta.data['despues_de'], respuesta.data['despues_de_equipo']), (ultimo.id, ultimo_grupal.id))
+
+class ConsultasConstantesMixin:
+    """
+    Falla si un endpoint hace más consultas cuanto más filas devuelve: mide
+    la petición con pocas filas y con más, y exige el mismo número.
+    """
+
+    def assertConsultasConstantes(self, url, crear_fila, pocas=1, muchas=6):
+        for _ in range(pocas):
+            crear_fila()
+        antes = self._contar_consultas(url, pocas)
+        for _ in range(muchas - pocas):
+            crear_fila()
+        despues = self._contar_consultas(url, muchas)
+        self.assertEqual(
+            antes, despues,
+            f"{url} hace {antes} consultas con {pocas} filas y {despues} con {muchas}",
+        )
+
+    def _contar_consultas(self, url, filas):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        datos = respuesta.data['results'] if isinstance(respuesta.data, dict) else respuesta.data
+        self.assertEqual(len(datos), filas, f"{url} debería devolver {filas} filas")
+        return len(consultas)
+
+
+class ConsultasPorEndpointTests(ConsultasConstantesMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='capitan', password='x', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.jugador = self.crear_jugador(self.user)
+        self.equipo = self.crear_equipo(self.user)
+        self.contador = 0
+
+    def nuevo_usuario(self):
+        self.contador += 1
+        return User.objects.create(username=f'usuario{self.contador}')
+
+    def crear_jugador(self, user):
+        return Jugador.objects.create(
+            user=user, nombre=user.username, edad=25, altura='1.75', posicion='base',
+            direccion='Calle Mayor 1, Madrid', nivel='intermedio',
+            correo='ana@example.com', sexo='femenino', latitud=40.4, longitud=-3.7,
+        )
+
+    def crear_equipo(self, creador):
+        return Equipo.objects.create(
+            creador=creador, nombre=f'Equipo de {creador.username}', categoria='senior',
+            primera_camiseta='blanca', primera_pantalon='negro', sexo='mixto',
+        )
+
+    def test_invitaciones_enviadas(self):
+        self.assertConsultasConstantes('/api/invitaciones/', lambda: Invitacion.objects.create(
+            equipo=self.crear_equipo(self.user), jugador=self.crear_jugador(self.nuevo_usuario()),
+        ))
+
+    def test_invitaciones_pendientes(self):
+        self.assertConsultasConstantes('/api/invitaciones-pendientes/', lambda: Invitacion.objects.create(
+            equipo=self.crear_equipo(self.nuevo_usuario()), jugador=self.jugador,
+        ))
+
+    def test_calendario_equipo(self):
+        self.assertConsultasConstantes(f'/api/calendario-equipo/{self.equipo.id}/', lambda: EventoCalendario.objects.create(
+            equipo=self.equipo, tipo='partido', fecha='2026-11-07', hora='10:00', lugar='Pabellón',
+        ))
+
+    def test_mensajes_de_un_chat(self):
+        chat = Chat.objects.create(jugador=self.crear_jugador(self.nuevo_usuario()), equipo=self.equipo)
+        self.assertConsultasConstantes(f'/api/mensajes/?chat={chat.id}', lambda: Mensaje.objects.create(
+            chat=chat, emisor=self.nuevo_usuario(), contenido='hola',
+        ))
+
+    def test_mensajes_chat_equipo(self):
+        chat = ChatEquipo.objects.create(equipo=self.equipo)
+        self.assertConsultasConstantes(f'/api/mensajes-chat-equipo/?chat={chat.id}', lambda: MensajeChatEquipo.objects.create(
+            chat=chat, emisor=self.nuevo_usuario(), contenido='hola',
+        ))
+
+    def test_reportes(self):
+        self.assertConsultasConstantes('/api/reportes/', lambda: Reporte.objects.create(
+            reportado=self.nuevo_usuario(), reportante=self.nuevo_usuario(), motivo='spam',
+        ))
+
+    def test_mis_equipos(self):
+        def unirse_a_un_equipo():
+            equipo = self.crear_equipo(self.nuevo_usuario())
+            equipo.jugadores.add(self.jugador, self.crear_jugador(self.nuevo_usuario()))
+        self.assertConsultasConstantes('/api/mis-equipos/', unirse_a_un_equipo)
+
+    def test_mis_equipos_creados(self):
+        def crear_equipo_con_anuncio():
+            equipo = self.crear_equipo(self.user)
+            equipo.jugadores.add(self.crear_jugador(self.nuevo_usuario()))
+            AnuncioEquipo.objects.create(
+                equipo=equipo, dia_partido='sabado', horario_partido='manana', direccion_partido='Pabellón',
+                latitud_partido=40.4, longitud_partido=-3.7,
+            )
+        self.equipo.delete()
+        self.assertConsultasConstantes('/api/mis-equipos-creados/', crear_equipo_con_anuncio)
+
+
+@override_settings(INSTRUMENTACION_ACTIVA=True, INSTRUMENTACION_UMBRAL_LENTO_MS=0)
+class InstrumentacionTests(TestCase):
+    def setUp(self):
+        geocoding.reiniciar_cache()
+        self.user = User.objects.create_user(username='jugador', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        parche = mock.patch.object(geocoding, '_geolocator')
+        parche.start().return_value.geocode.return_value = UbicacionFalsa(40.4, -3.7)
+        self.addCleanup(parche.stop)
+
+    def test_server_timing_y_log_de_la_peticion(self):
+        with self.assertLogs('basketconecta.instrumentacion', 'INFO') as logs:
+            respuesta = self.client.post('/api/jugadores/', {
+                'nombre': 'Ana', 'edad': 25, 'altura': '1.75', 'posicion': 'base',
+                'direccion': 'Calle Mayor 1, Madrid', 'nivel': 'intermedio',
+                'correo': 'ana@example.com', 'sexo': 'femenino',
+            })
+
+        self.assertEqual(respuesta.status_code, 201)
+        cabecera = respuesta['Server-Timing']
+        for metrica in ('db;dur=', 'geo;dur=', 'ser;dur=', 'total;dur='):
+            self.assertIn(metrica, cabecera)
+        self.assertIn('1 llamadas', cabecera)
+
+        peticion, lenta = (json.loads(registro.getMessage()) for registro in logs.records)
+        self.assertEqual(peticion['vista'], 'JugadorViewSet.create')
+        self.assertEqual(peticion['estado'], 201)
+        self.assertGreater(peticion['consultas'], 0)
+        self.assertEqual(logs.records[1].name, 'basketconecta.instrumentacion.lentas')
+        self.assertTrue(lenta['peores_consultas'])
+
+    def test_consultas_duplicadas_y_peores(self):
+        medicion = instrumentacion.Medicion()
+        with connection.execute_wrapper(medicion.registrar_consulta):
+            for _ in range(3):
+                list(Equipo.objects.filter(creador=self.user))
+            list(Jugador.objects.all())
+
+        self.assertEqual(len(medicion.consultas), 4)
+        self.assertEqual(medicion.duplicadas, 2)
+        peores = medicion.peores_consultas(5)
+        self.assertEqual(sorted(consulta['veces'] for consulta in peores), [1, 3])
+
+    def test_serializacion_medida_una_vez(self):
+        equipo = Equipo.objects.create(
+            creador=self.user, nombre='Los Pivots', categoria='senior',
+            primera_camiseta='blanca', primera_pantalon='negro', sexo='mixto',
+        )
+        equipo.jugadores.add(Jugador.objects.create(
+            user=self.user, nombre='Ana', edad=25, altura='1.75', posicion='base',
+            direccion='Calle Mayor 1, Madrid', nivel='intermedio',
+            correo='ana@example.com', sexo='femenino', latitud=40.4, longitud=-3.7,
+        ))
+        medicion = instrumentacion.Medicion()
+        token = instrumentacion._medicion.set(medicion)
+        try:
+            with mock.patch.object(instrumentacion.time, 'perf_counter', side_effect=[0.0, 0.25]):
+                datos = serializers.EquipoSerializer(Equipo.objects.all(), many=True).data
+        finally:
+            instrumentacion._medicion.reset(token)
+
+        # El serializador anidado de la plantilla no se mide aparte
+        self.assertEqual(len(datos[0]['jugadores']), 1)
+        self.assertEqual(medicion.serializacion, 0.25)
+
+    @override_settings(INSTRUMENTACION_ACTIVA=False)
+    def test_desactivada(self):
+        respuesta = self.client.get('/api/equipos/')
+        self.assertNotIn('Server-Timing', respuesta)
+
+
+class MetricasTests(TestCase):
+    def setUp(self):
+        geocoding.reiniciar_cache()
+        self.user = User.objects.create_user(username='jugador', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        parche = mock.patch.object(geocoding, '_geolocator')
+        parche.start().return_value.geocode.return_value = UbicacionFalsa(40.4, -3.7)
+        self.addCleanup(parche.stop)
+
+    def valor(self, nombre, **etiquetas):
+        return REGISTRY.get_sample_value(nombre, etiquetas) or 0
+
+    def test_metricas_por_vista(self):
+        peticiones = self.valor(
+            'basketconecta_peticiones_total', vista='JugadorViewSet.create', metodo='POST', estado='201',
+        )
+        latencias = self.valor('basketconecta_latencia_segundos_count', vista='JugadorViewSet.create')
+        fallos_cache = self.valor('basketconecta_cache_consultas_total', cache='geocodificacion', resultado='fallo')
+
+        self.client.post('/api/jugadores/', {
+            'nombre': 'Ana', 'edad': 25, 'altura': '1.75', 'posicion': 'base',
+            'direccion': 'Calle Mayor 1, Madrid', 'nivel': 'intermedio',
+            'correo': 'ana@example.com', 'sexo': 'femenino',
+        })
+
+        self.assertEqual(self.valor(
+            'basketconecta_peticiones_total', vista='JugadorViewSet.create', metodo='POST', estado='201',
+        ), peticiones + 1)
+        self.assertEqual(self.valor('basketconecta_latencia_segundos_count', vista='JugadorViewSet.create'), latencias + 1)
+        self.assertGreater(self.valor('basketconecta_consultas_bd_total', vista='JugadorViewSet.create'), 0)
+        self.assertEqual(self.valor(
+            'basketconecta_cache_consultas_total', cache='geocodificacion', resultado='fallo',
+        ), fallos_cache + 1)
+        self.assertGreater(self.valor(
+            'basketconecta_geocodificaciones_total', backend='GeocodificadorNominatim', resultado='encontrada',
+        ), 0)
+
+    @override_settings(DEBUG=True)
+    def test_endpoint_metrics(self):
+        self.client.get('/api/equipos/')
+        self.client.generic('PROPFIND', '/api/equipos/')
+        respuesta = self.client.get('/metrics')
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('text/plain', respuesta['Content-Type'])
+        self.assertIn(b'basketconecta_peticiones_total{estado="200",metodo="GET",vista="EquipoViewSet.list"}', respuesta.content)
+        self.assertIn(b'metodo="otro"', respuesta.content)
+        self.assertNotIn(b'PROPFIND', respuesta.content)
+
+    def test_endpoint_metrics_sin_token_en_produccion(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    @override_settings(METRICAS_TOKEN='secreto')
+    def test_endpoint_metrics_con_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secreto').status_code, 200)
+
+
+class TiempoRealTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='capitan', password='x')
+        jugador = Jugador.objects.create(
+            user=User.objects.create(username='jugador'), nombre='Ana', edad=25, altura='1.75',
+            posicion='base', direccion='Calle Mayor 1, Madrid', nivel='intermedio',
+            correo='ana@example.com', sexo='femenino', latitud=40.4, longitud=-3.7,
+        )
+        equipo = Equipo.objects.create(
+            creador=self.user, nombre='Los Pivots', categoria='senior',
+            primera_camiseta='blanca', primera_pantalon='negro', sexo='mixto',
+        )
+        self.chat = Chat.objects.create(jugador=jugador, equipo=equipo)
+        self.app = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    def conectar(self, url, usuario=None):
+        if usuario is not None:
+            url += f'?token={AccessToken.for_user(usuario)}'
+        return WebsocketCommunicator(self.app, url)
+
+    def escribir(self, contenido):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Mensaje.objects.create(chat=self.chat, emisor=self.user, contenido=contenido)
+
+    async def test_recibe_los_mensajes_nuevos_del_chat(self):
+        comunicador = self.conectar(f'/ws/chats/{self.chat.id}/', self.user)
+        conectado, _ = await comunicador.connect()
+        self.assertTrue(conectado)
+
+        mensaje = await database_sync_to_async(self.escribir)('hola')
+
+        recibido = await comunicador.receive_json_from()
+        self.assertEqual(recibido['tipo'], 'mensaje')
+        self.assertEqual(recibido['mensaje']['id'], mensaje.id)
+        self.assertEqual(recibido['mensaje']['contenido'], 'hola')
+        await comunicador.disconnect()
+
+    async def test_rechaza_sin_token_o_sin_acceso(self):
+        comunicador = self.conectar(f'/ws/chats/{self.chat.id}/')
+        self.assertEqual(await comunicador.connect(), (False, consumers.NO_AUTENTICADO))
+
+        ajeno = await database_sync_to_async(User.objects.create)(username='ajeno')
+        comunicador = self.conectar(f'/ws/chats/{self.chat.id}/', ajeno)
+        self.assertEqual(await comunicador.connect(), (False, consumers.SIN_PERMISO))
+
+
+class FlujoNotificacionesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='jugador', password='x')
+        self.token = str(AccessToken.for_user(self.user))
+
+    def notificar(self, mensaje):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notificacion.objects.create(usuario=self.user, mensaje=mensaje)
+
+    async def abrir(self, **cabeceras):
+        respuesta = await self.async_client.get(f'/api/notificaciones-flujo/?token={self.token}', headers=cabeceras)
+        self.assertEqual(respuesta['Content-Type'], 'text/event-stream')
+        eventos = aiter(respuesta.streaming_content)
+        self.assertEqual(await anext(eventos), b': conectado\n\n')
+        return respuesta, eventos
+
+    async def test_envia_las_notificaciones_nuevas(self):
+        respuesta, eventos = await self.abrir()
+        notificacion = await database_sync_to_async(self.notificar)('Te han invitado a Los Pivots')
+
+        evento = (await anext(eventos)).decode()
+        self.assertTrue(evento.startswith(f'id: {notificacion.id}\nevent: notificacion\n'))
+        self.assertIn('Te han invitado a Los Pivots', evento)
+        # Como hace Django al desconectarse el cliente
+        respuesta.close()
+        self.assertEqual(flujo_notificaciones.hub.conexiones(self.user.id), 0)
+
+    async def test_recupera_las_perdidas_con_last_event_id(self):
+        vista = await database_sync_to_async(self.notificar)('vista')
+        perdida = await database_sync_to_async(self.notificar)('perdida')
+
+        respuesta, eventos = await self.abrir(**{'Last-Event-ID': str(vista.id)})
+        self.assertTrue((await anext(eventos)).decode().startswith(f'id: {perdida.id}\n'))
+        respuesta.close()
+
+    async def test_sin_token(self):
+        respuesta = await self.async_client.get('/api/notificaciones-flujo/')
+        self.assertEqual(respuesta.status_code, 401)
+
+    async def test_expulsa_a_los_lentos(self):
+        hub = flujo_notificaciones.Hub()
+        lenta = hub.suscribir(self.user.id, tamano=2)
+        for i in range(3):
+            hub.publicar(self.user.id, (i, f'evento {i}'))
+        await asyncio.sleep(0)
+
+        self.assertTrue(lenta.expulsada)
+        self.assertIs(lenta.cola.get_nowait(), flujo_notificaciones._EXPULSADA)
+        self.assertEqual(hub.conexiones(), 0)
+
+
+class NotificacionesEnBloqueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='jugador', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.notificaciones = [
+            Notificacion.objects.create(usuario=self.user, mensaje=f'aviso {i}') for i in range(4)
+        ]
+        Notificacion.objects.create(usuario=User.objects.create(username='otro'), mensaje='ajena')
+
+    def test_contar_y_marcar_leidas(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/notificaciones/no-leidas/').data, {'no_leidas': 4})
+
+        ids = [n.id for n in self.notificaciones[:2]]
+        with self.assertNumQueries(1):
+            respuesta = self.client.post('/api/notificaciones/marcar-leidas/', {'ids': ids}, format='json')
+        self.assertEqual(respuesta.data, {'marcadas': 2})
+        self.assertEqual(self.client.get('/api/notificaciones/no-leidas/').data, {'no_leidas': 2})
+
+        with self.assertNumQueries(1):
+            respuesta = self.client.post('/api/notificaciones/marcar-leidas/')
+        self.assertEqual(respuesta.data, {'marcadas': 2})
+        self.assertEqual(Notificacion.objects.filter(leida=False).count(), 1)
+
+    def test_borrar_leidas_antiguas(self):
+        hace_un_mes = timezone.now() - timedelta(days=30)
+        Notificacion.objects.filter(id__in=[n.id for n in self.notificaciones[:3]]).update(creada=hace_un_mes)
+        Notificacion.objects.filter(id__in=[n.id for n in self.notificaciones[1:]]).update(leida=True)
+
+        with self.assertNumQueries(1):
+            respuesta = self.client.post('/api/notificaciones/borrar-leidas/', {'dias': 7}, format='json')
+
+        # Solo las leídas y antiguas: ni la no leída antigua ni la leída reciente
+        self.assertEqual(respuesta.data, {'borradas': 2})
+        self.assertEqual(
+            set(Notificacion.objects.filter(usuario=self.user).values_list('id', flat=True)),
+            {self.notificaciones[0].id, self.notificaciones[3].id},
+        )
+        self.assertEqual(self.client.post('/api/notificaciones/borrar-leidas/', {}).status_code, 400)
+
+    def test_parametros_no_validos(self):
+        for ids in ([True], [1, False], ['1'], 1, [2 ** 70], [0], [-1]):
+            respuesta = self.client.post('/api/notificaciones/marcar-leidas/', {'ids': ids}, format='json')
+            self.assertEqual(respuesta.status_code, 400, ids)
+        for dias in (-1, 10 ** 10, 10 ** 30, True, 1.5, 'abc'):
+            respuesta = self.client.post('/api/notificaciones/borrar-leidas/', {'dias': dias}, format='json')
+            self.assertEqual(respuesta.status_code, 400, dias)
+        self.assertEqual(Notificacion.objects.filter(leida=True).count(), 0)
@@ -0,0 +1,72 @@
+from urllib.parse import parse_qs
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+
+# Mensajes en tiempo real por websocket (ver consumers.py y routing.py). Cada
+# sala es un grupo de la capa de canales; al confirmarse un mensaje nuevo se
+# envía a su grupo y cada conexión del grupo lo reenvía a su cliente.
+
+def grupo_chat(chat_id):
+    return f'chat.{chat_id}'
+
+
+def grupo_chat_equipo(chat_id):
+    return f'chat_equipo.{chat_id}'
+
+
+def emitir(grupo, datos):
+    """Envía `datos` a las conexiones del grupo cuando se confirme la transacción en curso."""
+    capa = get_channel_layer()
+    if capa is None:
+        return
+    evento = {'type': 'mensaje.nuevo', 'mensaje': datos}
+    transaction.on_commit(lambda: async_to_sync(capa.group_send)(grupo, evento))
+
+
+@receiver(post_save, sender='basketconecta.Mensaje')
+def _mensaje_creado(sender, instance, created, **kwargs):
+    if created:
+        from .serializers import MensajeSerializer
+        emitir(grupo_chat(instance.chat_id), dict(MensajeSerializer(instance).data))
+
+
+@receiver(post_save, sender='basketconecta.MensajeChatEquipo')
+def _mensaje_equipo_creado(sender, instance, created, **kwargs):
+    if created:
+        from .serializers import MensajeChatEquipoSerializer
+        emitir(grupo_chat_equipo(instance.chat_id), dict(MensajeChatEquipoSerializer(instance).data))
+
+
+def token_de_la_url(scope):
+    """Token JWT de acceso del parámetro `?token=`: los navegadores no mandan cabeceras en un websocket."""
+    return parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+
+
+def usuario_del_token(token):
+    """Usuario de un token JWT de acceso, o AnonymousUser si falta o no es válido."""
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+    if not token:
+        return AnonymousUser()
+    autenticacion = JWTAuthentication()
+    try:
+        return autenticacion.get_user(autenticacion.get_validated_token(token))
+    except (InvalidToken, AuthenticationFailed):
+        return AnonymousUser()
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """Pone en `scope['user']` el usuario del token de `?token=`."""
+
+    async def __call__(self, scope, receive, send):
+        usuario = await database_sync_to_async(usuario_del_token)(token_de_la_url(scope))
+        return await super().__call__(dict(scope, user=usuario), receive, send)
@@ -1,6 +1,7 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import path
-from .views import JugadorViewSet, EquipoViewSet, AnuncioEquipoViewSet, AnuncioJugadorViewSet,  ChatViewSet, MensajeViewSet, ChatEquipoViewSet, MensajeChatEquipoViewSet, IniciarChatView, InvitacionViewSet, MisEquiposView, InvitacionesPendientesView, EventoCalendarioViewSet, CalendarioEquipoView,NotificacionViewSet, AnunciosCercanosView, MisEquiposCreadosView, PasswordResetView, EliminarUsuarioView, ReporteViewSet
+from .flujo_notificaciones import vista_flujo_notificaciones
+from .views import JugadorViewSet, EquipoViewSet, AnuncioEquipoViewSet, AnuncioJugadorViewSet,  ChatViewSet, MensajeViewSet, ChatEquipoViewSet, MensajeChatEquipoViewSet, IniciarChatView, InvitacionViewSet, MisEquiposView, InvitacionesPendientesView, EventoCalendarioViewSet, CalendarioEquipoView,NotificacionViewSet, AnunciosCercanosView, MisEquiposCreadosView, PasswordResetView, EliminarUsuarioView, ReporteViewSet, EstadisticasGeocodificacionView, RecomendacionesView, AnunciosMapaView
 
 router = DefaultRouter()
 router.register(r'jugadores', JugadorViewSet, basename='jugador')
@@ -48,4 +49,20 @@ urlpatterns += [
 
 urlpatterns += [
     path('eliminar-usuario/', EliminarUsuarioView.as_view(), name='eliminar-usuario'),
-]
\ No newline at end of file
+]
+
+urlpatterns += [
+    path('geocodificacion/estadisticas/', EstadisticasGeocodificacionView.as_view(), name='geocodificacion-estadisticas'),
+]
+
+urlpatterns += [
+    path('recomendaciones/', RecomendacionesView.as_view(), name='recomendaciones'),
+]
+
+urlpatterns += [
+    path('anuncios-mapa/', AnunciosMapaView.as_view(), name='anuncios-mapa'),
+]
+
+urlpatterns += [
+    path('notificaciones-flujo/', vista_flujo_notificaciones, name='notificaciones-flujo'),
+]
@@ -1,7 +1,10 @@
 from django.shortcuts import render
-from haversine import haversine, Unit
+import heapq
+import math
+import numpy as np
 from django.db import models
 from rest_framework.views import APIView
+from rest_framework.decorators import action
 from rest_framework import serializers
 from rest_framework import viewsets, permissions
 from rest_framework.response import Response
@@ -15,15 +18,35 @@ from .models import AnuncioEquipo
 from .models import AnuncioJugador
 from .models import Equipo, Chat, Mensaje, Invitacion, EventoCalendario, Notificacion, ChatEquipo, MensajeChatEquipo
 from .models import Reporte
+from .pagination import PaginacionOpcional, PaginacionMensajes, PaginacionNotificaciones, crear_cursor_distancia, leer_cursor_distancia
+from .geo import distancias_km, seleccionar_cercanos
+from . import chats, geocoding, cola_geocodificacion, mapa
 from .serializers import JugadorSerializer
-from .serializers import EquipoSerializer, AnuncioEquipoSerializer, AnuncioJugadorSerializer, ChatSerializer, MensajeSerializer, InvitacionSerializer, EventoCalendarioSerializer, NotificacionSerializer, ChatEquipoSerializer, MensajeChatEquipoSerializer, ReporteSerializer   
+from .serializers import EquipoSerializer, AnuncioEquipoSerializer, AnuncioJugadorSerializer, ChatSerializer, BandejaChatSerializer, MensajeSerializer, InvitacionSerializer, EventoCalendarioSerializer, NotificacionSerializer, ChatEquipoSerializer, MensajeChatEquipoSerializer, ReporteSerializer   
 from django.core.mail import send_mail
 import random
 import string
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta
 
 
 
+def leer_radio(lat, lon, distancia):
+    """
+    Convierte los parámetros de una búsqueda por radio a float. Lanza
+    ValidationError (400) si no son números finitos o la distancia es negativa.
+    """
+    try:
+        lat, lon, distancia = float(lat), float(lon), float(distancia)
+    except ValueError:
+        lat = None
+    if lat is None or not all(map(math.isfinite, (lat, lon, distancia))) or distancia < 0:
+        raise serializers.ValidationError("latitud, longitud y distancia deben ser números y la distancia no negativa.")
+    return lat, lon, distancia
+
+
 class EsDueñoDelAnuncioJugador(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         # Permitir lectura (GET, HEAD, OPTIONS) a todos los autenticados
@@ -36,17 +59,45 @@ class AnuncioJugadorViewSet(viewsets.ModelViewSet):
     serializer_class = AnuncioJugadorSerializer
     permission_classes = [permissions.IsAuthenticated, EsDueñoDelAnuncioJugador]
     filter_backends = [DjangoFilterBackend]
+    pagination_class = PaginacionOpcional
     filterset_fields = {
         'sexo': ['exact'],
         'disponibilidad_dia': ['exact'],
         'disponibilidad_horaria': ['exact'],
+        # ?disponibilidad__solapa=<máscara>: anuncios que comparten alguna franja
+        'disponibilidad': ['solapa'],
         'jugador__posicion': ['exact'],
         'jugador__altura': ['gte', 'lte'],
         'jugador__nivel': ['exact'],
     }
 
+    # Radio por defecto al buscar jugadores alrededor de un anuncio de equipo
+    DISTANCIA_POR_DEFECTO_KM = 10
+
     def get_queryset(self):
-        return AnuncioJugador.objects.all()
+        queryset = AnuncioJugador.objects.select_related('jugador')
+        params = self.request.query_params
+        anuncio_equipo_id = params.get('anuncio_equipo')
+        lat = params.get('latitud')
+        lon = params.get('longitud')
+        distancia = params.get('distancia')
+
+        if anuncio_equipo_id:
+            # Jugadores cerca del campo de un anuncio de equipo
+            if not anuncio_equipo_id.isdigit():
+                raise serializers.ValidationError("anuncio_equipo debe ser el id de un anuncio de equipo.")
+            anuncio = get_object_or_404(AnuncioEquipo, id=anuncio_equipo_id)
+            if anuncio.latitud_partido is None or anuncio.longitud_partido is None:
+                raise serializers.ValidationError("El anuncio de equipo no tiene coordenadas registradas.")
+            lat, lon = anuncio.latitud_partido, anuncio.longitud_partido
+            distancia = distancia or self.DISTANCIA_POR_DEFECTO_KM
+
+        if lat and lon and distancia:
+            lat, lon, distancia = leer_radio(lat, lon, distancia)
+            # Mismo filtro que en anuncios de equipo: caja envolvente indexada,
+            # distancia exacta y orden por cercanía en una sola consulta
+            queryset = queryset.cerca_de(lat, lon, distancia)
+        return queryset
 
     def perform_create(self, serializer):
         jugador = serializer.validated_data['jugador']
@@ -72,7 +123,7 @@ class EquipoViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated, EsCreadorDelEquipo]
 
     def get_queryset(self):
-        return Equipo.objects.all()
+        return Equipo.objects.para_serializar()
 
     def perform_create(self, serializer):
         serializer.save(creador=self.request.user)
@@ -115,11 +166,14 @@ class AnuncioEquipoViewSet(viewsets.ModelViewSet):
     serializer_class = AnuncioEquipoSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend]
+    pagination_class = PaginacionOpcional
     filterset_fields = {
         'dia_partido': ['exact'],
         'horario_partido': ['exact'],
         'dia_entrenamiento': ['exact'],
         'horario_entrenamiento': ['exact'],
+        'disponibilidad_partido': ['solapa'],
+        'disponibilidad_entrenamiento': ['solapa'],
         'equipo__sexo': ['exact'],
         'equipo__categoria': ['exact'],
     }
@@ -129,28 +183,10 @@ class AnuncioEquipoViewSet(viewsets.ModelViewSet):
         lat = self.request.query_params.get('latitud')
         lon = self.request.query_params.get('longitud')
         distancia = self.request.query_params.get('distancia')
-        print(f"Parámetros recibidos: lat={lat}, lon={lon}, distancia={distancia}")
         if lat and lon and distancia:
-            from math import radians, cos, sin, asin, sqrt
-            lat = float(lat)
-            lon = float(lon)
-            distancia = float(distancia)
-
-            def haversine(lat1, lon1, lat2, lon2):
-                lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-                dlon = lon2 - lon1
-                dlat = lat2 - lat1
-                a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-                c = 2 * asin(sqrt(a))
-                r = 6371
-                return c * r
-
-            ids = [
-                anuncio.id for anuncio in queryset
-                if anuncio.latitud_partido and anuncio.longitud_partido and
-                haversine(lat, lon, anuncio.latitud_partido, anuncio.longitud_partido) <= distancia
-            ]
-            queryset = queryset.filter(id__in=ids)
+            # Caja envolvente sobre columnas indexadas + distancia exacta en SQL,
+            # ordenado por cercanía. Con ?limite= se aplica LIMIT en la misma consulta.
+            queryset = queryset.cerca_del_partido(*leer_radio(lat, lon, distancia))
         return queryset
 
     def perform_create(self, serializer):
@@ -166,20 +202,69 @@ class ChatViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        user = self.request.user
-        queryset = Chat.objects.filter(
-            models.Q(jugador__user=user) |
-            models.Q(equipo__creador=user)
-        )
+        queryset = chats.chats_de(self.request.user).select_related('jugador', 'equipo', 'ultimo_mensaje__emisor')
         anuncio_equipo_id = self.request.query_params.get('anuncio_equipo')
         if anuncio_equipo_id:
             queryset = queryset.filter(anuncio_equipo_id=anuncio_equipo_id)
         return queryset
 
+    @action(detail=False, pagination_class=PaginacionOpcional)
+    def bandeja(self, request):
+        """Chats por última actividad, con los mensajes no leídos de cada uno."""
+        queryset = chats.bandeja(self.get_queryset(), request.user)
+        pagina = self.paginate_queryset(queryset)
+        if pagina is not None:
+            return self.get_paginated_response(BandejaChatSerializer(pagina, many=True).data)
+        return Response(BandejaChatSerializer(queryset, many=True).data)
+
+    @action(detail=True, methods=['post'], url_path='marcar-leido')
+    def marcar_leido(self, request, pk=None):
+        """Marca el chat como leído hasta `mensaje` (por defecto, hasta el último mensaje)."""
+        chat = self.get_object()
+        mensaje_id = request.data.get('mensaje')
+        if mensaje_id in (None, ''):
+            mensaje_id = None
+        else:
+            try:
+                if isinstance(mensaje_id, (bool, float)):
+                    raise TypeError(mensaje_id)
+                mensaje_id = int(mensaje_id)
+            except (TypeError, ValueError):
+                return Response({'error': 'mensaje debe ser el id de un mensaje.'}, status=status.HTTP_400_BAD_REQUEST)
+        ultimo_leido = chats.marcar_leido(chat, request.user, mensaje_id)
+        return Response({'ultimo_leido': ultimo_leido})
+
+    @action(detail=False)
+    def novedades(self, request):
+        """
+        Sondeo de mensajes nuevos en todos los chats del usuario. Recibe los
+        últimos ids vistos, `despues_de` (chats) y `despues_de_equipo` (chats
+        grupales), y devuelve los chats con mensajes posteriores y los ids
+        para el siguiente sondeo. Sin ids, devuelve solo los ids actuales.
+        """
+        try:
+            despues_de = request.query_params.get('despues_de')
+            despues_de_equipo = request.query_params.get('despues_de_equipo')
+            if despues_de is None or despues_de_equipo is None:
+                despues_de, despues_de_equipo = chats.ultimos_ids()
+                return Response({
+                    'chats': [], 'chats_equipo': [],
+                    'despues_de': despues_de, 'despues_de_equipo': despues_de_equipo,
+                })
+            despues_de, despues_de_equipo = int(despues_de), int(despues_de_equipo)
+        except ValueError:
+            return Response({'error': 'despues_de y despues_de_equipo deben ser ids.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        resultado = chats.novedades(request.user, despues_de, despues_de_equipo)
+        resultado['despues_de'] = max([despues_de] + [c['ultimo'] for c in resultado['chats']])
+        resultado['despues_de_equipo'] = max([despues_de_equipo] + [c['ultimo'] for c in resultado['chats_equipo']])
+        return Response(resultado)
+
 
 class MensajeViewSet(viewsets.ModelViewSet):
     serializer_class = MensajeSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PaginacionMensajes
 
     def get_queryset(self):
         user = self.request.user
@@ -193,8 +278,8 @@ class MensajeViewSet(viewsets.ModelViewSet):
                 return Mensaje.objects.none()
             if chat.jugador.user != user and chat.equipo.creador != user:
                 return Mensaje.objects.none()
-            return Mensaje.objects.filter(chat=chat).order_by('timestamp')
-        return Mensaje.objects.filter(emisor=user).order_by('timestamp')
+            return Mensaje.objects.filter(chat=chat).select_related('emisor').order_by('timestamp')
+        return Mensaje.objects.filter(emisor=user).select_related('emisor').order_by('timestamp')
 
     def perform_create(self, serializer):
         chat = serializer.validated_data['chat']
@@ -253,7 +338,7 @@ class InvitacionViewSet(viewsets.ModelViewSet):
         user = self.request.user
         queryset = Invitacion.objects.filter(
             models.Q(equipo__creador=user) | models.Q(jugador__user=user)
-        )
+        ).select_related('equipo', 'jugador')
         equipo_id = self.request.query_params.get('equipo')
         jugador_id = self.request.query_params.get('jugador')
         if equipo_id:
@@ -312,7 +397,7 @@ class MisEquiposView(APIView):
 
     def get(self, request):
         jugador = get_object_or_404(Jugador, user=request.user)
-        equipos = jugador.equipos.all()  # relación M:N
+        equipos = jugador.equipos.para_serializar()  # relación M:N
         serializer = EquipoSerializer(equipos, many=True)
         return Response(serializer.data)
     
@@ -321,7 +406,7 @@ class InvitacionesPendientesView(APIView):
 
     def get(self, request):
         jugador = get_object_or_404(Jugador, user=request.user)
-        invitaciones = Invitacion.objects.filter(jugador=jugador, estado='pendiente')
+        invitaciones = Invitacion.objects.filter(jugador=jugador, estado='pendiente').select_related('equipo', 'jugador')
         serializer = InvitacionSerializer(invitaciones, many=True)
         return Response(serializer.data)
     
@@ -331,7 +416,7 @@ class EventoCalendarioViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
-        return EventoCalendario.objects.filter(equipo__creador=user)
+        return EventoCalendario.objects.filter(equipo__creador=user).select_related('equipo')
 
     def perform_create(self, serializer):
         equipo = serializer.validated_data['equipo']
@@ -349,13 +434,18 @@ class CalendarioEquipoView(APIView):
         if request.user != equipo.creador and not equipo.jugadores.filter(user=request.user).exists():
             return Response({"detail": "No tienes acceso a este calendario."}, status=status.HTTP_403_FORBIDDEN)
 
-        eventos = equipo.eventos.all().order_by('fecha', 'hora')
+        eventos = equipo.eventos.select_related('equipo').order_by('fecha', 'hora')
         serializer = EventoCalendarioSerializer(eventos, many=True)
         return Response(serializer.data)
     
 class NotificacionViewSet(viewsets.ModelViewSet):
     serializer_class = NotificacionSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PaginacionNotificaciones
+    # Antigüedad máxima que se admite en `dias` al borrar (diez años)
+    MAX_DIAS = 3650
+    # Los ids son BigAutoField: fuera de (0, 2**63) la base de datos no los admite
+    MAX_ID = 2 ** 63 - 1
 
     def get_queryset(self):
         return Notificacion.objects.filter(usuario=self.request.user).order_by('-creada')
@@ -364,83 +454,197 @@ class NotificacionViewSet(viewsets.ModelViewSet):
         # Solo permite marcar como leída
         serializer.save()
 
+    @action(detail=False, url_path='no-leidas')
+    def no_leidas(self, request):
+        """Número de notificaciones sin leer, contado sobre el índice (usuario, leida, creada)."""
+        return Response({'no_leidas': self.get_queryset().filter(leida=False).count()})
+
+    @action(detail=False, methods=['post'], url_path='marcar-leidas')
+    def marcar_leidas(self, request):
+        """Marca como leídas las notificaciones de `ids`, o todas si no se envía. Un solo UPDATE."""
+        queryset = self.get_queryset().filter(leida=False)
+        ids = request.data.get('ids')
+        if ids is not None:
+            # bool es subclase de int: true/false no son ids
+            if not isinstance(ids, list) or not all(
+                isinstance(id, int) and not isinstance(id, bool) and 0 < id <= self.MAX_ID for id in ids
+            ):
+                return Response({'error': 'ids debe ser una lista de ids.'}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(id__in=ids)
+        return Response({'marcadas': queryset.order_by().update(leida=True)})
+
+    @action(detail=False, methods=['post'], url_path='borrar-leidas')
+    def borrar_leidas(self, request):
+        """Borra las notificaciones leídas creadas hace más de `dias` días o antes de `antes_de`. Un solo DELETE."""
+        dias = request.data.get('dias')
+        antes_de = request.data.get('antes_de')
+        try:
+            if dias is not None:
+                if isinstance(dias, (bool, float)) or not 0 <= int(dias) <= self.MAX_DIAS:
+                    raise ValueError(dias)
+                limite = timezone.now() - timedelta(days=int(dias))
+            else:
+                limite = parse_datetime(antes_de) if isinstance(antes_de, str) else None
+        except (TypeError, ValueError, OverflowError):
+            limite = None
+        if limite is None:
+            return Response(
+                {'error': f'Indica dias (entero entre 0 y {self.MAX_DIAS}) o antes_de (fecha ISO 8601).'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if timezone.is_naive(limite):
+            limite = timezone.make_aware(limite)
+        borradas, _ = self.get_queryset().filter(leida=True, creada__lt=limite).order_by().delete()
+        return Response({'borradas': borradas})
+
 class AnunciosCercanosView(APIView):
+    """
+    Anuncios de equipo cerca del jugador, de más cerca a más lejos y paginados
+    con `?limite=` y `?cursor=`. Con `?completo=true` se devuelve además el
+    volcado de todos los anuncios y la información de depuración.
+    """
     permission_classes = [IsAuthenticated]
+    LIMITE_POR_DEFECTO = 20
+    LIMITE_MAXIMO = 100
 
     def get(self, request):
+        jugador = get_object_or_404(Jugador, user=request.user)
+        completo = request.query_params.get('completo') in ('1', 'true')
         try:
             distancia_max_km = float(request.query_params.get('distancia', 5))  # valor por defecto: 5 km
-            jugador = get_object_or_404(Jugador, user=request.user)
-
-            # Información de depuración del jugador
-            debug_info = {
-                "jugador_id": jugador.id,
-                "jugador_nombre": jugador.nombre,
-                "coordenadas_jugador": {
-                    "latitud": jugador.latitud,
-                    "longitud": jugador.longitud
-                }
-            }
-
-            if not jugador.latitud or not jugador.longitud:
-                return Response({
-                    "error": "Tu perfil de jugador no tiene coordenadas registradas.",
-                    "debug_info": debug_info
-                }, status=400)
-
-            anuncios_cercanos = []
-            todos_los_anuncios = []
-            posicion_jugador = (jugador.latitud, jugador.longitud)
-            total_anuncios = AnuncioEquipo.objects.count()
-            anuncios_con_coordenadas = 0
-
-            for anuncio in AnuncioEquipo.objects.all():
-                if anuncio.latitud_partido and anuncio.longitud_partido:
-                    anuncios_con_coordenadas += 1
-                    posicion_anuncio = (anuncio.latitud_partido, anuncio.longitud_partido)
-                    
-                    # Calcular distancia usando haversine
-                    distancia = haversine(
-                        (float(jugador.latitud), float(jugador.longitud)),
-                        (float(anuncio.latitud_partido), float(anuncio.longitud_partido)),
-                        unit=Unit.KILOMETERS
-                    )
-                    
-                    anuncio_data = AnuncioEquipoSerializer(anuncio).data
-                    anuncio_data['distancia'] = round(distancia, 2)
-                    anuncio_data['posicion_jugador'] = posicion_jugador
-                    anuncio_data['posicion_anuncio'] = posicion_anuncio
-                    todos_los_anuncios.append(anuncio_data)
-
-                    # Solo añadir si está dentro del radio
-                    if distancia <= distancia_max_km:
-                        anuncios_cercanos.append(anuncio_data)
-
-            # Añadir información de depuración
-            debug_info.update({
-                "total_anuncios": total_anuncios,
-                "anuncios_con_coordenadas": anuncios_con_coordenadas,
-                "distancia_maxima_km": distancia_max_km,
-                "anuncios_cercanos_encontrados": len(anuncios_cercanos)
-            })
+        except ValueError:
+            distancia_max_km = None
+        if distancia_max_km is None or not math.isfinite(distancia_max_km) or distancia_max_km < 0:
+            return Response({"error": "La distancia debe ser un número de kilómetros no negativo."}, status=400)
+        try:
+            limite = self._limite(request, None if completo else self.LIMITE_POR_DEFECTO)
+        except ValueError:
+            return Response({"error": "El límite debe ser un entero mayor que cero."}, status=400)
+        cursor = request.query_params.get('cursor')
+        try:
+            posicion = leer_cursor_distancia(cursor) if cursor else None
+        except ValueError:
+            return Response({"error": "Cursor no válido."}, status=400)
 
+        if jugador.estado_geocodificacion == cola_geocodificacion.PENDIENTE:
             return Response({
-                "anuncios_cercanos": anuncios_cercanos,
-                "todos_los_anuncios": todos_los_anuncios,
-                "debug_info": debug_info
-            })
+                "error": "Tu dirección se está geolocalizando, inténtalo más tarde."
+            }, status=409)
 
-        except Exception as e:
+        if not jugador.latitud or not jugador.longitud:
             return Response({
-                "error": str(e),
-                "debug_info": debug_info if 'debug_info' in locals() else None
-            }, status=500)
+                "error": "Tu perfil de jugador no tiene coordenadas registradas."
+            }, status=400)
+
+        try:
+            if completo:
+                return self._respuesta_completa(jugador, distancia_max_km, limite)
+            return self._pagina(jugador, distancia_max_km, limite, posicion)
+        except Exception as e:
+            return Response({"error": str(e)}, status=500)
+
+    def _limite(self, request, por_defecto):
+        """`?limite=` hasta LIMITE_MAXIMO; ValueError si no es un entero positivo."""
+        limite = request.query_params.get('limite')
+        if limite is None:
+            return por_defecto
+        limite = int(limite)
+        if limite < 1:
+            raise ValueError(limite)
+        return min(limite, self.LIMITE_MAXIMO)
+
+    def _pagina(self, jugador, distancia_max_km, limite, posicion):
+        lat, lon = jugador.latitud, jugador.longitud
+
+        # Solo las coordenadas de los anuncios en las celdas que cubren el radio
+        filas = np.array(list(
+            AnuncioEquipo.objects.candidatos_partido(lat, lon, distancia_max_km)
+            .exclude(estado_geocodificacion=cola_geocodificacion.PENDIENTE)
+            .values_list('id', 'latitud_partido', 'longitud_partido')
+        ), dtype=np.float64).reshape(-1, 3)
+        ids = filas[:, 0].astype(np.int64)
+        distancias = distancias_km(lat, lon, filas[:, 1], filas[:, 2])
+
+        dentro = distancias <= distancia_max_km
+        total = int(dentro.sum())
+        if posicion:
+            # Orden estable por (distancia, id): se sigue justo después del último devuelto
+            ultima_distancia, ultimo_id = posicion
+            dentro &= (distancias > ultima_distancia) | ((distancias == ultima_distancia) & (ids > ultimo_id))
+
+        # Montículo acotado: solo se mantienen los limite + 1 más cercanos
+        pagina = heapq.nsmallest(limite + 1, zip(distancias[dentro].tolist(), ids[dentro].tolist()))
+        siguiente = None
+        if len(pagina) > limite:
+            pagina = pagina[:limite]
+            siguiente = crear_cursor_distancia(*pagina[-1])
+
+        # Solo se cargan y serializan los anuncios de la página
+        anuncios = AnuncioEquipo.objects.in_bulk([anuncio_id for _, anuncio_id in pagina])
+        anuncios_cercanos = []
+        for distancia, anuncio_id in pagina:
+            anuncio_data = AnuncioEquipoSerializer(anuncios[anuncio_id]).data
+            anuncio_data['distancia'] = round(distancia, 2)
+            anuncios_cercanos.append(anuncio_data)
+
+        return Response({
+            "anuncios_cercanos": anuncios_cercanos,
+            "total": total,
+            "siguiente": siguiente
+        })
+
+    def _respuesta_completa(self, jugador, distancia_max_km, limite):
+        posicion_jugador = (jugador.latitud, jugador.longitud)
+        total_anuncios = AnuncioEquipo.objects.count()
+
+        anuncios = list(AnuncioEquipo.objects.filter(
+            latitud_partido__isnull=False, longitud_partido__isnull=False
+        ).exclude(estado_geocodificacion=cola_geocodificacion.PENDIENTE))
+        anuncios_con_coordenadas = len(anuncios)
+        coordenadas = np.array(
+            [(a.latitud_partido, a.longitud_partido) for a in anuncios], dtype=np.float64
+        ).reshape(-1, 2)
+
+        # Todas las distancias en una sola operación vectorizada
+        distancias = distancias_km(jugador.latitud, jugador.longitud, coordenadas[:, 0], coordenadas[:, 1])
+
+        todos_los_anuncios = []
+        for anuncio, distancia in zip(anuncios, distancias.tolist()):
+            anuncio_data = AnuncioEquipoSerializer(anuncio).data
+            anuncio_data['distancia'] = round(distancia, 2)
+            anuncio_data['posicion_jugador'] = posicion_jugador
+            anuncio_data['posicion_anuncio'] = (anuncio.latitud_partido, anuncio.longitud_partido)
+            todos_los_anuncios.append(anuncio_data)
+
+        # Dentro del radio, de más cerca a más lejos (los `limite` más cercanos si se pide)
+        indices = seleccionar_cercanos(distancias, distancia_max_km, k=limite)
+        anuncios_cercanos = [todos_los_anuncios[i] for i in indices]
+
+        # Información de depuración, solo en la respuesta completa
+        debug_info = {
+            "jugador_id": jugador.id,
+            "jugador_nombre": jugador.nombre,
+            "coordenadas_jugador": {
+                "latitud": jugador.latitud,
+                "longitud": jugador.longitud
+            },
+            "total_anuncios": total_anuncios,
+            "anuncios_con_coordenadas": anuncios_con_coordenadas,
+            "distancia_maxima_km": distancia_max_km,
+            "anuncios_cercanos_encontrados": len(anuncios_cercanos)
+        }
+
+        return Response({
+            "anuncios_cercanos": anuncios_cercanos,
+            "todos_los_anuncios": todos_los_anuncios,
+            "debug_info": debug_info
+        })
 
 class MisEquiposCreadosView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        equipos = Equipo.objects.filter(creador=request.user)
+        equipos = Equipo.objects.filter(creador=request.user).para_serializar()
         serializer = EquipoSerializer(equipos, many=True)
         return Response(serializer.data)
 
@@ -466,10 +670,11 @@ class ChatEquipoViewSet(viewsets.ModelViewSet):
 class MensajeChatEquipoViewSet(viewsets.ModelViewSet):
     serializer_class = MensajeChatEquipoSerializer
     permission_classes = [IsAuthenticated]
-    queryset = MensajeChatEquipo.objects.all().order_by('timestamp')
+    pagination_class = PaginacionMensajes
+    queryset = MensajeChatEquipo.objects.select_related('emisor').order_by('timestamp')
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().filter(chat__in=chats.chats_equipo_de(self.request.user).values('id'))
         chat_id = self.request.query_params.get('chat')
         if chat_id:
             queryset = queryset.filter(chat_id=chat_id)
@@ -477,6 +682,8 @@ class MensajeChatEquipoViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         user = self.request.user
+        if not chats.chats_equipo_de(self.request.user).filter(id=serializer.validated_data['chat'].id).exists():
+            raise PermissionDenied("No puedes escribir en este chat.")
         serializer.save(emisor=user)
 
 class PasswordResetView(APIView):
@@ -534,7 +741,7 @@ class EsAdminOReportante(permissions.BasePermission):
         return obj.reportante == request.user
 
 class ReporteViewSet(viewsets.ModelViewSet):
-    queryset = Reporte.objects.all().order_by('-fecha_creacion')
+    queryset = Reporte.objects.select_related('reportado', 'reportante').order_by('-fecha_creacion')
     serializer_class = ReporteSerializer
     permission_classes = [EsAdminOReportante]
 
@@ -544,5 +751,85 @@ class ReporteViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         user = self.request.user
         if user.is_staff:
-            return Reporte.objects.all().order_by('-fecha_creacion')
-        return Reporte.objects.filter(reportante=user).order_by('-fecha_creacion')
\ No newline at end of file
+            return self.queryset.all()
+        return self.queryset.filter(reportante=user)
+
+class EstadisticasGeocodificacionView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(geocoding.estadisticas())
+
+
+class RecomendacionesView(APIView):
+    """
+    Mejores emparejamientos para un anuncio propio. Con `?anuncio_equipo=<id>`
+    devuelve anuncios de jugador para ese equipo; sin él, anuncios de equipo
+    para el anuncio del jugador. Admite `?n=` (máx. 100) y `?distancia=` en km.
+    """
+    permission_classes = [IsAuthenticated]
+    N_POR_DEFECTO = 10
+    N_MAXIMO = 100
+
+    def get(self, request):
+        try:
+            n = int(request.query_params.get('n', self.N_POR_DEFECTO))
+        except ValueError:
+            n = self.N_POR_DEFECTO
+        n = max(1, min(n, self.N_MAXIMO))
+        distancia = request.query_params.get('distancia')
+        if distancia:
+            try:
+                distancia = float(distancia)
+            except ValueError:
+                return Response({"error": "La distancia debe ser un número."}, status=400)
+
+        anuncio_equipo_id = request.query_params.get('anuncio_equipo')
+        if anuncio_equipo_id:
+            if not anuncio_equipo_id.isdigit():
+                return Response({"error": "anuncio_equipo debe ser el id de un anuncio de equipo."}, status=400)
+            anuncio = get_object_or_404(AnuncioEquipo, id=anuncio_equipo_id)
+            if anuncio.equipo.creador != request.user:
+                raise PermissionDenied("Solo el creador del equipo puede ver sus recomendaciones.")
+            emparejamientos = anuncio.emparejamientos.select_related('anuncio_jugador__jugador').order_by('-puntuacion', 'anuncio_jugador')
+            campo, serializer_class = 'anuncio_jugador', AnuncioJugadorSerializer
+        else:
+            anuncio = get_object_or_404(AnuncioJugador, jugador__user=request.user)
+            emparejamientos = anuncio.emparejamientos.select_related('anuncio_equipo').order_by('-puntuacion', 'anuncio_equipo')
+            campo, serializer_class = 'anuncio_equipo', AnuncioEquipoSerializer
+
+        if distancia:
+            emparejamientos = emparejamientos.filter(distancia__lte=distancia)
+
+        # Una sola consulta sobre el índice (anuncio, -puntuacion) de la tabla de emparejamientos
+        recomendaciones = []
+        for emparejamiento in emparejamientos[:n]:
+            recomendado = getattr(emparejamiento, campo)
+            recomendado.distancia = emparejamiento.distancia
+            recomendaciones.append({
+                'puntuacion': round(emparejamiento.puntuacion, 3),
+                'anuncio': serializer_class(recomendado).data,
+            })
+        return Response({'recomendaciones': recomendaciones})
+
+
+class AnunciosMapaView(APIView):
+    """
+    Anuncios de equipo y de jugador para pintar un mapa. Recibe
+    `?bbox=lon_min,lat_min,lon_max,lat_max` y `?zoom=`; devuelve agrupaciones
+    con su número de anuncios y centroide, o los anuncios sueltos con zoom alto.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            caja = [float(valor) for valor in request.query_params['bbox'].split(',')]
+            zoom = int(request.query_params['zoom'])
+        except (KeyError, ValueError):
+            return Response({"error": "Indica bbox=lon_min,lat_min,lon_max,lat_max y zoom."}, status=400)
+        if len(caja) != 4 or not all(map(math.isfinite, caja)):
+            return Response({"error": "bbox no válido."}, status=400)
+        lon_min, lat_min, lon_max, lat_max = caja
+        if not (-90 <= lat_min <= lat_max <= 90 and -180 <= lon_min <= 180 and -180 <= lon_max <= 180):
+            return Response({"error": "bbox no válido."}, status=400)
+        return Response(mapa.mapa(caja, zoom))